@@ -2,20 +2,13 @@ import Metashape
 import os
 import sys
 import time
-import glob
-import json
-import numpy as np
-import reportlab
-import pandas as pd
 import uuid
 
 import re
 
-# parse the voyisCalibFile
-import glob
-from tqdm import tqdm
-from pqdm.processes import pqdm
-import shutil
+# the shared tie point filter and scale bar code live in the voyis folder next to this script. Metashape runs this file at every
+# start up just to get the menu entry, so numpy, pandas, reportlab and the filter are only imported where they are used
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 
 # Checking compatibility
@@ -25,42 +18,8 @@ if found_major_version != compatible_major_version:
     raise Exception("Incompatible Metashape version: {} != {}".format(found_major_version, compatible_major_version))
 
 
-def find_files(folder, types):
-    return [
-        entry.path
-        for entry in os.scandir(folder)
-        if (entry.is_file() and os.path.splitext(entry.name)[1].lower() in types)
-    ]
-
-
-class ScaleBar:
-    def __init__(self, name, marker_1_name, marker_2_name, ground_truth_distance):
-        self.name = name
-        self.marker_1_name = marker_1_name
-        self.marker_2_name = marker_2_name
-        self.ground_truth_distance = ground_truth_distance
-        self.measured_distance = None
-
-    def error(self):
-        return (
-            self.measured_distance - self.ground_truth_distance
-        )
-
-    def absError(self):
-        return abs(self.measured_distance - self.ground_truth_distance)
-
-    def errorPercent(self):
-        return self.error() / self.ground_truth_distance * 100
-
-
-
-# globally define the scale bars for the bar scan
-ScaleBars = [
-    ScaleBar("Marker 1 to Marker 2", "target 1", "target 2", 6.004),
-    ScaleBar("Marker 3 to Marker 4", "target 3", "target 4", 5.966),
-    ScaleBar("Marker 5 to Marker 6", "target 5", "target 6", 6.155),
-    ScaleBar("Marker 7 to Marker 8", "target 7", "target 8", 5.7895),
-]
+# the first barscan fixture, 4 bars of about 6 m. The bars are in voyis/fixture_data/barscan_v1.csv
+FIXTURE_ID = "barscan_v1"
 
 def getSerialIdFromFolder(folder):
     # get the serial id from the folder path using regex to find the serial id
@@ -91,6 +50,9 @@ class BarScanAnalizer:
         self.passing_error_in_percentage = 0.03
         self.passing_single_measurment_error_percentage = 0.03
 
+        # filled in by detectAndReportScaleBars
+        self.scale_bar_result = None
+
     def save(self):
         self.doc.save(self.output_file)
         self.doc.open(self.output_file)
@@ -99,70 +61,14 @@ class BarScanAnalizer:
 
         print("loading calibration from {}".format(self.calibration_folder))
 
-        self.calibs["left"] = Metashape.Calibration()
-        self.calibs["right"] = Metashape.Calibration()
-
-        self.calibs["left"].load(os.path.join(self.calibration_folder, "{}_cam0.xml".format(self.serial_id)))
-        self.calibs["right"].load(os.path.join(self.calibration_folder, "{}_cam1.xml".format(self.serial_id)))
-
-        self.sensors = dict()
-        self.sensors["left"] = self.chunk.addSensor()
-        self.sensors["right"] = self.chunk.addSensor()
-        self.sensors["left"].label = "left"
-        self.sensors["right"].label = "right"
-        self.sensors["right"].master = self.sensors["left"]
-
-        for sensor in self.sensors.keys():
-            calib = self.calibs[sensor]
-            self.sensors[sensor].width = calib.width
-            self.sensors[sensor].height = calib.height
-            self.sensors[sensor].type = calib.type
-            self.sensors[sensor].user_calib = calib
-            self.sensors[sensor].fixed = True
-
-        # load the stereo calibration offsets
-        with open(
-            os.path.join(os.path.join(self.calibration_folder, "AgisoftSlaveOffsets.json"))
-        ) as f:
-            extrinsics = json.load(f)
-
-            self.sensors["right"].reference.enabled = True
-
-            # you MUST set this.. and its does not match gui and it is not documented at all. Like at all
-            # this is the same as checking "adjust location" in the gui / camera calibration tab under slave offsets
-            # I would like the last 4 hours of my life back please
-            self.sensors["right"].fixed_location = False
-            self.sensors["right"].fixed_rotation = False
-
-            # yes.. you have to set this for the left sensor too. In soviet Russia left sensor moves you. Dont know why. Dont ask why. Just do it.
-            self.sensors["left"].fixed_location = False
-
-            # set the rotation and translation for the right sensor and set accuracy to a high value to be "constant"
-            # In soviet Russia, nothing is fixed! Just solidly attached to the left sensor
-            self.sensors["right"].reference.location = Metashape.Vector(
-                [extrinsics["x"], extrinsics["y"], extrinsics["z"]]
-            )
-            self.sensors["right"].reference.location_accuracy = Metashape.Vector(
-                [1e-5, 1e-5, 1e-5]
-            )
-            self.sensors["right"].reference.location_enabled = True
-
-            # at least this part makes some sense. Had to find it by looking at the python console output. Like a real programmer.
-            self.sensors["right"].reference.rotation = Metashape.Vector(
-                [extrinsics["Omega"], extrinsics["Kappa"], extrinsics["Phi"]]
-            )
-            self.sensors["right"].reference.rotation_accuracy = Metashape.Vector(
-                [1e-5, 1e-5, 1e-5]
-            )
-            self.sensors["right"].reference.rotation_enabled = True
-
-            self.sensors["right"].location = Metashape.Vector(
-                [extrinsics["x"], extrinsics["y"], extrinsics["z"]]
-            )
-            self.sensors["right"].rotation = Metashape.Matrix(
-                [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0, 0, 1.0]]
-            )
-            
+        # parsed once and then taken from the local cache while the files do not change, same as the v2 barscan
+        from voyis.calibration import loadCalibrationBundle, setupStereoSensors
+
+        bundle = loadCalibrationBundle(self.calibration_folder, self.serial_id)
+        self.calibs["left"] = bundle.metashapeCalibration("left")
+        self.calibs["right"] = bundle.metashapeCalibration("right")
+        self.sensors = setupStereoSensors(self.chunk, bundle, offset_accuracy=1e-5)
+
     def getFiles(self):
 
         # check to see if the folder / shortcut exists
@@ -171,19 +77,24 @@ class BarScanAnalizer:
 
         print("loading images from {}".format(self.image_folder))
 
-        # recursively search for all images in the folder
-        images = glob.glob("{}/**/*.jpg".format(os.path.normpath(self.image_folder)), recursive=True)
-        images.extend(glob.glob("{}/**/*.jpeg".format(os.path.normpath(self.image_folder)), recursive=True))
+        # recursively search for all images in the folder, one scandir walk that skips our own output folders
+        from voyis.discovery import discoverImages
+        from voyis.pairing import assignSensors, pairImages
+
+        images = [os.path.join(self.image_folder, entry[0]) for entry in discoverImages(self.image_folder)]
 
+        # now associate the images into right and left pairs by the sequence number after CAL_ in the file name.
+        # example: image_left_processed_SYSTEM_2023-11-08T153950.040882_CAL_11820.jpg
+        # Images without a partner are left out and reported, a dropped frame would otherwise shift every pair after it
+        self.pairing = pairImages(images)
+        self.pairing.printSummary()
+        if len(self.pairing.pairs) == 0:
+            raise Exception("No stereo pairs found in {}".format(self.image_folder))
 
-        # now associate the images into right and left pairs. Order is left, right, left, right, etc. This is done by looking at the last part of the filename which contains the sequence number
-        # example: image_left_processed_SYSTEM_2023-11-08T153950.040882_CAL_11820.jpg. The value after CAL_ is the sequence number
-        sorted_images = sorted(
-            images, key=lambda x: os.path.basename(x).split("_")[-1])
-        print(sorted_images)
+        sorted_images = self.pairing.images()
 
         # create a list of filegroups. This is a list of integers that defines the multi-camera system groups. Basically it tells metashape that the first 2 images are a group, the next 2 are a group, etc.
-        filegroups = [2] * (len(sorted_images) // 2)
+        filegroups = self.pairing.filegroups()
 
         # images is alternating list of left and right paths
         self.chunk.addPhotos(
@@ -194,14 +105,12 @@ class BarScanAnalizer:
         )
 
         # a sensor is what we call a camera, and a camera in metashape is a "Pose" in the VSLAM world. So we need to assign the sensor to each "keyframe or camera" in the chunk
-        for cam in self.chunk.cameras:
-            base = os.path.basename(cam.photo.path)
-            # if basename has "left in it assign to left grouping with sensor
-            # else assign to right grouping with sensor
-            if "left" in base:
-                cam.sensor = self.sensors["left"]
-            else:
-                cam.sensor = self.sensors["right"]
+        # the role of every image is already known from pairing, so this is a lookup per camera
+        unassigned = assignSensors(self.chunk.cameras, self.sensors, self.pairing.sensorIndex())
+        if len(unassigned) > 0:
+            for cam in unassigned:
+                print("no sensor for {}".format(cam.photo.path))
+            raise Exception("{} cameras could not be assigned a sensor".format(len(unassigned)))
 
     # the first part of making a model is to align the cameras and make a sparse point cloud
     def align(self):
@@ -222,67 +131,11 @@ class BarScanAnalizer:
         # self.doc.open(self.output_file)
         self.doc.open(os.path.join(file))
 
-    def optimize_cameras(self, chunk, calcVariance=False):
-        chunk.optimizeCameras(
-            fit_f=False,
-            fit_cx=False,
-            fit_cy=False,
-            fit_b1=False,
-            fit_b2=False,
-            fit_k1=False,
-            fit_k2=False,
-            fit_k3=False,
-            fit_k4=False,
-            fit_p1=False,
-            fit_p2=False,
-            fit_corrections=False,
-            adaptive_fitting=False,
-            tiepoint_covariance=calcVariance,
-        )
-
     def filterBadPoints(self):
-        print("filtering points with only 2 observations")
-        # remove points with less than 3 observations
         chunk = self.doc.chunks[0]
-        # filter out bad points by removing points that only have 2 or less observations
-        f = Metashape.TiePoints.Filter()
-        img_count = 2
-        f.init(chunk, criterion=Metashape.TiePoints.Filter.ImageCount)
-        f.selectPoints(img_count)
-        f.removePoints(img_count)
-
-        self.optimize_cameras(chunk)
-
-        #remove points with high reconstruction uncertainty
-        print("filtering points with high reconstruction uncertainty")
-
-        for reconstruction_uncertainty in range(100, 20, -20):
-            f = Metashape.TiePoints.Filter()
-            f.init(
-                chunk,
-                criterion=Metashape.TiePoints.Filter.ReconstructionUncertainty,
-            )
-            f.removePoints(reconstruction_uncertainty)
-            self.optimize_cameras(chunk)
-
-        # remove points with low projection Accuracy
-        print("filtering with low projection uncertainty")
-        for projection_accuracy in range(90, 20, -20):
-            f = Metashape.TiePoints.Filter()
-            f.init(chunk, criterion=Metashape.TiePoints.Filter.ProjectionAccuracy)
-            f.removePoints(projection_accuracy)
-            self.optimize_cameras(chunk)
-
-        # remove points with high reprojection error 
-        print("filtering points with high reprojection error")
-        for reprojection_error in np.arange(1.2, 0.5, -0.2):
-            f = Metashape.TiePoints.Filter()
-            f.init(chunk, criterion=Metashape.TiePoints.Filter.ReprojectionError)
-            f.removePoints(reprojection_error)
-            self.optimize_cameras(chunk)
-
-        # one last calc with the variance for saving
-        self.optimize_cameras(chunk, calcVariance=True)
+        from voyis.tiepoints import TiePointFilter, barscanSchedule
+
+        TiePointFilter(chunk, barscanSchedule()).run()
 
 
     '''generate a report of the scale bar measurments'''
@@ -290,8 +143,6 @@ class BarScanAnalizer:
         from reportlab.lib.pagesizes import letter
         from reportlab.pdfgen import canvas
 
-        has_passed = True
-
         # make output folder if it does not exist
         os.makedirs(self.output_folder, exist_ok=True)
 
@@ -316,18 +167,8 @@ class BarScanAnalizer:
             ]
         ]
 
-        for scale_bar in ScaleBars:
-            measurment_table.append(
-                [
-                    scale_bar.name,
-                    "{:.4f}".format(scale_bar.ground_truth_distance),
-                    "{:.4f}".format(scale_bar.measured_distance),
-                    "{:.2f}".format(scale_bar.error() * 1000),
-                    "{:.3f}".format(scale_bar.errorPercent()),
-                    # fail if over 0.5 mm / meter of the ground truth distance. This is a 0.05% error 
-                    "Pass" if abs(scale_bar.errorPercent()) < self.passing_single_measurment_error_percentage else "Fail",
-                ]
-            )
+        result = self.scale_bar_result
+        measurment_table.extend(result.rows())
 
         from reportlab.platypus import Table, TableStyle
 
@@ -365,12 +206,9 @@ class BarScanAnalizer:
         # Draw the table at the calculated position
         table.drawOn(c, start_x, start_y)
 
-        # summarize the results as Root Mean square error
-        rms = np.sqrt(
-            np.mean([(scale_bar.errorPercent()/100) ** 2 for scale_bar in ScaleBars]))
-        
-        # check if the rms error is less than the passing error
-        has_passed = rms * 100 < self.passing_error_in_percentage
+        # the rms and pass / fail were worked out once when the bars were measured
+        rms = result.rms_error_percentage / 100
+        has_passed = result.has_passed
         
         start_y = start_y - 20
         c.setFont("Helvetica-Bold", 12)
@@ -391,38 +229,14 @@ class BarScanAnalizer:
         return has_passed
 
     def detectAndReportScaleBars(self):
+        from voyis.fixtures import getFixture
+        from voyis.scalebars import ScaleBarResult, measureScaleBars
+
+        scale_bars = getFixture(FIXTURE_ID).scale_bars
         for chunk in self.doc.chunks:
-            # detect markers
-            chunk.detectMarkers(
-                target_type=Metashape.CircularTarget12bit,
-                tolerance=15,
-                filter_mask=False,
-                inverted=False,
-            )
-
-            chunk.refineMarkers()
-
-            # get the list of markers
-            markers = chunk.markers
-            marker_dict = dict()
-
-            # make a dict with the marker names
-            for marker in markers:
-                marker_dict[marker.label] = marker
-
-            # take all the measurements
-            for scale_bar in ScaleBars:
-                marker_1 = marker_dict[scale_bar.marker_1_name]
-                marker_2 = marker_dict[scale_bar.marker_2_name]
-                bar = chunk.addScalebar(marker_1, marker_2)
-
-                # YOU NEED TO SCALE YOUR MEASUREMENTS BY THE CHUNK SCALE TO GET THE REAL WORLD MEASUREMENTS
-                # In soviet Russia, the chunk scale scales you
-                # This is where 3.5 hours of Stan's time went to die
-                dist = (
-                    marker_1.position - marker_2.position
-                ).norm() * chunk.transform.scale
-                scale_bar.measured_distance = dist
+            distances = measureScaleBars(chunk, scale_bars)
+            self.scale_bar_result = ScaleBarResult(
+                scale_bars, distances, self.passing_error_in_percentage, self.passing_single_measurment_error_percentage)
 
         # report the results
         return self.generateReport()
@@ -448,6 +262,8 @@ class BarScanAnalizer:
 
     # dead code dont look
     def estimateImageQuality(self):
+        import pandas as pd
+
         self.chunk.analyzeImages()
        
         # create  pandas dataframe to hold the image quality stats
@@ -1,4 +1,10 @@
 import Metashape
+import os
+import sys
+
+# the shared voyis helpers live in the folder next to this script. They pull in numpy,
+# so they are only imported when a menu entry is used, not at Metashape start up
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 # Checking compatibility
 compatible_major_version = "2.1"
@@ -8,74 +14,39 @@ if found_major_version != compatible_major_version:
 
 
 class TiePointCleaner():
-    def __init__(self, chunk):
+    def __init__(self, chunk, profiler=None):
+        from voyis.profiling import StageProfiler
+
         self.chunk = chunk
-    
-    def optimize_cameras(self, chunk, calcVariance=False, adaptive_fitting=False):
-        chunk.optimizeCameras(
-            fit_f=True,
-            fit_cx=True,
-            fit_cy=True,
-            fit_b1=False,
-            fit_b2=False,
-            fit_k1=False,
-            fit_k2=False,
-            fit_k3=False,
-            fit_k4=False,
-            fit_p1=True,
-            fit_p2=True,
-            fit_corrections=False,
-            adaptive_fitting=adaptive_fitting,
-            tiepoint_covariance=calcVariance,
-    )
+        self.profiler = profiler if profiler is not None else StageProfiler()
 
     def filterBadPoints(self, 
                         img_count=2, 
                         max_reconstruction_uncertainty=35, 
                         min_projection_accuracy=15, 
                         min_reprojection_error=0.4):
-        
-        print("filtering points with less then {} observations".format(img_count))
-        # remove points with less than 3 observations
-        chunk = self.chunk
-        # filter out bad points by removing points that only have 2 or less observations
-        f = Metashape.TiePoints.Filter()
-        f.init(chunk, criterion=Metashape.TiePoints.Filter.ImageCount)
-        f.selectPoints(img_count)
-        f.removePoints(img_count)
-
-        self.optimize_cameras(chunk, adaptive_fitting=False)
-
-        #remove points with high reconstruction uncertainty
-        print("filtering points with high reconstruction uncertainty higher then {}".format(max_reconstruction_uncertainty))
-
-        for reconstruction_uncertainty in range(100, max_reconstruction_uncertainty, -10):
-            f = Metashape.TiePoints.Filter()
-            f.init(
-                chunk,
-                criterion=Metashape.TiePoints.Filter.ReconstructionUncertainty,
-            )
-            f.removePoints(reconstruction_uncertainty)
-            self.optimize_cameras(chunk)
-
-        # remove points with low projection Accuracyy
-        print("filtering with projection uncertainty higher then {}".format(min_projection_accuracy))
-        for projection_accuracy in range(90, min_projection_accuracy, -10):
-            f = Metashape.TiePoints.Filter()
-            f.init(chunk, criterion=Metashape.TiePoints.Filter.ProjectionAccuracy)
-            f.removePoints(projection_accuracy)
-            self.optimize_cameras(chunk)
-
-        print("filtering points with reprojection error higher then {}".format(min_reprojection_error))
-        for reprojection_error_int in range(12, min_reprojection_error * 10, -1):
-            f = Metashape.TiePoints.Filter()
-            f.init(chunk, criterion=Metashape.TiePoints.Filter.ReprojectionError)
-            reprojection_error = float(reprojection_error_int) / 10
-            f.removePoints(reprojection_error)
-            self.optimize_cameras(chunk)
-
-        # one last calc with the variance for saving
-        self.optimize_cameras(chunk, calcVariance=True, adaptive_fitting=False)
+        from voyis.tiepoints import TiePointFilter, cleanerSchedule
+
+        schedule = cleanerSchedule(img_count, max_reconstruction_uncertainty, min_projection_accuracy, min_reprojection_error)
+        TiePointFilter(self.chunk, schedule, self.profiler).run()
+
+    def filterBadPointsAdaptive(self,
+                                img_count=2,
+                                max_reconstruction_uncertainty=35,
+                                min_projection_accuracy=15,
+                                min_reprojection_error=0.4,
+                                max_removal_percent=10,
+                                min_removed_points=10,
+                                rms_tolerance=0.001,
+                                max_passes=10):
+        '''ends at the last thresholds filterBadPoints applies for the same arguments, but every pass picks its threshold from the current values
+        and removes at most max_removal_percent of the points. A criterion stops as soon as its end threshold
+        is reached, fewer than min_removed_points would go or the rms reprojection error stops changing.'''
+        from voyis.tiepoints import TiePointFilter, adaptiveCleanerSchedule
+
+        schedule = adaptiveCleanerSchedule(img_count, max_reconstruction_uncertainty, min_projection_accuracy, min_reprojection_error,
+                                           max_removal_percent, min_removed_points, rms_tolerance, max_passes)
+        TiePointFilter(self.chunk, schedule, self.profiler).run()
 
     # def filterImageQuality(self, threshold=0.5):
     #     self.chunk.analyzeImages()
@@ -99,9 +70,25 @@ def cleanTiePoints():
     
     cleaner = TiePointCleaner(chunk)
     cleaner.filterBadPoints()
+    cleaner.profiler.printSummary()
+    print("Tie points cleaned")
+    return True
+
+
+def cleanTiePointsAdaptive():
+    chunk = Metashape.app.document.chunk
+    if chunk is None:
+        raise Exception("Empty project!")
+
+    cleaner = TiePointCleaner(chunk)
+    cleaner.filterBadPointsAdaptive()
+    cleaner.profiler.printSummary()
     print("Tie points cleaned")
     return True
 
 
 label = "Voyis/Filter Tie Points"
-Metashape.app.addMenuItem(label, cleanTiePoints)
\ No newline at end of file
+Metashape.app.addMenuItem(label, cleanTiePoints)
+
+label = "Voyis/Filter Tie Points (Adaptive)"
+Metashape.app.addMenuItem(label, cleanTiePointsAdaptive)
\ No newline at end of file
@@ -0,0 +1,88 @@
+# Aligns a synthetic unit whose right camera is rotated in its mount (non zero Omega / Phi / Kappa) against the fake
+# Metashape, puts a share of the right cameras off the rig, and runs the stereo baseline check on it. Reports how many
+# of the broken pairs were caught, how many other pairs were flagged, and whether the pairs were reset or the check
+# refused to because too many were off. A share above the reset cap must not reset anything.
+# The --rig-errors cases have alignment put the right sensor off its calibrated rotation instead, the rig moved since
+# it was calibrated. Every pair follows the sensor, so every pair must be flagged and none reset.
+#
+# usage: python benchmarks/baseline_benchmark.py [--frames 200] [--fractions 0 0.05 0.5] [--rig-errors 1.0]
+#                                                [--omega 1.5 --phi -0.8 --kappa 2.5]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import contextlib
+
+import synthetic
+
+import Metashape
+
+from voyis.baseline import BaselineCheck
+from voyis.calibration import loadCalibrationBundle, loadStereoCalibration
+from voyis.pairing import pairImages
+
+
+def runCheck(calibration_folder, frames, fraction, rig_error):
+    synthetic.configureFake(tie_points=1000)
+    Metashape.fake.misaligned_pair_fraction = fraction
+    Metashape.fake.sensor_rotation_error_deg = rig_error
+
+    doc = Metashape.Document()
+    chunk = doc.addChunk()
+    paths = [os.path.join("synthetic", synthetic.imageName(role, 10000 + index))
+             for index in range(frames) for role in ["left", "right"]]
+    chunk.addPhotos(paths)
+    loadStereoCalibration(calibration_folder, chunk)
+    chunk.matchPhotos()
+    chunk.alignCameras()
+
+    check = BaselineCheck(chunk, pairImages(paths), loadCalibrationBundle(calibration_folder).extrinsics)
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        summary = check.run()
+    seconds = time.perf_counter() - start
+
+    flagged = set(int(sequence) for sequence in summary["outliers"])
+    return {
+        "fraction": fraction,
+        "rig_error": rig_error,
+        "pairs": summary["pairs"],
+        "misaligned": len(chunk.fake_misaligned),
+        "caught": len(flagged & chunk.fake_misaligned),
+        "other_flagged": len(flagged - chunk.fake_misaligned),
+        "reset": summary["reset"],
+        "median_rotation_deg": summary["median_rotation_deg"],
+        "rig_rotation_deg": summary["rig_rotation_deg"],
+        "ms": seconds * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="The stereo baseline check on a rig with a rotated right camera")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--fractions", type=float, nargs="+", default=[0.0, 0.05, 0.5], help="shares of pairs put off the rig")
+    parser.add_argument("--rig-errors", type=float, nargs="+", default=[1.0], help="degrees the aligned right sensor is off its calibration")
+    parser.add_argument("--omega", type=float, default=1.5)
+    parser.add_argument("--phi", type=float, default=-0.8)
+    parser.add_argument("--kappa", type=float, default=2.5)
+    args = parser.parse_args(argv)
+
+    offsets = dict(synthetic.SLAVE_OFFSETS, Omega=args.omega, Phi=args.phi, Kappa=args.kappa)
+    with tempfile.TemporaryDirectory() as root:
+        os.environ["VOYIS_CALIBRATION_CACHE"] = os.path.join(root, "calibration_cache")
+        calibration_folder = synthetic.makeCalibrationFolder(os.path.join(root, "AgisoftParams"), offsets=offsets)
+
+        print("right camera at omega {} phi {} kappa {}".format(args.omega, args.phi, args.kappa))
+        print("{:>9} {:>10} {:>6} {:>11} {:>7} {:>14} {:>6} {:>13} {:>10} {:>8}".format(
+            "fraction", "rig [deg]", "pairs", "misaligned", "caught", "other flagged", "reset", "median [deg]", "rig off", "ms"))
+        cases = [(fraction, 0.0) for fraction in args.fractions] + [(0.0, rig_error) for rig_error in args.rig_errors]
+        for fraction, rig_error in cases:
+            result = runCheck(calibration_folder, args.frames, fraction, rig_error)
+            print("{fraction:>9.2f} {rig_error:>10.2f} {pairs:>6} {misaligned:>11} {caught:>7} {other_flagged:>14} {reset!s:>6} "
+                  "{median_rotation_deg:>13.3f} {rig_rotation_deg:>10.3f} {ms:>8.1f}".format(**result))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,66 @@
+# Times finding and pairing the images of a verification folder: the old recursive glob, one scandir walk (with a
+# stat of every image and the manifest write, the glob does neither), and a
+# rerun that reuses the image manifest. The folder is synthetic and lives in a temp dir unless --folder is given.
+#
+# usage: python benchmarks/discovery_benchmark.py [--frames 5000] [--sub-folders 20] [--extra-files 50]
+
+import os
+import sys
+import glob
+import time
+import argparse
+import tempfile
+
+import synthetic
+
+from voyis.discovery import discoverImages
+from voyis.pairing import pairImages
+
+
+def globImages(folder):
+    # what the scripts did before the discovery module
+    images = glob.glob(os.path.join(folder, "**", "*.jpg"), recursive=True)
+    if len(images) == 0:
+        images = glob.glob(os.path.join(folder, "**", "*.tif"), recursive=True)
+    return sorted(images)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Image discovery and pairing on a synthetic verification folder")
+    parser.add_argument("--frames", type=int, default=5000)
+    parser.add_argument("--sub-folders", type=int, default=20)
+    parser.add_argument("--extra-files", type=int, default=50)
+    parser.add_argument("--folder", default=None, help="where to build the synthetic folder, a temp dir by default")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.folder) as root:
+        folder = synthetic.makeStillsFolder(root, frames=args.frames, sub_folders=args.sub_folders, extra_files=args.extra_files)
+        manifest_file = os.path.join(root, "images.json")
+
+        rows = []
+        seconds, images = timed(globImages, folder)
+        rows.append(["recursive glob", seconds, len(images)])
+
+        seconds, entries = timed(discoverImages, folder, manifest_file)
+        rows.append(["scandir walk", seconds, len(entries)])
+
+        seconds, entries = timed(discoverImages, folder, manifest_file)
+        rows.append(["manifest reuse", seconds, len(entries)])
+
+        paths = [os.path.join(folder, entry[0]) for entry in entries]
+        seconds, pairing = timed(pairImages, paths)
+        rows.append(["pairing", seconds, len(pairing.pairs)])
+
+    print("{:<16} {:>10} {:>8}".format("step", "time [ms]", "found"))
+    for name, seconds, count in rows:
+        print("{:<16} {:>10.1f} {:>8}".format(name, seconds * 1000, count))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,691 @@
+# Stand-in for the Metashape module so the scripts can be run and profiled on a machine without Metashape.
+#
+# It implements the parts of the API these scripts touch, backed by a synthetic tie point cloud. Sizes and the
+# simulated cost of the expensive calls are set on Metashape.fake, e.g.
+#
+#     import Metashape
+#     Metashape.fake.tie_points = 200000
+#     Metashape.fake.optimize_cost_per_point = 2e-6
+#
+# Nothing here is accurate photogrammetry. Numbers move in the right direction (filtering lowers the
+# reprojection error, optimizing takes longer on bigger clouds) so schedules and pipelines can be compared.
+
+import os
+import re
+import math
+import time
+import zlib
+import pickle
+import struct
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+
+
+class FakeConfig:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seed = 0
+        # tie points created by alignCameras
+        self.tie_points = 20000
+        # seconds optimizeCameras sleeps per valid tie point, and matchPhotos per matched image pair
+        self.optimize_cost_per_point = 0.0
+        self.match_cost_per_pair = 0.0
+        # seconds TiePoints.Filter.init takes per tie point to work out the criterion
+        self.filter_init_cost_per_point = 0.0
+        # how far apart two frames may be and still get matched when matching is left to preselection
+        self.match_window = 10
+        # marker label -> true position in meters. detectMarkers finds these, with noise that shrinks with the
+        # rms reprojection error of the cloud
+        self.targets = dict()
+        self.marker_noise = 0.0005
+        # share of stereo pairs whose right camera is put somewhere the rig geometry does not allow
+        self.misaligned_pair_fraction = 0.0
+        # degrees about z alignment puts a free slave sensor off its reference rotation, a rig that moved since calibration
+        self.sensor_rotation_error_deg = 0.0
+        # image quality handed out by analyzeImages, path -> quality
+        self.image_quality = dict()
+
+
+fake = FakeConfig()
+
+
+# constants the scripts pass around
+MultiplaneLayout = "MultiplaneLayout"
+CircularTarget12bit = "CircularTarget12bit"
+TiePointsData = "TiePointsData"
+DepthMapsData = "DepthMapsData"
+MildFiltering = "MildFiltering"
+
+
+class ReferencePreselectionMode:
+    ReferencePreselectionSource = "ReferencePreselectionSource"
+    ReferencePreselectionEstimated = "ReferencePreselectionEstimated"
+    ReferencePreselectionSequential = "ReferencePreselectionSequential"
+
+
+class Vector:
+    def __init__(self, values):
+        self.values = [float(v) for v in values]
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def size(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __setitem__(self, index, value):
+        self.values[index] = float(value)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __add__(self, other):
+        return Vector([a + b for a, b in zip(self.values, other)])
+
+    def __sub__(self, other):
+        return Vector([a - b for a, b in zip(self.values, other)])
+
+    def __mul__(self, scalar):
+        return Vector([a * scalar for a in self.values])
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        return isinstance(other, Vector) and self.values == other.values
+
+    def norm(self):
+        return math.sqrt(sum(a * a for a in self.values))
+
+    def normalized(self):
+        return self * (1.0 / self.norm())
+
+    def list(self):
+        return list(self.values)
+
+    @property
+    def x(self):
+        return self.values[0]
+
+    @property
+    def y(self):
+        return self.values[1]
+
+    @property
+    def z(self):
+        return self.values[2]
+
+    def __repr__(self):
+        return "Vector({})".format(self.values)
+
+
+def rotationZYX(first, second, third):
+    # degrees, R = Rz(first) Ry(second) Rx(third)
+    a, b, c = np.radians([first, second, third])
+    rz = np.array([[np.cos(a), -np.sin(a), 0], [np.sin(a), np.cos(a), 0], [0, 0, 1]])
+    ry = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
+    rx = np.array([[1, 0, 0], [0, np.cos(c), -np.sin(c)], [0, np.sin(c), np.cos(c)]])
+    return rz @ ry @ rx
+
+
+class Matrix:
+    def __init__(self, rows):
+        self.array = np.array([[float(v) for v in row] for row in rows])
+
+    @staticmethod
+    def fromArray(array):
+        matrix = Matrix([[0.0]])
+        matrix.array = np.array(array, dtype=float)
+        return matrix
+
+    @staticmethod
+    def Diag(values):
+        return Matrix.fromArray(np.diag(list(values)))
+
+    @staticmethod
+    def Translation(vector):
+        array = np.eye(4)
+        array[:3, 3] = list(vector)
+        return Matrix.fromArray(array)
+
+    @property
+    def size(self):
+        return self.array.shape
+
+    def __getitem__(self, index):
+        if isinstance(index, tuple):
+            return float(self.array[index])
+        return Vector(self.array[index])
+
+    def __mul__(self, other):
+        if isinstance(other, Matrix):
+            return Matrix.fromArray(self.array @ other.array)
+        if isinstance(other, Vector):
+            values = np.array(other.values)
+            if len(values) == self.array.shape[1] - 1:
+                # homogeneous transform of a point
+                return Vector((self.array @ np.append(values, 1.0))[:-1])
+            return Vector(self.array @ values)
+        return Matrix.fromArray(self.array * other)
+
+    def mulp(self, vector):
+        return Vector((self.array @ np.append(list(vector), 1.0))[:3])
+
+    def mulv(self, vector):
+        return Vector(self.array[:3, :3] @ np.array(list(vector)))
+
+    def inv(self):
+        return Matrix.fromArray(np.linalg.inv(self.array))
+
+    def t(self):
+        return Matrix.fromArray(self.array.T)
+
+    def translation(self):
+        return Vector(self.array[:3, 3])
+
+    def rotation(self):
+        return Matrix.fromArray(self.array[:3, :3])
+
+    def __repr__(self):
+        return "Matrix({})".format(self.array.tolist())
+
+
+class Application:
+    version = "2.1.0"
+
+    def __init__(self):
+        self.menu_items = dict()
+        self.document = Document()
+
+    def addMenuItem(self, label, function):
+        self.menu_items[label] = function
+
+    def getExistingDirectory(self, hint=""):
+        raise Exception("No dialogs without Metashape: {}".format(hint))
+
+
+class Calibration:
+    FIELDS = ["f", "cx", "cy", "b1", "b2", "k1", "k2", "k3", "k4", "p1", "p2", "p3", "p4"]
+
+    def __init__(self):
+        self.type = Sensor.Type.Frame
+        self.width = 0
+        self.height = 0
+        for field in Calibration.FIELDS:
+            setattr(self, field, 0.0)
+
+    def load(self, path, format=None):
+        # the agisoft calibration xml: <calibration><projection>frame</projection><width>..</width>...
+        root = ElementTree.parse(path).getroot()
+        projection = root.findtext("projection", "frame")
+        self.type = {
+            "frame": Sensor.Type.Frame,
+            "fisheye": Sensor.Type.Fisheye,
+            "spherical": Sensor.Type.Spherical,
+            "cylindrical": Sensor.Type.Cylindrical,
+        }[projection]
+        self.width = int(root.findtext("width"))
+        self.height = int(root.findtext("height"))
+        for field in Calibration.FIELDS:
+            setattr(self, field, float(root.findtext(field, "0")))
+
+
+class Reference:
+    def __init__(self):
+        self.enabled = False
+        self.location = None
+        self.location_accuracy = None
+        self.location_enabled = False
+        self.rotation = None
+        self.rotation_accuracy = None
+        self.rotation_enabled = False
+
+
+class Sensor:
+    class Type:
+        Frame = "Frame"
+        Fisheye = "Fisheye"
+        Spherical = "Spherical"
+        Cylindrical = "Cylindrical"
+
+    def __init__(self, key):
+        self.key = key
+        self.label = "sensor {}".format(key)
+        self.master = self
+        self.width = 0
+        self.height = 0
+        self.type = Sensor.Type.Frame
+        self.user_calib = None
+        self.calibration = Calibration()
+        self.fixed = False
+        self.fixed_location = True
+        self.fixed_rotation = True
+        self.reference = Reference()
+        self.location = None
+        self.rotation = None
+
+
+class Photo:
+    def __init__(self, path):
+        self.path = path
+        self.meta = dict()
+
+
+class Camera:
+    def __init__(self, key, path, sensor):
+        self.key = key
+        self.label = os.path.splitext(os.path.basename(path))[0]
+        self.photo = Photo(path)
+        self.sensor = sensor
+        self.transform = None
+        self.enabled = True
+        self.meta = dict()
+        self.frames = [self]
+        self.master = self
+
+
+class Marker:
+    def __init__(self, key, label):
+        self.key = key
+        self.label = label
+        self.position = None
+        self.reference = Reference()
+        self.projections = dict()
+
+
+class ScalebarReference:
+    def __init__(self):
+        self.distance = None
+        self.accuracy = None
+        self.enabled = True
+
+
+class Scalebar:
+    def __init__(self, key, point0, point1):
+        self.key = key
+        self.point0 = point0
+        self.point1 = point1
+        self.label = "{}_{}".format(point0.label, point1.label)
+        self.reference = ScalebarReference()
+
+
+class ChunkTransform:
+    def __init__(self):
+        self.scale = 1.0
+        self.matrix = Matrix.fromArray(np.eye(4))
+        self.rotation = Matrix.fromArray(np.eye(3))
+        self.translation = Vector([0, 0, 0])
+
+
+class Projection:
+    def __init__(self, coord, track_id, size):
+        self.coord = coord
+        self.track_id = track_id
+        self.size = size
+
+
+class TiePoint:
+    # a view on one row of the cloud, like the real API hands out
+    def __init__(self, cloud, index):
+        self.cloud = cloud
+        self.index = index
+
+    @property
+    def coord(self):
+        return Vector(np.append(self.cloud.coords[self.index], 1.0))
+
+    @property
+    def valid(self):
+        return bool(self.cloud.valid[self.index])
+
+    @valid.setter
+    def valid(self, value):
+        self.cloud.valid[self.index] = bool(value)
+
+    @property
+    def track_id(self):
+        return self.index
+
+    @property
+    def selected(self):
+        return bool(self.cloud.selected[self.index])
+
+    @selected.setter
+    def selected(self, value):
+        self.cloud.selected[self.index] = bool(value)
+
+
+class TiePointList:
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def __len__(self):
+        return len(self.cloud.valid)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        return TiePoint(self.cloud, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield TiePoint(self.cloud, index)
+
+
+class ProjectionLookup:
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def __getitem__(self, camera):
+        return self.cloud.projectionsOf(camera)
+
+
+class TiePoints:
+    class Filter:
+        ReprojectionError = "ReprojectionError"
+        ReconstructionUncertainty = "ReconstructionUncertainty"
+        ImageCount = "ImageCount"
+        ProjectionAccuracy = "ProjectionAccuracy"
+
+        def __init__(self):
+            self.chunk = None
+            self.criterion = None
+            self.values = None
+
+        def init(self, chunk, criterion):
+            self.chunk = chunk
+            self.criterion = criterion
+            self.values = chunk.tie_points.criterionValues(criterion)
+            time.sleep(fake.filter_init_cost_per_point * len(self.values))
+
+        def tooBad(self, threshold):
+            # values can be set from a script, the real API takes a plain list
+            self.values = np.asarray(self.values, dtype=float)
+            if self.criterion == TiePoints.Filter.ImageCount:
+                # image count removes points seen by threshold images or fewer
+                return self.values <= threshold
+            return self.values > threshold
+
+        def selectPoints(self, threshold):
+            self.chunk.tie_points.selected = self.tooBad(threshold) & self.chunk.tie_points.valid
+
+        def removePoints(self, threshold):
+            cloud = self.chunk.tie_points
+            cloud.valid &= ~self.tooBad(threshold)
+
+    def __init__(self, count, cameras, width, height, rng):
+        self.cameras = cameras
+        self.width = width
+        self.height = height
+        self.camera_index = {camera.key: index for index, camera in enumerate(cameras)}
+
+        self.coords = rng.normal(0.0, 2.0, size=(count, 3))
+        self.valid = np.ones(count, dtype=bool)
+        self.selected = np.zeros(count, dtype=bool)
+
+        # every point is seen by image_count consecutive cameras, starting at first_camera
+        self.image_count = np.minimum(rng.geometric(0.35, size=count) + 1, max(2, len(cameras)))
+        self.first_camera = rng.integers(0, max(1, len(cameras)), size=count)
+        self.pixel = rng.uniform(0.0, 1.0, size=(count, 2)) * [width, height]
+        self.size = rng.uniform(2.0, 12.0, size=count)
+
+        # the criteria, higher is worse for all but image count
+        self.reprojection_error = np.abs(rng.normal(0.0, 0.45, size=count)) + rng.exponential(0.05, size=count)
+        self.reconstruction_uncertainty = rng.lognormal(3.2, 0.7, size=count)
+        self.projection_accuracy = rng.lognormal(2.8, 0.6, size=count)
+
+    @property
+    def points(self):
+        return TiePointList(self)
+
+    @property
+    def projections(self):
+        return ProjectionLookup(self)
+
+    def criterionValues(self, criterion):
+        values = {
+            TiePoints.Filter.ReprojectionError: self.reprojection_error,
+            TiePoints.Filter.ReconstructionUncertainty: self.reconstruction_uncertainty,
+            TiePoints.Filter.ImageCount: self.image_count.astype(float),
+            TiePoints.Filter.ProjectionAccuracy: self.projection_accuracy,
+        }[criterion]
+        return values.copy()
+
+    def observedBy(self, camera):
+        index = self.camera_index[camera.key]
+        offset = (index - self.first_camera) % max(1, len(self.cameras))
+        return np.flatnonzero(self.valid & (offset < self.image_count))
+
+    def projectionsOf(self, camera):
+        index = self.camera_index[camera.key]
+        projections = []
+        for track_id in self.observedBy(camera):
+            # every camera sees the point at a slightly different pixel
+            x = (self.pixel[track_id, 0] + index * 7.0) % self.width
+            y = (self.pixel[track_id, 1] + index * 3.0) % self.height
+            projections.append(Projection(Vector([x, y]), int(track_id), float(self.size[track_id])))
+        return projections
+
+    def rmsReprojectionError(self):
+        errors = self.reprojection_error[self.valid]
+        return float(np.sqrt(np.mean(errors ** 2))) if len(errors) > 0 else 0.0
+
+
+class Image:
+    def __init__(self, width=64, height=64):
+        self.width = width
+        self.height = height
+
+    def save(self, path):
+        # a real (grey gradient) png so anything that embeds it can read it
+        rows = b"".join(b"\x00" + bytes((x + y) % 256 for x in range(self.width)) for y in range(self.height))
+
+        def chunk(kind, data):
+            return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+        with open(path, "wb") as filepointer:
+            filepointer.write(b"\x89PNG\r\n\x1a\n")
+            filepointer.write(chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 0, 0, 0, 0)))
+            filepointer.write(chunk(b"IDAT", zlib.compress(rows)))
+            filepointer.write(chunk(b"IEND", b""))
+
+
+SEQUENCE_PATTERN = re.compile(r"CAL_(\d+)")
+
+
+class Chunk:
+    def __init__(self, key=0):
+        self.key = key
+        self.label = "Chunk {}".format(key)
+        self.enabled = True
+        self.cameras = []
+        self.sensors = []
+        self.markers = []
+        self.scalebars = []
+        self.tie_points = None
+        self.transform = ChunkTransform()
+        self.meta = dict()
+        self.next_key = 0
+
+        # what the fake did, for benchmarks to look at
+        self.fake_matched_pairs = 0
+        self.fake_optimizations = 0
+        # sequence numbers of the frames alignCameras put off the rig on purpose
+        self.fake_misaligned = set()
+
+    def nextKey(self):
+        self.next_key += 1
+        return self.next_key
+
+    @property
+    def rng(self):
+        return np.random.default_rng(fake.seed + self.key)
+
+    def addSensor(self, source=None):
+        sensor = Sensor(self.nextKey())
+        self.sensors.append(sensor)
+        return sensor
+
+    def addPhotos(self, filenames=None, filegroups=None, layout=None, load_reference=True, **kwargs):
+        filenames = list(filenames or [])
+        sensor = self.sensors[0] if len(self.sensors) > 0 else self.addSensor()
+        for path in filenames:
+            self.cameras.append(Camera(self.nextKey(), path, sensor))
+
+    def addMarker(self, point=None, visibility=False):
+        marker = Marker(self.nextKey(), "point {}".format(len(self.markers) + 1))
+        self.markers.append(marker)
+        return marker
+
+    def addScalebar(self, point1, point2):
+        scalebar = Scalebar(self.nextKey(), point1, point2)
+        self.scalebars.append(scalebar)
+        return scalebar
+
+    def matchPhotos(self, downscale=1, keypoint_limit=40000, tiepoint_limit=4000, generic_preselection=True,
+                    reference_preselection=True, reference_preselection_mode=None, pairs=None, **kwargs):
+        count = len([camera for camera in self.cameras if camera.enabled])
+        if pairs is not None:
+            matched = len(pairs)
+        elif generic_preselection:
+            # global preselection compares everything against everything
+            matched = count * (count - 1) // 2
+        else:
+            matched = count * fake.match_window
+
+        self.fake_matched_pairs = matched
+        time.sleep(matched * fake.match_cost_per_pair)
+
+    def sequenceOf(self, camera):
+        match = SEQUENCE_PATTERN.search(os.path.basename(camera.photo.path))
+        return int(match.group(1)) if match is not None else camera.key
+
+    def alignCameras(self, cameras=None, reset_alignment=True, **kwargs):
+        rng = self.rng
+        cameras = [camera for camera in self.cameras if camera.enabled]
+        width = max([camera.sensor.width for camera in cameras] + [1])
+        height = max([camera.sensor.height for camera in cameras] + [1])
+        self.tie_points = TiePoints(fake.tie_points, cameras, width, height, rng)
+        self.fake_misaligned = set()
+
+        # a slave sensor free to rotate ends up near its reference rotation, the angles read as Rz Ry Rx in the order
+        # they were given. Every camera of the sensor hangs off its master through this one rotation
+        for sensor in set(camera.sensor for camera in cameras):
+            reference = sensor.reference
+            if sensor.master is not sensor and not sensor.fixed_rotation and reference.rotation_enabled and reference.rotation is not None:
+                rotation = rotationZYX(*reference.rotation) @ rotationZYX(fake.sensor_rotation_error_deg, 0.0, 0.0)
+                sensor.rotation = Matrix.fromArray(rotation)
+
+        # frames move along x, every slave sensor sits at its offset from its master
+        sequences = sorted(set(self.sequenceOf(camera) for camera in cameras))
+        position = {sequence: index for index, sequence in enumerate(sequences)}
+        for camera in cameras:
+            transform = np.eye(4)
+            transform[0, 3] = 0.05 * position[self.sequenceOf(camera)]
+
+            sensor = camera.sensor
+            if sensor.master is not sensor and sensor.location is not None:
+                offset = np.eye(4)
+                offset[:3, 3] = list(sensor.location)
+                if sensor.rotation is not None:
+                    offset[:3, :3] = sensor.rotation.array
+                transform = transform @ offset
+                if rng.uniform() < fake.misaligned_pair_fraction:
+                    self.fake_misaligned.add(self.sequenceOf(camera))
+                    transform[:3, 3] += rng.normal(0.0, 0.02, size=3)
+                    transform[:3, :3] = transform[:3, :3] @ rotationZYX(*rng.normal(0.0, 2.0, size=3))
+
+            camera.transform = Matrix.fromArray(transform)
+
+    def optimizeCameras(self, tiepoint_covariance=False, **kwargs):
+        cloud = self.tie_points
+        valid = np.count_nonzero(cloud.valid)
+        time.sleep(valid * fake.optimize_cost_per_point)
+
+        # fewer bad points left means the remaining ones fit better
+        cloud.reprojection_error[cloud.valid] *= 0.97
+        self.fake_optimizations += 1
+
+    def detectMarkers(self, target_type=None, tolerance=50, filter_mask=False, inverted=False, **kwargs):
+        rng = self.rng
+        rms = self.tie_points.rmsReprojectionError() if self.tie_points is not None else 1.0
+        existing = {marker.label for marker in self.markers}
+        for label, position in sorted(fake.targets.items()):
+            if label in existing:
+                continue
+            marker = Marker(self.nextKey(), label)
+            marker.position = Vector(np.asarray(position, dtype=float) + rng.normal(0.0, fake.marker_noise * rms, size=3))
+            self.markers.append(marker)
+
+    def refineMarkers(self, markers=None, **kwargs):
+        pass
+
+    def analyzeImages(self, cameras=None, **kwargs):
+        for camera in cameras or self.cameras:
+            camera.meta["Image/Quality"] = str(fake.image_quality.get(camera.photo.path, 0.8))
+
+    def exportReport(self, path=None, title="", **kwargs):
+        with open(path, "w") as filepointer:
+            filepointer.write("fake agisoft report: {}\n".format(title))
+
+    def renderPreview(self, **kwargs):
+        return Image()
+
+    def buildModel(self, **kwargs):
+        pass
+
+    def reduceOverlap(self, **kwargs):
+        pass
+
+    def buildDepthMaps(self, **kwargs):
+        pass
+
+    def buildUV(self, **kwargs):
+        pass
+
+    def buildTexture(self, **kwargs):
+        pass
+
+
+class Document:
+    def __init__(self):
+        self.chunks = []
+        self.path = None
+        self.read_only = False
+
+    @property
+    def chunk(self):
+        return self.chunks[0] if len(self.chunks) > 0 else None
+
+    def addChunk(self):
+        chunk = Chunk(len(self.chunks))
+        self.chunks.append(chunk)
+        return chunk
+
+    def save(self, path=None, **kwargs):
+        path = path or self.path
+        if self.read_only and path == self.path:
+            raise Exception("Document is opened read only")
+        # metashape makes the folder if it is not there, the v1 script relies on it
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "wb") as filepointer:
+            pickle.dump(self.chunks, filepointer)
+        self.path = path
+        self.read_only = False
+
+    def open(self, path, read_only=False, ignore_lock=False, **kwargs):
+        with open(path, "rb") as filepointer:
+            self.chunks = pickle.load(filepointer)
+        self.path = path
+        self.read_only = read_only
+
+
+app = Application()
@@ -0,0 +1,74 @@
+# Runs every tie point filter schedule preset on synthetic clouds of a few sizes against the fake Metashape.
+# optimizeCameras is what costs time in the real thing, so the fake sleeps per valid tie point when optimizing
+# (--optimize-cost) and the number of optimizations is reported next to the wall time. Working out a criterion
+# (TiePoints.Filter.init) costs --init-cost per point, the number of those is reported too. With --budgets the cloud
+# is also thinned to each budget first (0 is no thinning), thinning time is part of the total.
+#
+# usage: python benchmarks/filter_benchmark.py [--points 10000 100000] [--optimize-cost 1e-6] [--init-cost 2e-7] [--schedules barscan cleaner]
+#                                              [--budgets 0 20000]
+
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+import synthetic
+
+from voyis.thinning import TiePointThinner
+from voyis.tiepoints import TiePointFilter, SCHEDULE_PRESETS
+
+
+def runSchedule(name, points, frames, optimize_cost, init_cost, budget=0):
+    synthetic.configureFake(tie_points=points, optimize_cost_per_point=optimize_cost, filter_init_cost_per_point=init_cost)
+    _, chunk = synthetic.alignedChunk(frames)
+
+    tie_points = chunk.tie_points
+    filter = TiePointFilter(chunk, SCHEDULE_PRESETS[name]())
+
+    start = time.perf_counter()
+    # the filter talks a lot, we only want the numbers
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        if budget > 0:
+            TiePointThinner(chunk, budget).run()
+        filter.run()
+    seconds = time.perf_counter() - start
+
+    remaining = int(tie_points.valid.sum())
+    # the weakest camera after filtering, thinning must not leave one without points
+    per_camera = [len(tie_points.projections[camera]) for camera in chunk.cameras]
+    return {
+        "schedule": name,
+        "points": points,
+        "budget": budget or "-",
+        "min_camera_points": min(per_camera) if len(per_camera) > 0 else 0,
+        "seconds": seconds,
+        "optimizations": filter.optimizations,
+        "filter_inits": filter.filter_inits,
+        "removed_percent": 100.0 * (points - remaining) / points,
+        "rms": tie_points.rmsReprojectionError(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tie point filter schedules on synthetic clouds")
+    parser.add_argument("--points", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--optimize-cost", type=float, default=1e-6, help="seconds per valid tie point per optimizeCameras")
+    parser.add_argument("--init-cost", type=float, default=2e-7, help="seconds per tie point per TiePoints.Filter.init")
+    parser.add_argument("--schedules", nargs="+", default=sorted(SCHEDULE_PRESETS), choices=sorted(SCHEDULE_PRESETS))
+    parser.add_argument("--budgets", type=int, nargs="+", default=[0], help="tie point budgets to thin to first, 0 for no thinning")
+    args = parser.parse_args(argv)
+
+    print("{:<18} {:>9} {:>8} {:>10} {:>14} {:>8} {:>10} {:>8} {:>11}".format(
+        "schedule", "points", "budget", "time [s]", "optimizations", "inits", "removed %", "rms", "min/camera"))
+    for points in args.points:
+        for name in args.schedules:
+            for budget in args.budgets:
+                result = runSchedule(name, points, args.frames, args.optimize_cost, args.init_cost, budget)
+                print("{schedule:<18} {points:>9} {budget:>8} {seconds:>10.2f} {optimizations:>14} {filter_inits:>8} {removed_percent:>10.1f} "
+                      "{rms:>8.4f} {min_camera_points:>11}".format(**result))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
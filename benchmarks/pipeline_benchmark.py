@@ -0,0 +1,80 @@
+# Runs the whole barscan (align, filter, scale bars, reports) on a synthetic unit against the fake Metashape, then
+# once more to time a resumed run, and prints where the time went from the timings file the pipeline writes.
+# The scale bar report is generated a few extra times on its own since it is the one step that is all ours.
+#
+# usage: python benchmarks/pipeline_benchmark.py [--frames 200] [--points 50000] [--optimize-cost 1e-6] [--reports 10]
+#                                                [--match-cost 1e-4] [--match-mode sequential]
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+import synthetic
+
+
+def readTimings(timings_file):
+    with open(timings_file) as filepointer:
+        return json.load(filepointer)["records"]
+
+
+def printTimings(title, records):
+    print(title)
+    for record in records:
+        # only the stages and their direct steps, the filter thresholds are in the file
+        if record["name"].count("/") > 1:
+            continue
+        if record["skipped"]:
+            print("  {:<40} skipped".format(record["name"]))
+        else:
+            print("  {:<40} {:>9.3f} s".format(record["name"], record["wall_s"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="The barscan pipeline on a synthetic unit")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--points", type=int, default=50000)
+    parser.add_argument("--optimize-cost", type=float, default=1e-6, help="seconds per valid tie point per optimizeCameras")
+    parser.add_argument("--match-cost", type=float, default=0.0, help="seconds per matched image pair")
+    parser.add_argument("--match-mode", default="preselection", choices=["preselection", "sequential"])
+    parser.add_argument("--reports", type=int, default=10, help="extra scale bar reports to time")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as root:
+        # keep the calibration cache and results of the benchmark out of the real ones
+        os.environ["VOYIS_CALIBRATION_CACHE"] = os.path.join(root, "calibration_cache")
+        os.environ["VOYIS_RESULTS_DB"] = os.path.join(root, "results.sqlite")
+        from voyis import barscan
+        from voyis.fixtures import getFixture
+
+        synthetic.configureFake(args.points, args.optimize_cost, args.match_cost, scale_bars=getFixture().scale_bars)
+        calibration_folder = synthetic.makeCalibrationFolder(os.path.join(root, "AgisoftParams"))
+        stills_folder = synthetic.makeStillsFolder(root, frames=args.frames, sub_folders=4)
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            analyzer = barscan.processBarscan(stills_folder, calibration_folder, resume=False, match_mode=args.match_mode)
+            fresh_seconds = time.perf_counter() - start
+            records = readTimings(analyzer.timings_file)
+
+            start = time.perf_counter()
+            # every stage is checkpointed by now, so this is the cost of finding that out
+            barscan.processBarscan(stills_folder, calibration_folder, resume=True, match_mode=args.match_mode)
+            resumed_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(args.reports):
+                analyzer.generateReport()
+            report_seconds = (time.perf_counter() - start) / max(1, args.reports)
+
+        printTimings("fresh run, {:.2f} s, {}, {} image pairs matched".format(
+            fresh_seconds, "PASS" if analyzer.has_passed else "FAIL", analyzer.chunk.fake_matched_pairs), records)
+        print("resumed run, {:.2f} s".format(resumed_seconds))
+        print("scale bar report, {:.1f} ms each".format(report_seconds * 1000))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
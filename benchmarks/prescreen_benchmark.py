@@ -0,0 +1,102 @@
+# Times the image quality screen on full size synthetic stills: a full decode against the dct scaled thumbnail
+# the screen uses, then the whole screen (serial and pooled) on a folder with some blurry and black frames, and
+# whether it caught them. Needs Pillow and numpy, not Metashape.
+#
+# usage: python benchmarks/prescreen_benchmark.py [--frames 100] [--width 4096 --height 3000] [--workers 4]
+
+import io
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+import synthetic
+
+from voyis.discovery import discoverImages
+from voyis.imagequality import ImageQualityScreen, loadThumbnail
+from voyis.pairing import pairImages
+
+
+def stillBytes(kind, width, height, seed=0):
+    # smooth shapes plus fine texture, closer to a tank full of targets than plain noise
+    from PIL import Image, ImageFilter
+
+    rng = np.random.default_rng(seed)
+    texture = rng.normal(0.0, 25.0, size=(height // 8, width // 8))
+    pixels = np.kron(texture, np.ones((8, 8)))[:height, :width] + rng.normal(128.0, 20.0, size=(height, width))
+    if kind == "black":
+        pixels = pixels * 0.05
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), mode="L")
+    if kind == "blurry":
+        image = image.filter(ImageFilter.GaussianBlur(6))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def makeFolder(root, frames, width, height, bad_frames):
+    images = {kind: stillBytes(kind, width, height) for kind in synthetic.IMAGE_KINDS}
+    folder = os.path.join(root, "Stills_{}".format(synthetic.SERIAL_ID))
+    os.makedirs(folder)
+    for index in range(frames):
+        for role in ["left", "right"]:
+            bad = bad_frames.get(index)
+            kind = bad[1] if bad is not None and bad[0] == role else "sharp"
+            with open(os.path.join(folder, synthetic.imageName(role, 10000 + index)), "wb") as filepointer:
+                filepointer.write(images[kind])
+    return folder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Image quality screen on full size stills")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--width", type=int, default=4096)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    from PIL import Image
+
+    rng = np.random.default_rng(1)
+    bad_indices = rng.choice(args.frames, size=max(2, args.frames // 20), replace=False)
+    bad_frames = {int(index): (["left", "right"][i % 2], ["blurry", "black"][i // 2 % 2]) for i, index in enumerate(bad_indices)}
+
+    with tempfile.TemporaryDirectory() as root:
+        folder = makeFolder(root, args.frames, args.width, args.height, bad_frames)
+        entries = discoverImages(folder)
+        sample = os.path.join(folder, entries[0][0])
+
+        start = time.perf_counter()
+        for _ in range(5):
+            with Image.open(sample) as image:
+                image.convert("L").load()
+        full = (time.perf_counter() - start) / 5
+
+        start = time.perf_counter()
+        for _ in range(5):
+            thumbnail = loadThumbnail(sample)
+        draft = (time.perf_counter() - start) / 5
+        print("full decode {:.1f} ms, thumbnail {:.1f} ms ({} x {})".format(full * 1e3, draft * 1e3, thumbnail.shape[1], thumbnail.shape[0]))
+
+        for workers in sorted({1, args.workers}):
+            pairing = pairImages([os.path.join(folder, entry[0]) for entry in entries])
+            start = time.perf_counter()
+            with open(os.devnull, "w") as devnull:
+                stdout, sys.stdout = sys.stdout, devnull
+                try:
+                    rejected = ImageQualityScreen(n_jobs=workers).run(folder, entries, pairing)
+                finally:
+                    sys.stdout = stdout
+            seconds = time.perf_counter() - start
+
+            caught = set(rejected) & {10000 + index for index in bad_frames}
+            print("{} workers: {} images in {:.2f} s, {} of {} bad frames caught, {} good frames rejected".format(
+                workers, len(entries), seconds, len(caught), len(bad_frames), len(set(rejected) - caught)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
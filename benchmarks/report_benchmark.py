@@ -0,0 +1,68 @@
+# Renders the verification report for synthetic fixtures with more and more targets, to check that the time per
+# table row and the memory stay flat as the all pairs table grows. Needs nothing but reportlab and numpy.
+#
+# usage: python benchmarks/report_benchmark.py [--targets 18 50 100 200]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+import synthetic
+
+from voyis.accuracy import PairwiseAccuracy, distanceMatrix
+from voyis.report import renderReport
+
+
+def reportData(targets, folder):
+    rng = np.random.default_rng(0)
+    labels = ["target {}".format(i + 1) for i in range(targets)]
+    positions = rng.uniform(0.0, 6.0, size=(targets, 3))
+    pairwise = PairwiseAccuracy(labels, positions + rng.normal(0.0, 0.0002, size=positions.shape), labels, distanceMatrix(positions))
+
+    return {
+        "serial_id": synthetic.SERIAL_ID,
+        "uuid": "benchmark",
+        "fixture_id": "synthetic_{}".format(targets),
+        "created": time.strftime("%Y-%m-%d_%H-%M-%S"),
+        "report_file": os.path.join(folder, "report_{}.pdf".format(targets)),
+        "scale_bars": [["Marker 1 to Marker 10", "5.5193", "5.5194", "0.10", "0.002", "Pass"]] * 9,
+        "rms_error_percentage": 0.002,
+        "passing_error_in_percentage": 0.03,
+        "passed": True,
+        "pairwise": pairwise.toDict(),
+        "top_down_image": None,
+        "timings": [["align", 12.0, 40.0, 900.0], ["filter", 30.0, 31.0, 950.0]],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verification report rendering for growing all pairs tables")
+    parser.add_argument("--targets", type=int, nargs="+", default=[18, 50, 100, 200])
+    args = parser.parse_args(argv)
+
+    print("{:>8} {:>8} {:>10} {:>14} {:>14}".format("targets", "rows", "time [s]", "us per row", "peak [MB]"))
+    with tempfile.TemporaryDirectory() as folder:
+        for targets in args.targets:
+            data = reportData(targets, folder)
+            rows = len(data["pairwise"]["pairs"])
+
+            start = time.perf_counter()
+            renderReport(data)
+            seconds = time.perf_counter() - start
+
+            # tracing slows rendering down several times, so memory gets its own run
+            tracemalloc.start()
+            renderReport(data)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            print("{:>8} {:>8} {:>10.2f} {:>14.1f} {:>14.1f}".format(targets, rows, seconds, seconds / rows * 1e6, peak / 1e6))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,64 @@
+# Measures what each script costs Metashape at start up, i.e. importing it just to register its menu entries.
+# Every measurement runs in a fresh interpreter against the fake Metashape module, so nothing is cached.
+#
+# usage: python benchmarks/startup_benchmark.py [--repeat 5]
+
+import os
+import sys
+import glob
+import json
+import argparse
+import statistics
+import subprocess
+
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+REPO_FOLDER = os.path.dirname(BENCHMARK_FOLDER)
+FAKE_FOLDER = os.path.join(BENCHMARK_FOLDER, "fake")
+
+# modules that should never be loaded just to register a menu entry
+HEAVY_MODULES = ["numpy", "pandas", "reportlab", "tqdm", "pqdm"]
+
+MEASURE = """
+import sys, time, json, runpy
+sys.path.insert(0, {fake!r})
+import Metashape
+# the fake itself pulls in numpy, only count what the script loads
+loaded = set(sys.modules)
+start = time.perf_counter()
+runpy.run_path({script!r})
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "menu_items": sorted(Metashape.app.menu_items),
+    "heavy_modules": [name for name in {heavy!r} if name in sys.modules and name not in loaded],
+}}))
+"""
+
+
+def measureScript(script):
+    code = MEASURE.format(fake=FAKE_FOLDER, script=script, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import cost of the Metashape start up scripts")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    scripts = sorted(glob.glob(os.path.join(REPO_FOLDER, "*.py")))
+    print("{:<34} {:>12} {:>12}  {}".format("script", "median [ms]", "max [ms]", "heavy modules loaded"))
+    for script in scripts:
+        runs = [measureScript(script) for _ in range(args.repeat)]
+        seconds = [run["seconds"] for run in runs]
+        print("{:<34} {:>12.1f} {:>12.1f}  {}".format(
+            os.path.basename(script),
+            statistics.median(seconds) * 1000,
+            max(seconds) * 1000,
+            ", ".join(runs[-1]["heavy_modules"]) or "-",
+        ))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,165 @@
+# Synthetic verification data for the benchmarks: a calibration folder, a Stills folder full of stereo images
+# and target positions that agree with the scale bars, so a barscan on the fake Metashape has something to find.
+#
+# Importing this puts the fake Metashape and the repo on sys.path, so the benchmarks import it first.
+
+import io
+import os
+import sys
+import json
+import functools
+
+import numpy as np
+
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+REPO_FOLDER = os.path.dirname(BENCHMARK_FOLDER)
+FAKE_FOLDER = os.path.join(BENCHMARK_FOLDER, "fake")
+
+for folder in [REPO_FOLDER, FAKE_FOLDER]:
+    if folder not in sys.path:
+        sys.path.insert(0, folder)
+
+import Metashape
+
+
+SERIAL_ID = "230900123"
+
+CALIBRATION_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<calibration>
+  <projection>frame</projection>
+  <width>{width}</width>
+  <height>{height}</height>
+  <f>{f}</f>
+  <cx>{cx}</cx>
+  <cy>{cy}</cy>
+  <k1>-0.05</k1>
+  <k2>0.01</k2>
+  <p1>0.0001</p1>
+  <p2>-0.0002</p2>
+</calibration>
+"""
+
+# a stereo baseline of 12 cm along x, like the units we ship
+SLAVE_OFFSETS = {"x": 0.12, "y": 0.0, "z": 0.0, "Omega": 0.0, "Kappa": 0.0, "Phi": 0.0}
+
+# what a frame looks like to the image quality screen. Discovery and pairing only look at the names
+IMAGE_KINDS = ["sharp", "blurry", "black"]
+
+
+@functools.lru_cache(maxsize=None)
+def imageBytes(kind="sharp", width=64, height=48):
+    '''a small real jpeg: grey noise, the same noise box blurred, or a frame where the strobe did not fire'''
+    from PIL import Image, ImageFilter
+
+    pixels = np.random.default_rng(0).integers(40, 216, size=(height, width), dtype=np.uint8)
+    if kind == "black":
+        pixels = pixels // 40
+    image = Image.fromarray(pixels, mode="L")
+    if kind == "blurry":
+        image = image.filter(ImageFilter.BoxBlur(3))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def makeCalibrationFolder(folder, serial_id=SERIAL_ID, width=4096, height=3000, offsets=None):
+    os.makedirs(folder, exist_ok=True)
+    for index, camera in enumerate(["cam0", "cam1"]):
+        with open(os.path.join(folder, "{}_{}.xml".format(serial_id, camera)), "w") as filepointer:
+            filepointer.write(CALIBRATION_XML.format(
+                width=width, height=height, f=3000.0 + index, cx=1.5 - index, cy=-2.0 + index))
+    with open(os.path.join(folder, "AgisoftSlaveOffsets.json"), "w") as filepointer:
+        json.dump(offsets or SLAVE_OFFSETS, filepointer, indent=4)
+    return folder
+
+
+def imageName(role, sequence):
+    return "image_{}_processed_SYSTEM_2023-11-08T153950.040882_CAL_{}.jpg".format(role, sequence)
+
+
+def makeStillsFolder(root, serial_id=SERIAL_ID, frames=200, sub_folders=1, dropped=0, extra_files=0, bad_frames=None):
+    '''a Stills_<serial> folder with frames stereo pairs spread over sub_folders. The last dropped frames lose their
+    right image and every sub folder gets extra_files files that are not images, like the logs next to real captures.
+    bad_frames maps a frame index to (role, kind) for the images the quality screen should catch'''
+    bad_frames = bad_frames or dict()
+    folder = os.path.join(root, "Stills_{}".format(serial_id))
+    for index in range(frames):
+        sub_folder = os.path.join(folder, "part_{:02d}".format(index % sub_folders))
+        os.makedirs(sub_folder, exist_ok=True)
+
+        sequence = 10000 + index
+        roles = ["left"] if index >= frames - dropped else ["left", "right"]
+        for role in roles:
+            with open(os.path.join(sub_folder, imageName(role, sequence)), "wb") as filepointer:
+                bad = bad_frames.get(index)
+                filepointer.write(imageBytes(bad[1] if bad is not None and bad[0] == role else "sharp"))
+
+    for index in range(sub_folders):
+        sub_folder = os.path.join(folder, "part_{:02d}".format(index))
+        os.makedirs(sub_folder, exist_ok=True)
+        for extra in range(extra_files):
+            with open(os.path.join(sub_folder, "log_{}.txt".format(extra)), "w") as filepointer:
+                filepointer.write("not an image")
+    return folder
+
+
+def fitTargetPositions(scale_bars, iterations=50):
+    '''positions for the targets of the scale bars whose distances match the ground truth. Gauss Newton from a rough
+    layout with the targets at both ends of the fixture, the system is underdetermined so any exact fit will do'''
+    labels = sorted({label for bar in scale_bars for label in [bar.marker_1_name, bar.marker_2_name]})
+    index = {label: i for i, label in enumerate(labels)}
+
+    positions = np.zeros((len(labels), 3))
+    for i, label in enumerate(labels):
+        number = int(label.split()[-1])
+        positions[i] = [0.0 if number < 10 else 5.6, 0.3 * (number % 3), 0.0]
+
+    first = np.array([index[bar.marker_1_name] for bar in scale_bars])
+    second = np.array([index[bar.marker_2_name] for bar in scale_bars])
+    ground_truth = np.array([bar.ground_truth_distance for bar in scale_bars])
+
+    for _ in range(iterations):
+        delta = positions[first] - positions[second]
+        distance = np.linalg.norm(delta, axis=1)
+        residual = distance - ground_truth
+        if np.max(np.abs(residual)) < 1e-10:
+            break
+
+        jacobian = np.zeros((len(scale_bars), positions.size))
+        direction = delta / distance[:, None]
+        for row, (a, b) in enumerate(zip(first, second)):
+            jacobian[row, 3 * a:3 * a + 3] = direction[row]
+            jacobian[row, 3 * b:3 * b + 3] = -direction[row]
+
+        step = np.linalg.lstsq(jacobian, -residual, rcond=None)[0]
+        positions += step.reshape(positions.shape)
+
+    return {label: positions[i].tolist() for label, i in index.items()}
+
+
+def configureFake(tie_points=20000, optimize_cost_per_point=0.0, match_cost_per_pair=0.0, scale_bars=None, seed=0,
+                  filter_init_cost_per_point=0.0):
+    Metashape.fake.reset()
+    Metashape.fake.seed = seed
+    Metashape.fake.tie_points = tie_points
+    Metashape.fake.optimize_cost_per_point = optimize_cost_per_point
+    Metashape.fake.match_cost_per_pair = match_cost_per_pair
+    Metashape.fake.filter_init_cost_per_point = filter_init_cost_per_point
+    if scale_bars is not None:
+        Metashape.fake.targets = fitTargetPositions(scale_bars)
+
+
+def alignedChunk(frames=100, width=4096, height=3000):
+    '''a chunk with frames stereo pairs that went through alignCameras, without any files on disk'''
+    doc = Metashape.Document()
+    chunk = doc.addChunk()
+    chunk.addPhotos([os.path.join("synthetic", imageName(role, 10000 + index))
+                     for index in range(frames) for role in ["left", "right"]])
+    for sensor in chunk.sensors:
+        sensor.width = width
+        sensor.height = height
+    chunk.matchPhotos()
+    chunk.alignCameras()
+    return doc, chunk
@@ -0,0 +1,84 @@
+# Fills a results database with a synthetic fleet, some units of which drift, and times the fleet trend aggregation
+# and the html / pdf summary. Needs pandas, numpy and reportlab, not Metashape.
+#
+# usage: python benchmarks/trend_benchmark.py [--units 200] [--runs 20] [--drifting 10]
+
+import os
+import sys
+import time
+import uuid
+import argparse
+import tempfile
+
+import numpy as np
+
+import synthetic
+
+from voyis.fixtures import getFixture
+from voyis.results import ResultsDatabase
+from voyis.trends import FleetTrends
+
+
+def fleetRecords(units, runs, drifting, seed=0):
+    # every unit measures the default fixture once a week, the first few slowly walk off by 0.002 % a run
+    rng = np.random.default_rng(seed)
+    bars = getFixture().scale_bars
+    records = []
+    for unit in range(units):
+        serial_id = "23{:07d}".format(unit)
+        bias = rng.normal(0.0, 0.003, size=len(bars))
+        for run in range(runs):
+            error_percent = bias + rng.normal(0.0, 0.002, size=len(bars))
+            if unit < drifting:
+                error_percent += 0.002 * run
+            rms = float(np.sqrt(np.mean(error_percent ** 2)))
+            records.append({
+                "run_uuid": str(uuid.UUID(int=int(rng.integers(2 ** 63)))),
+                "serial_id": serial_id,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(1.7e9 + run * 7 * 86400 + unit * 60)),
+                "fixture_id": "barscan_v2",
+                "passed": rms < 0.03,
+                "rms_error_percentage": rms,
+                "output_folder": None,
+                "results_file": "synthetic/{}/{}".format(serial_id, run),
+                "mtime_ns": 0,
+                "bars": [
+                    {"name": bar.name, "ground_truth_m": bar.ground_truth_distance,
+                     "measured_m": bar.ground_truth_distance * (1 + error / 100), "error_percent": float(error), "passed": True}
+                    for bar, error in zip(bars, error_percent)
+                ],
+            })
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fleet trend aggregation on a synthetic results database")
+    parser.add_argument("--units", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--drifting", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as folder:
+        database = ResultsDatabase(os.path.join(folder, "results.sqlite"))
+        start = time.perf_counter()
+        database.ingest(fleetRecords(args.units, args.runs, args.drifting))
+        print("ingested {} runs in {:.2f} s".format(args.units * args.runs, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        trends = FleetTrends.fromDatabase(database)
+        print("aggregated {} bar measurements in {:.2f} s".format(len(trends.frame), time.perf_counter() - start))
+
+        flagged = set(trends.drifting()["serial_id"])
+        expected = {"23{:07d}".format(unit) for unit in range(args.drifting)}
+        print("{} units flagged, {} of {} drifting units caught, {} false alarms".format(
+            len(flagged), len(flagged & expected), len(expected), len(flagged - expected)))
+
+        for writer, name in [(trends.writeHtml, "fleet.html"), (trends.writePdf, "fleet.pdf")]:
+            start = time.perf_counter()
+            filename = writer(os.path.join(folder, name))
+            print("{} in {:.2f} s, {:.0f} kB".format(name, time.perf_counter() - start, os.path.getsize(filename) / 1e3))
+        database.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,2 @@
+# Shared Voyis verification code used by the Metashape scripts in this folder.
+# Copy this folder next to the scripts in the Metashape scripts folder.
@@ -0,0 +1,174 @@
+import os
+import json
+import numpy as np
+
+
+# how many of the worst pairs end up in the report
+WORST_PAIR_COUNT = 10
+
+
+def loadGroundTruth(filename):
+    '''reads a fixture ground truth file and returns (target labels, N x N ground truth distance matrix in meters).
+    The file has surveyed target positions, known distances, or both:
+
+        {
+            "fixture_id": "barscan_6m",
+            "targets": {"target 1": [x, y, z], ...},
+            "distances": [["target 1", "target 10", 5.5193], ...]
+        }
+
+    Distances listed explicitly win over the ones from the positions. Pairs nobody measured are nan'''
+    with open(filename) as filepointer:
+        fixture = json.load(filepointer)
+
+    targets = fixture.get("targets", dict())
+    distances = fixture.get("distances", [])
+    labels = sorted(set(targets) | {label for pair in distances for label in pair[:2]}, key=targetSortKey)
+    if len(labels) < 2:
+        raise Exception("Ground truth file {} has fewer than two targets".format(filename))
+
+    index = {label: i for i, label in enumerate(labels)}
+    matrix = np.full((len(labels), len(labels)), np.nan)
+
+    if len(targets) > 0:
+        surveyed = np.array([index[label] for label in targets], dtype=int)
+        matrix[np.ix_(surveyed, surveyed)] = distanceMatrix(np.array(list(targets.values()), dtype=float))
+
+    if len(distances) > 0:
+        first = np.array([index[pair[0]] for pair in distances], dtype=int)
+        second = np.array([index[pair[1]] for pair in distances], dtype=int)
+        values = np.array([pair[2] for pair in distances], dtype=float)
+        matrix[first, second] = values
+        matrix[second, first] = values
+
+    np.fill_diagonal(matrix, np.nan)
+    return labels, matrix
+
+
+def targetSortKey(label):
+    # target 2 before target 10
+    number = label.split()[-1]
+    return (0, int(number), label) if number.isdigit() else (1, 0, label)
+
+
+def distanceMatrix(positions):
+    # all pairwise distances of an N x 3 array at once
+    difference = positions[:, None, :] - positions[None, :, :]
+    return np.sqrt(np.einsum("ijk,ijk->ij", difference, difference))
+
+
+class PairwiseAccuracy:
+    '''every detected target against every other one, compared with the fixture's ground truth distances.
+    Everything is worked out once when it is made, over the upper triangle of the distance matrices'''
+
+    def __init__(self, labels, positions, ground_truth_labels, ground_truth, worst_pair_count=WORST_PAIR_COUNT):
+        position_index = {label: i for i, label in enumerate(labels)}
+        self.labels = [label for label in ground_truth_labels if label in position_index]
+        self.missing = [label for label in ground_truth_labels if label not in position_index]
+
+        # both matrices in ground truth order, only the targets that were detected
+        ground_truth_index = {label: i for i, label in enumerate(ground_truth_labels)}
+        ground_truth_rows = np.array([ground_truth_index[label] for label in self.labels], dtype=int)
+        position_rows = np.array([position_index[label] for label in self.labels], dtype=int)
+        self.ground_truth = ground_truth[np.ix_(ground_truth_rows, ground_truth_rows)]
+        self.measured = distanceMatrix(positions[position_rows].reshape(-1, 3))
+        self.error = self.measured - self.ground_truth
+
+        # each pair once, and only the ones with a ground truth
+        first, second = np.triu_indices(len(self.labels), k=1)
+        known = ~np.isnan(self.ground_truth[first, second])
+        self.first = first[known]
+        self.second = second[known]
+        self.pair_length = self.ground_truth[self.first, self.second]
+        self.pair_error = self.error[self.first, self.second]
+        self.pair_error_percent = self.pair_error / self.pair_length * 100
+
+        # per target bias: the mean signed error of all pairs it is part of
+        with np.errstate(invalid="ignore"):
+            counts = np.sum(~np.isnan(self.error), axis=1)
+            self.target_bias = np.where(counts > 0, np.nansum(self.error, axis=1) / np.maximum(counts, 1), np.nan)
+            self.target_rms = np.where(counts > 0, np.sqrt(np.nansum(self.error ** 2, axis=1) / np.maximum(counts, 1)), np.nan)
+        self.target_pairs = counts
+
+        # distance dependent error, error = slope * length + offset. A scale error shows up as slope
+        if len(self.pair_length) >= 2 and np.ptp(self.pair_length) > 0:
+            self.slope, self.offset = (float(value) for value in np.polyfit(self.pair_length, self.pair_error, 1))
+        else:
+            self.slope, self.offset = float("nan"), float("nan")
+
+        self.worst = np.argsort(-np.abs(self.pair_error))[:worst_pair_count]
+
+    def pairCount(self):
+        return len(self.pair_error)
+
+    def rmsError(self):
+        return float(np.sqrt(np.mean(self.pair_error ** 2))) if self.pairCount() > 0 else float("nan")
+
+    def rmsErrorPercent(self):
+        return float(np.sqrt(np.mean(self.pair_error_percent ** 2))) if self.pairCount() > 0 else float("nan")
+
+    def worstPairs(self):
+        return [
+            {
+                "pair": [self.labels[self.first[i]], self.labels[self.second[i]]],
+                "ground_truth_m": float(self.pair_length[i]),
+                "measured_m": float(self.measured[self.first[i], self.second[i]]),
+                "error_mm": float(self.pair_error[i] * 1000),
+                "error_percent": float(self.pair_error_percent[i]),
+            }
+            for i in self.worst
+        ]
+
+    def pairRows(self):
+        # every pair as [target, target, ground truth m, measured m, error mm, error %]
+        measured = self.measured[self.first, self.second]
+        return [
+            [self.labels[first], self.labels[second], float(length), float(distance), float(error * 1000), float(error_percent)]
+            for first, second, length, distance, error, error_percent in zip(
+                self.first, self.second, self.pair_length, measured, self.pair_error, self.pair_error_percent)
+        ]
+
+    def summary(self):
+        return {
+            "targets": len(self.labels),
+            "missing_targets": self.missing,
+            "pairs": self.pairCount(),
+            "rms_error_mm": self.rmsError() * 1000,
+            "rms_error_percent": self.rmsErrorPercent(),
+            "max_abs_error_mm": float(np.max(np.abs(self.pair_error)) * 1000) if self.pairCount() > 0 else float("nan"),
+            "mean_error_mm": float(np.mean(self.pair_error) * 1000) if self.pairCount() > 0 else float("nan"),
+            "std_error_mm": float(np.std(self.pair_error) * 1000) if self.pairCount() > 0 else float("nan"),
+            # slope in mm per m is the same as parts per thousand
+            "error_vs_length_slope_mm_per_m": self.slope * 1000,
+            "error_vs_length_offset_mm": self.offset * 1000,
+        }
+
+    def toDict(self):
+        return {
+            "summary": self.summary(),
+            "targets": {
+                label: {
+                    "bias_mm": float(bias * 1000),
+                    "rms_mm": float(rms * 1000),
+                    "pairs": int(pairs),
+                }
+                for label, bias, rms, pairs in zip(self.labels, self.target_bias, self.target_rms, self.target_pairs)
+            },
+            "worst_pairs": self.worstPairs(),
+            "pairs": self.pairRows(),
+        }
+
+    def write(self, filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as filepointer:
+            json.dump(self.toDict(), filepointer, indent=4)
+
+    def printSummary(self):
+        summary = self.summary()
+        print("{} targets, {} pairs with ground truth, rms {:.3f} mm ({:.4f} %), error vs length {:.4f} mm/m + {:.3f} mm".format(
+            summary["targets"], summary["pairs"], summary["rms_error_mm"], summary["rms_error_percent"],
+            summary["error_vs_length_slope_mm_per_m"], summary["error_vs_length_offset_mm"]))
+        if len(self.missing) > 0:
+            print("targets not detected: {}".format(", ".join(self.missing)))
+        for pair in self.worstPairs():
+            print("{:<24} {:>8.4f} m {:>8.3f} mm".format(" to ".join(pair["pair"]), pair["ground_truth_m"], pair["error_mm"]))
@@ -0,0 +1,569 @@
+import Metashape
+import os
+import time
+import glob
+import json
+import uuid
+
+import re
+
+from voyis.accuracy import PairwiseAccuracy, loadGroundTruth
+from voyis.baseline import BaselineCheck
+from voyis.calibration import loadCalibrationBundle, setupStereoSensors
+from voyis.checkpoint import PipelineCheckpoint, hashInputs
+from voyis.discovery import discoverImages
+from voyis.fixtures import DEFAULT_FIXTURE, getFixture
+from voyis.imagequality import ImageQualityScreen
+from voyis.matching import DEFAULT_MATCH_MODE, MATCH_MODES, SequentialMatchPairs
+from voyis.pairing import pairImages, assignSensors
+from voyis.profiling import StageProfiler
+from voyis.results import DEFAULT_DATABASE, ResultsDatabase
+from voyis.scalebars import ScaleBarResult, measureScaleBars, markerPositions
+from voyis.thinning import TiePointThinner
+from voyis.tiepoints import TiePointFilter, SCHEDULE_PRESETS
+
+
+def getSerialIdFromFolder(folder):
+    # get the serial id from the folder path using regex to find the serial id
+    serial_id = re.search(r"(\d{9})", folder).group(1)
+    return serial_id
+
+
+# the stages of a barscan in the order they run. Each one is checkpointed in the output folder
+PIPELINE_STAGES = ["align", "filter", "scalebars", "agisoft_report"]
+
+# the tie point filter schedule a barscan runs unless told otherwise, see SCHEDULE_PRESETS
+DEFAULT_FILTER_PRESET = "barscan"
+
+
+def selectStages(last_stage=None):
+    # the stages up to and including last_stage, a stage can not run without the ones before it
+    if last_stage is None:
+        return list(PIPELINE_STAGES)
+    if last_stage not in PIPELINE_STAGES:
+        raise Exception("Unknown stage {}, the stages are {}".format(last_stage, ", ".join(PIPELINE_STAGES)))
+    return PIPELINE_STAGES[:PIPELINE_STAGES.index(last_stage) + 1]
+
+
+class BarScanAnalizer:
+    def __init__(self, verification_folder, camera_calibration_file, resume=True, ground_truth_file=None, fixture_id=DEFAULT_FIXTURE,
+                 defer_report=False, results_database=DEFAULT_DATABASE, filter_preset=DEFAULT_FILTER_PRESET, prescreen=True,
+                 tiepoint_budget=None, baseline_check=True, match_mode=DEFAULT_MATCH_MODE):
+        self.serial_id = getSerialIdFromFolder(verification_folder) 
+        self.uuid = uuid.uuid4()
+        self.image_folder = verification_folder
+        self.calibration_folder = os.path.join(camera_calibration_file)
+        self.cal_uuid = ""
+
+        # pick up where the last run in this folder stopped, otherwise start a new output folder
+        self.output_folder = self.findResumableOutputFolder() if resume else None
+        if self.output_folder is None:
+            self.output_folder = os.path.join(verification_folder, "{}_Verification-{}".format(self.serial_id, time.strftime("%Y-%m-%d_%H-%M-%S")))
+        else:
+            print("resuming barscan in {}".format(self.output_folder))
+
+        self.output_file = os.path.join(
+            self.output_folder, f"{self.serial_id}.psx")
+
+        self.doc = Metashape.Document()
+        self.chunk = self.doc.addChunk()
+        self.calibs = dict()
+        self.calibration_bundle = loadCalibrationBundle(self.calibration_folder, self.serial_id)
+
+        self.profiler = StageProfiler()
+        self.timings_file = os.path.join(self.output_folder, "{}_timings.json".format(self.serial_id))
+
+        # blurry and black frames are dropped (with their partner) before they cost a minute of matching each
+        self.image_screen = ImageQualityScreen() if prescreen else None
+
+        self.image_manifest_file = os.path.join(self.output_folder, "{}_images.json".format(self.serial_id))
+        self.pairing_file = os.path.join(self.output_folder, "{}_pairing.json".format(self.serial_id))
+        self.findImages()
+
+        # changing any of these invalidates the matching stage and everything after it
+        self.align_params = {
+            "downscale": 2,
+            "keypoint_limit": 50000,
+            "tiepoint_limit": 5000,
+        }
+        # sequential matches each frame with its neighbours and a few look alikes instead of letting metashape preselect
+        if match_mode not in MATCH_MODES:
+            raise Exception("Unknown match mode {}, the modes are {}".format(match_mode, ", ".join(MATCH_MODES)))
+        self.match_pairs = SequentialMatchPairs() if match_mode == "sequential" else None
+        if filter_preset not in SCHEDULE_PRESETS:
+            raise Exception("Unknown filter preset {}, the presets are {}".format(filter_preset, ", ".join(sorted(SCHEDULE_PRESETS))))
+        self.filter_schedule = SCHEDULE_PRESETS[filter_preset]()
+
+        # dense captures are thinned to this many tie points before the filter sweep, None keeps them all
+        self.tiepoint_budget = tiepoint_budget
+        self.thinning_summary = None
+
+        # aligned pairs that do not fit the stereo offsets are reset before filtering, None to leave them all in
+        self.baseline_check = BaselineCheck(None, self.pairing, self.calibration_bundle.extrinsics) if baseline_check else None
+        self.baseline_file = os.path.join(self.output_folder, "{}_baseline.json".format(self.serial_id))
+        
+        # these dictate if a scan passes or fails
+        self.passing_error_in_percentage = 0.03
+        self.passing_single_measurment_error_percentage = 0.04
+
+        # what is measured and reported on. The fixture is shared and read only, results go on this run
+        self.fixture = getFixture(fixture_id)
+        self.scale_bars = self.fixture.scale_bars
+
+        # with a fixture ground truth file every detected target is also measured against every other one. A json
+        # fixture that lists its distances is its own ground truth file unless another one is given
+        self.ground_truth_file = ground_truth_file if ground_truth_file is not None else self.fixture.groundTruthFile()
+
+        # every run goes into the fleet results database, None to leave it out
+        self.results_database = results_database
+
+        # with defer_report only the report data is written, the pdf is rendered by whoever started the run
+        self.defer_report = defer_report
+        self.report_data_file = None
+
+        # filled in by detectAndReportScaleBars
+        self.scale_bar_result = None
+        self.pairwise_result = None
+        self.rms_error_percentage = None
+        self.has_passed = None
+
+        self.checkpoint = PipelineCheckpoint(self.output_folder, self.serial_id)
+        self.stage_hashes = self.computeStageHashes()
+        # set once a stage had to run, every stage after it has to run as well
+        self.stages_invalidated = False
+        self.last_project_file = None
+
+    def save(self):
+        with self.profiler.measure("save"):
+            self.doc.save(self.output_file)
+            self.doc.open(self.output_file)
+        self.profiler.write(self.timings_file)
+
+    def findResumableOutputFolder(self):
+        # output folders are time stamped so the last one in name order is the newest
+        checkpoints = sorted(glob.glob(os.path.join(
+            glob.escape(self.image_folder), "{}_Verification-*".format(self.serial_id), "{}_checkpoint.json".format(self.serial_id))))
+        if len(checkpoints) == 0:
+            return None
+        return os.path.dirname(checkpoints[-1])
+
+    def stageInputs(self, stage):
+        if stage == "align":
+            return {
+                "images": self.image_entries,
+                "pairs": self.pairing.pairs,
+                "calibration": self.calibration_bundle.content_hash,
+                "params": self.align_params,
+                # what the screen drops follows from the images (their size and mtime are hashed above) and its thresholds
+                "prescreen": self.image_screen.describe() if self.image_screen is not None else None,
+                "matching": self.match_pairs.describe() if self.match_pairs is not None else None,
+            }
+        if stage == "filter":
+            return {
+                "schedule": self.filter_schedule.describe(),
+                "thinning": self.thinner(None).describe() if self.tiepoint_budget is not None else None,
+                "baseline_check": self.baseline_check.describe() if self.baseline_check is not None else None,
+            }
+        if stage == "scalebars":
+            return {
+                "fixture": self.fixture.describe(),
+                "passing_error_in_percentage": self.passing_error_in_percentage,
+                "passing_single_measurment_error_percentage": self.passing_single_measurment_error_percentage,
+                "ground_truth": self.groundTruthContent(),
+            }
+        return {}
+
+    def groundTruthContent(self):
+        if self.ground_truth_file is None:
+            return None
+        with open(self.ground_truth_file) as filepointer:
+            return filepointer.read()
+
+    def computeStageHashes(self):
+        # every stage hash includes the one before it, so an upstream change invalidates everything downstream
+        stage_hashes = dict()
+        previous_hash = None
+        for stage in PIPELINE_STAGES:
+            previous_hash = hashInputs(previous_hash, stage, self.stageInputs(stage))
+            stage_hashes[stage] = previous_hash
+        return stage_hashes
+
+    def runStage(self, stage, function, save_project=True):
+        input_hash = self.stage_hashes[stage]
+
+        if not self.stages_invalidated and self.checkpoint.isDone(stage, input_hash):
+            print("skipping {}, already done for these inputs".format(stage))
+            self.profiler.skipped(stage)
+            if self.checkpoint.projectFile(stage) is not None:
+                self.last_project_file = self.checkpoint.projectFile(stage)
+            return self.checkpoint.result(stage)
+
+        if not self.stages_invalidated:
+            self.stages_invalidated = True
+            self.checkpoint.invalidate(PIPELINE_STAGES[PIPELINE_STAGES.index(stage):])
+
+            # restart from the project the last finished stage saved
+            if self.last_project_file is not None:
+                print("reopening {}".format(self.last_project_file))
+                self.load(self.last_project_file)
+
+        print("running {}".format(stage))
+        # the only place the cloud is counted point by point, the steps inside pass counts they already have
+        with self.profiler.measure(stage, self.chunk, count_points=True):
+            result = function()
+
+            project_file = None
+            if save_project:
+                # every stage keeps its own copy of the project so a later stage can be redone from it
+                os.makedirs(self.output_folder, exist_ok=True)
+                project_file = os.path.join(self.output_folder, "{}_{}.psx".format(self.serial_id, stage))
+                with self.profiler.measure("save"):
+                    self.doc.save(project_file)
+                self.last_project_file = project_file
+
+        self.checkpoint.markDone(stage, input_hash, project_file, result)
+        # written after every stage so a crashed run still shows where the time went
+        self.profiler.write(self.timings_file)
+        return result
+
+    def scaleBarStage(self):
+        self.detectAndReportScaleBars()
+        result = {"passed": bool(self.has_passed), "rms_error_percentage": float(self.rms_error_percentage)}
+        if self.pairwise_result is not None:
+            result["pairwise"] = self.pairwise_result.summary()
+        return result
+
+    def loadCalibration(self):
+
+        print("loading calibration from {}".format(self.calibration_folder))
+
+        # the bundle was parsed (or taken from the local cache) when the analyzer was created
+        self.calibs["left"] = self.calibration_bundle.metashapeCalibration("left")
+        self.calibs["right"] = self.calibration_bundle.metashapeCalibration("right")
+        self.sensors = setupStereoSensors(self.chunk, self.calibration_bundle, offset_accuracy=1e-5)
+
+    def findImages(self):
+
+        # check to see if the folder / shortcut exists
+        if not os.path.exists(self.image_folder):
+            raise Exception("Verification image folder {} does not exist".format(self.image_folder))
+
+        print("finding images in {}".format(self.image_folder))
+
+        # recursively search for all images in the folder in one walk, or reuse the list from the last run
+        self.image_entries = discoverImages(self.image_folder, self.image_manifest_file)
+        images = [os.path.join(self.image_folder, entry[0]) for entry in self.image_entries]
+
+        # now associate the images into right and left pairs by the sequence number after CAL_ in the file name.
+        # Images without a partner are left out, a dropped frame would otherwise shift every pair after it
+        self.pairing = pairImages(images)
+        self.pairing.printSummary()
+        self.pairing.write(self.pairing_file)
+
+        if len(self.pairing.pairs) == 0:
+            raise Exception("No stereo pairs found in {}".format(self.image_folder))
+
+    def screenImages(self):
+        '''drops the frames with a blurry or black image from the pairing. Only run by the align stage, once the
+        images are in the project the screen can not change anything any more'''
+        quality_file = os.path.join(self.output_folder, "{}_image_quality.json".format(self.serial_id))
+        with self.profiler.measure("prescreen"):
+            rejected = self.image_screen.run(self.image_folder, self.image_entries, self.pairing, quality_file)
+        for sequence, reasons in sorted(rejected.items()):
+            print("dropping frame {}: {}".format(sequence, ", ".join(reasons)))
+
+        self.pairing.write(self.pairing_file)
+        if len(self.pairing.pairs) == 0:
+            raise Exception("No stereo pairs left in {} after the image quality screen".format(self.image_folder))
+        return rejected
+
+    def dropRejectedFrames(self, align_result):
+        # a skipped align stage still has to leave out the frames its screen dropped, later stages go by the pairing
+        rejected = (align_result or dict()).get("rejected", dict())
+        if len(rejected) > 0:
+            self.pairing.dropFrames({int(sequence): reasons for sequence, reasons in rejected.items()})
+            self.pairing.write(self.pairing_file)
+
+    def getFiles(self):
+        print("loading images from {}".format(self.image_folder))
+        sorted_images = self.pairing.images()
+
+        # create a list of filegroups. This is a list of integers that defines the multi-camera system groups. Basically it tells metashape that the first 2 images are a group, the next 2 are a group, etc.
+        filegroups = self.pairing.filegroups()
+
+        # images is alternating list of left and right paths
+        self.chunk.addPhotos(
+            sorted_images,
+            filegroups=filegroups,
+            layout=Metashape.MultiplaneLayout,
+            load_reference=False,
+        )
+
+        # a sensor is what we call a camera, and a camera in metashape is a "Pose" in the VSLAM world. So we need to assign the sensor to each "keyframe or camera" in the chunk
+        # the role of every image is already known from pairing, so this is a lookup per camera
+        unassigned = assignSensors(self.chunk.cameras, self.sensors, self.pairing.sensorIndex())
+        if len(unassigned) > 0:
+            raise Exception("{} cameras could not be assigned a sensor".format(len(unassigned)))
+
+    # the first part of making a model is to align the cameras and make a sparse point cloud
+    def align(self):
+        # sensors and photos only go into the chunk when we actually align, a resumed run gets them from the project
+        rejected = self.screenImages() if self.image_screen is not None else dict()
+        self.loadCalibration()
+        self.getFiles()
+
+        print(str(len(self.chunk.cameras)) + " images loaded")
+
+        if self.match_pairs is not None:
+            # we know the order the frames were taken in, so we tell metashape which pairs to match
+            with self.profiler.measure("match pairs"):
+                preselection = {
+                    "generic_preselection": False,
+                    "reference_preselection": False,
+                    # the quality screen already decoded every image, its descriptors save doing that again
+                    "pairs": self.match_pairs.cameraPairs(self.chunk.cameras, self.pairing,
+                                                          self.image_screen.descriptors if self.image_screen is not None else None),
+                }
+        else:
+            preselection = {
+                "generic_preselection": True, # enable or disable global matching of photos based on similarity
+                "reference_preselection": True, # enable or disable matching photos with some kind of prior knowledge. In this case we know every photo comes in order
+                "reference_preselection_mode": Metashape.ReferencePreselectionMode.ReferencePreselectionSequential,
+            }
+
+        with self.profiler.measure("matchPhotos", self.chunk):
+            self.chunk.matchPhotos(
+                downscale=self.align_params["downscale"],
+                keypoint_limit=self.align_params["keypoint_limit"],
+                tiepoint_limit=self.align_params["tiepoint_limit"],
+                **preselection
+            )
+        with self.profiler.measure("alignCameras", self.chunk):
+            self.chunk.alignCameras()
+
+        # kept with the checkpoint so a resumed run leaves out the same frames without screening again
+        return {"rejected": {str(sequence): reasons for sequence, reasons in rejected.items()}}
+
+    def load(self, file):
+        self.doc = Metashape.Document()
+        # self.doc.open(self.output_file)
+        self.doc.open(os.path.join(file))
+        self.chunk = self.doc.chunks[0]
+
+    def thinner(self, chunk):
+        return TiePointThinner(chunk, self.tiepoint_budget, profiler=self.profiler)
+
+    def filterBadPoints(self):
+        chunk = self.doc.chunks[0]
+        if self.baseline_check is not None:
+            with self.profiler.measure("baseline check", chunk):
+                self.baseline_check.chunk = chunk
+                self.baseline_check.run(self.baseline_file)
+        if self.tiepoint_budget is not None:
+            thinner = self.thinner(chunk)
+            with self.profiler.measure("thin", chunk, thinner.validCount):
+                self.thinning_summary = thinner.run()
+        TiePointFilter(chunk, self.filter_schedule, self.profiler).run()
+
+
+    def reportData(self):
+        # everything the verification pdf shows, as plain json so the pdf can be rendered later in another process
+        created = time.strftime("%Y-%m-%d_%H-%M-%S")
+        result = self.scale_bar_result
+        return {
+            "serial_id": self.serial_id,
+            "uuid": str(self.uuid),
+            "fixture_id": self.fixture.fixture_id,
+            "created": created,
+            "report_file": os.path.join(self.output_folder, "{}_Verification_Results_{}.pdf".format(self.serial_id, created)),
+            "scale_bars": result.rows(),
+            "rms_error_percentage": result.rms_error_percentage,
+            "passing_error_in_percentage": self.passing_error_in_percentage,
+            "passed": result.has_passed,
+            "pairwise": self.pairwise_result.toDict() if self.pairwise_result is not None else None,
+            "top_down_image": os.path.join(self.output_folder, "{}_top_down.png".format(self.serial_id)),
+            "timings": [
+                [record["name"], record["wall_s"], record["cpu_s"], record["peak_rss_mb"]]
+                for record in self.profiler.records if not record["skipped"]
+            ],
+        }
+
+    '''generate a report of the scale bar measurments'''
+    def generateReport(self):
+        from voyis.report import renderReport, writeReportData
+
+        data = self.reportData()
+        self.report_data_file = os.path.join(self.output_folder, "{}_report_data.json".format(self.serial_id))
+        writeReportData(data, self.report_data_file)
+
+        # a batch renders all its reports in one pool at the end
+        if not self.defer_report:
+            renderReport(data)
+
+        return self.has_passed
+
+    def detectAndReportScaleBars(self):
+        for chunk in self.doc.chunks:
+            distances = measureScaleBars(chunk, self.scale_bars, self.profiler)
+            self.scale_bar_result = ScaleBarResult(
+                self.scale_bars, distances, self.passing_error_in_percentage, self.passing_single_measurment_error_percentage)
+
+            # keep the summary around for batch runs
+            self.rms_error_percentage = self.scale_bar_result.rms_error_percentage
+            self.has_passed = self.scale_bar_result.has_passed
+
+            if self.ground_truth_file is not None:
+                with self.profiler.measure("pairwiseAccuracy"):
+                    self.measurePairwiseAccuracy(chunk)
+
+        self.dumpScaleBarsToJson()
+        # report the results
+        with self.profiler.measure("generateReport"):
+            return self.generateReport()
+    
+    def measurePairwiseAccuracy(self, chunk):
+        # the targets are already detected by measureScaleBars, this only reads their positions
+        labels, positions = markerPositions(chunk)
+        ground_truth_labels, ground_truth = loadGroundTruth(self.ground_truth_file)
+        self.pairwise_result = PairwiseAccuracy(labels, positions * chunk.transform.scale, ground_truth_labels, ground_truth)
+        self.pairwise_result.printSummary()
+        self.pairwise_result.write(os.path.join(self.output_folder, "{}_pairwise_accuracy.json".format(self.serial_id)))
+
+    def dumpScaleBarsToJson(self):
+        result_summary = dict()
+        result_summary[self.serial_id] = self.serial_id
+
+        result_summary.update(self.scale_bar_result.errorPercentByName())
+
+        # everything the results database needs to know about this run
+        result_summary["run"] = {
+            "run_uuid": str(self.uuid),
+            "serial_id": self.serial_id,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "fixture_id": self.fixture.fixture_id,
+            "passed": self.scale_bar_result.has_passed,
+            "rms_error_percentage": self.scale_bar_result.rms_error_percentage,
+            "bars": self.scale_bar_result.bars(),
+        }
+
+        os.makedirs(self.output_folder, exist_ok=True)
+        filename = os.path.join(self.output_folder, "{}_results.json".format(self.serial_id))
+        with open(filename, "w") as filepointer:
+            json.dump(result_summary, filepointer, indent=4)
+
+        self.recordResults(filename)
+
+    def recordResults(self, filename):
+        if self.results_database is None:
+            return
+
+        # the results file is the record of the run, a database that can not be reached is not worth failing a barscan over
+        try:
+            database = ResultsDatabase(self.results_database)
+            database.ingestFile(filename)
+            database.close()
+        except Exception as e:
+            print("could not add the results to {}: {}".format(self.results_database, e))
+
+    def takePhoto(self):
+        # Set the camera viewpoint for the top-down view
+        chunk = self.doc.chunks[0]
+        # Save the image
+        return chunk.renderPreview()
+
+    def buildModel(self):
+        chunk = self.doc.chunks[0]
+        chunk.buildModel(source_data=Metashape.TiePointsData)
+        chunk.reduceOverlap(overlap=30)
+
+        chunk.buildDepthMaps(downscale=1, filter_mode=Metashape.MildFiltering)
+        chunk.buildModel(source_data=Metashape.DepthMapsData)
+        chunk.buildUV(page_count=2, texture_size=4096)
+        chunk.buildTexture(texture_size=4096, ghosting_filter=True)
+      
+        img = self.takePhoto()
+        img.save(os.path.join(self.output_folder, "{}_top_down.png".format(self.serial_id)))
+
+    # dead code dont look
+    def estimateImageQuality(self):
+        import pandas as pd
+
+        self.chunk.analyzeImages()
+       
+        # create  pandas dataframe to hold the image quality stats
+        quality_vals = []
+
+
+        # loop through each image and get the quality stats and fill out the dataframe
+        for camera in self.chunk.cameras:
+            for frame in camera.frames:
+                quality_vals.append(
+                    {"Image": frame.photo.path, 
+                    "Quality": float(frame.meta["Image/Quality"])}
+                )
+
+        # create a pandas dataframe to process the data
+        quality_vals = pd.DataFrame(quality_vals)
+
+        return quality_vals
+    
+    def writeAgiSoftReport(self):
+        # export the agisoft report
+        with self.profiler.measure("exportReport"):
+            self.doc.chunks[0].exportReport(path=os.path.join(self.output_folder, f"{self.serial_id}_Agisoft_Report_Internal.pdf"),
+                                                title=f"{self.serial_id}")
+
+
+def processBarscan(validation_folder, camera_calibration_file, resume=True, ground_truth_file=None, fixture_id=DEFAULT_FIXTURE,
+                   defer_report=False, results_database=DEFAULT_DATABASE, filter_preset=DEFAULT_FILTER_PRESET, last_stage=None,
+                   rerun_from=None, prescreen=True, tiepoint_budget=None,
+                   baseline_check=True, match_mode=DEFAULT_MATCH_MODE):
+    '''runs the barscan of one verification folder. last_stage stops the pipeline after that stage, rerun_from
+    redoes that stage and everything after it even if the checkpoint says it is done'''
+    stages = selectStages(last_stage)
+    if rerun_from is not None and rerun_from not in PIPELINE_STAGES:
+        raise Exception("Unknown stage {}, the stages are {}".format(rerun_from, ", ".join(PIPELINE_STAGES)))
+
+    if not os.path.exists(validation_folder):
+        raise Exception("Validation folder {} does not exist".format(validation_folder))
+
+    if not os.path.exists(camera_calibration_file):
+        raise Exception("Camera calibration file {} does not exist".format(camera_calibration_file))
+    
+    if ground_truth_file is not None and not os.path.exists(ground_truth_file):
+        raise Exception("Ground truth file {} does not exist".format(ground_truth_file))
+
+    barscan = BarScanAnalizer(validation_folder, camera_calibration_file, resume=resume, ground_truth_file=ground_truth_file,
+                              fixture_id=fixture_id, defer_report=defer_report, results_database=results_database,
+                              filter_preset=filter_preset, prescreen=prescreen, tiepoint_budget=tiepoint_budget,
+                              baseline_check=baseline_check, match_mode=match_mode)
+    if rerun_from is not None:
+        barscan.checkpoint.invalidate(PIPELINE_STAGES[PIPELINE_STAGES.index(rerun_from):])
+
+    barscan.dropRejectedFrames(barscan.runStage("align", barscan.align))
+    if "filter" in stages:
+        barscan.runStage("filter", barscan.filterBadPoints)
+    if "scalebars" in stages:
+        summary = barscan.runStage("scalebars", barscan.scaleBarStage)
+        barscan.has_passed = summary["passed"]
+        barscan.rms_error_percentage = summary["rms_error_percentage"]
+
+    # turn this on to build a model.. but it will take an extra 10 minutes
+    # barscan.buildModel()
+    # barscan.save()
+    if "agisoft_report" in stages:
+        barscan.runStage("agisoft_report", barscan.writeAgiSoftReport, save_project=False)
+
+    # only write the final project if something changed
+    if barscan.stages_invalidated:
+        barscan.save()
+
+    if barscan.has_passed is None:
+        print("Stopped after {} for unit {}, no verdict yet".format(stages[-1], barscan.serial_id))
+    elif barscan.has_passed:
+        print("The barscan has passed for unit {}".format(barscan.serial_id))
+    else:
+        print("The barscan has failed for unit {}".format(barscan.serial_id))
+
+    return barscan
+
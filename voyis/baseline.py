@@ -0,0 +1,177 @@
+import os
+import json
+
+import numpy as np
+
+from voyis.calibration import slaveRotationAngles
+
+
+# how far an aligned stereo pair may be from the rig geometry of the calibration before it is taken out
+DEFAULT_MAX_ROTATION_DEG = 0.5
+DEFAULT_MAX_DIRECTION_DEG = 1.0
+# the baseline length is compared to the median of all pairs, the chunk has no scale before the scale bars
+DEFAULT_MAX_LENGTH_ERROR = 0.02
+# with more pairs than this off the rig it is the calibration or the check that is wrong, not the pairs
+DEFAULT_MAX_RESET_FRACTION = 0.1
+
+
+def transformArray(matrix, size=4):
+    # works on a Metashape.Matrix and anything else that takes [row, column]
+    return [[matrix[row, column] for column in range(size)] for row in range(size)]
+
+
+def referenceRotation(angles):
+    '''rotation matrix of a sensor reference rotation in degrees, the angles in the order the reference was given
+    them: R = Rz(angles[0]) Ry(angles[1]) Rx(angles[2])'''
+    first, second, third = np.radians(angles)
+    rz = np.array([[np.cos(first), -np.sin(first), 0], [np.sin(first), np.cos(first), 0], [0, 0, 1]])
+    ry = np.array([[np.cos(second), 0, np.sin(second)], [0, 1, 0], [-np.sin(second), 0, np.cos(second)]])
+    rx = np.array([[1, 0, 0], [0, np.cos(third), -np.sin(third)], [0, np.sin(third), np.cos(third)]])
+    return rz @ ry @ rx
+
+
+def sensorRotation(sensor):
+    # the rotation of a slave sensor in its master as alignment left it, None if it has none
+    if sensor is None or sensor.rotation is None:
+        return None
+    return np.array(transformArray(sensor.rotation, 3), dtype=float)
+
+
+def rotationAngles(rotations, reference):
+    '''angle in degrees between every rotation in an (n, 3, 3) stack and the reference rotation'''
+    difference = np.einsum("ji,njk->nik", reference, rotations)
+    cosine = (np.trace(difference, axis1=1, axis2=2) - 1.0) / 2.0
+    return np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
+
+
+def relativePoses(left, right):
+    '''pose of every right camera in its left camera, for (n, 4, 4) stacks of camera transforms'''
+    relative = np.linalg.inv(left) @ right
+    return relative[:, :3, :3], relative[:, :3, 3]
+
+
+class BaselineCheck:
+    '''compares the relative pose of every aligned left / right pair with the stereo offsets of the calibration,
+    all pairs in one go. Pairs that do not fit the rig are reset so they stay out of the filter and optimize loop,
+    unless so many do that the rig itself is the suspect. In a multi camera layout every right camera hangs off its
+    left one through the right sensor, so a rig that moved away from the calibration shows up as every pair off'''
+
+    def __init__(self, chunk, pairing, extrinsics, max_rotation_deg=DEFAULT_MAX_ROTATION_DEG,
+                 max_direction_deg=DEFAULT_MAX_DIRECTION_DEG, max_length_error=DEFAULT_MAX_LENGTH_ERROR, disable_outliers=True,
+                 max_reset_fraction=DEFAULT_MAX_RESET_FRACTION):
+        self.chunk = chunk
+        self.pairing = pairing
+        self.extrinsics = extrinsics
+        self.max_rotation_deg = max_rotation_deg
+        self.max_direction_deg = max_direction_deg
+        self.max_length_error = max_length_error
+        self.disable_outliers = disable_outliers
+        self.max_reset_fraction = max_reset_fraction
+
+    def describe(self):
+        return {
+            "max_rotation_deg": self.max_rotation_deg,
+            "max_direction_deg": self.max_direction_deg,
+            "max_length_error": self.max_length_error,
+            "disable_outliers": self.disable_outliers,
+            "max_reset_fraction": self.max_reset_fraction,
+        }
+
+    def alignedPairs(self):
+        '''sequence, left camera and right camera of every frame with both cameras aligned'''
+        # the offsets file only describes a stereo rig
+        if len(self.pairing.roles) != 2:
+            return []
+
+        cameras = {os.path.normpath(camera.photo.path): camera for camera in self.chunk.cameras}
+        pairs = []
+        for sequence, paths in self.pairing.pairs:
+            left = cameras.get(os.path.normpath(paths[0]))
+            right = cameras.get(os.path.normpath(paths[1]))
+            if left is None or right is None or left.transform is None or right.transform is None:
+                continue
+            pairs.append((sequence, left, right))
+        return pairs
+
+    def measure(self, pairs, expected_rotation):
+        '''rotation, baseline direction and baseline length error of every pair against the rig'''
+        left = np.array([transformArray(left.transform) for _, left, _ in pairs], dtype=float).reshape(-1, 4, 4)
+        right = np.array([transformArray(right.transform) for _, _, right in pairs], dtype=float).reshape(-1, 4, 4)
+        rotations, translations = relativePoses(left, right)
+
+        extrinsics = self.extrinsics
+        expected_translation = np.array([extrinsics["x"], extrinsics["y"], extrinsics["z"]], dtype=float)
+
+        lengths = np.linalg.norm(translations, axis=1)
+        directions = translations / np.maximum(lengths, 1e-12)[:, None]
+        expected_direction = expected_translation / max(np.linalg.norm(expected_translation), 1e-12)
+        median_length = float(np.median(lengths)) if len(lengths) > 0 else 0.0
+
+        return {
+            "rotation_deg": rotationAngles(rotations, expected_rotation),
+            "direction_deg": np.degrees(np.arccos(np.clip(directions @ expected_direction, -1.0, 1.0))),
+            "length_error": lengths / max(median_length, 1e-12) - 1.0,
+            # chunk units per meter of calibrated baseline, only a real scale once the chunk is referenced
+            "baseline_scale": median_length / max(np.linalg.norm(expected_translation), 1e-12),
+        }
+
+    def rigRotation(self, pairs, expected_rotation):
+        # how far alignment moved the right sensor away from the calibrated rotation, None without a sensor rotation
+        estimated = sensorRotation(pairs[0][2].sensor)
+        if estimated is None:
+            return None
+        return float(rotationAngles(estimated[None], expected_rotation)[0])
+
+    def run(self, output_file=None):
+        '''checks every aligned pair, resets the outliers if asked to and returns a summary'''
+        pairs = self.alignedPairs()
+        if len(pairs) == 0:
+            print("no aligned stereo pairs to check against the calibration")
+            return {"pairs": 0, "outliers": dict()}
+
+        # the calibrated rotation, never the one alignment estimated: that one agrees with the pairs by construction
+        expected_rotation = referenceRotation(slaveRotationAngles(self.extrinsics))
+        measured = self.measure(pairs, expected_rotation)
+        outliers = ((measured["rotation_deg"] > self.max_rotation_deg)
+                    | (measured["direction_deg"] > self.max_direction_deg)
+                    | (np.abs(measured["length_error"]) > self.max_length_error))
+
+        reset = self.disable_outliers
+        if reset and np.count_nonzero(outliers) > self.max_reset_fraction * len(pairs):
+            print("stereo baseline: {} of {} pairs off the rig geometry, more than {:.0%}. Not resetting any, check the calibration".format(
+                np.count_nonzero(outliers), len(pairs), self.max_reset_fraction))
+            reset = False
+
+        details = dict()
+        for index in np.flatnonzero(outliers):
+            sequence, left, right = pairs[index]
+            details[str(sequence)] = {
+                "rotation_deg": float(measured["rotation_deg"][index]),
+                "direction_deg": float(measured["direction_deg"][index]),
+                "length_error": float(measured["length_error"][index]),
+            }
+            if reset:
+                # an unaligned camera takes no part in optimizeCameras, better than one pulling the whole rig around
+                left.transform = None
+                right.transform = None
+
+        summary = {
+            "thresholds": self.describe(),
+            "pairs": len(pairs),
+            "baseline_scale": measured["baseline_scale"],
+            "median_rotation_deg": float(np.median(measured["rotation_deg"])),
+            "median_direction_deg": float(np.median(measured["direction_deg"])),
+            "max_length_error": float(np.max(np.abs(measured["length_error"]))),
+            "rig_rotation_deg": self.rigRotation(pairs, expected_rotation),
+            "reset": reset and len(details) > 0,
+            "outliers": details,
+        }
+        print("stereo baseline: {} of {} pairs off the rig geometry{}".format(
+            len(details), len(pairs), ", reset" if summary["reset"] else ""))
+
+        if output_file is not None:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+            with open(output_file, "w") as filepointer:
+                json.dump(summary, filepointer, indent=4)
+
+        return summary
@@ -0,0 +1,147 @@
+import os
+import time
+import json
+
+from pqdm.processes import pqdm
+
+from voyis.barscan import DEFAULT_FILTER_PRESET, processBarscan, getSerialIdFromFolder
+from voyis.fixtures import DEFAULT_FIXTURE
+
+
+# verification folders are named Stills_<serial>, e.g. Stills_000123456
+STILLS_FOLDER_PREFIX = "Stills_"
+
+
+def defaultWorkerCount():
+    # align and optimize are already multi threaded inside metashape, so only use a share of the cores.
+    # The gain comes from overlapping the single threaded stages (loading, marker detection, saving, reports)
+    return max(1, (os.cpu_count() or 1) // 4)
+
+
+def findVerificationFolders(root_folder):
+    # walk the root once and collect every Stills_<serial> folder we can get a serial id from
+    folders = []
+    for dirpath, dirnames, _ in os.walk(root_folder):
+        for dirname in sorted(dirnames):
+            if not dirname.startswith(STILLS_FOLDER_PREFIX):
+                continue
+
+            try:
+                getSerialIdFromFolder(dirname)
+            except AttributeError:
+                print("skipping {}, no serial id in folder name".format(dirname))
+                continue
+
+            folders.append(os.path.join(dirpath, dirname))
+
+        # dont look inside the stills folders, they only hold images and previous results
+        dirnames[:] = [d for d in dirnames if not d.startswith(STILLS_FOLDER_PREFIX)]
+
+    return sorted(folders)
+
+
+def newBatchResult(verification_folder):
+    return {
+        "serial_id": None,
+        "verification_folder": verification_folder,
+        "output_folder": None,
+        "passed": False,
+        "rms_error_percentage": None,
+        "duration_s": None,
+        "report_data_file": None,
+        "report_file": None,
+        "error": None,
+    }
+
+
+def runBarscanWorker(verification_folder, camera_calibration_folder, fixture_id=DEFAULT_FIXTURE, filter_preset=DEFAULT_FILTER_PRESET):
+    # runs in a worker process. Every worker builds its own BarScanAnalizer and with it its own Metashape.Document
+    summary = newBatchResult(verification_folder)
+
+    start = time.time()
+    try:
+        summary["serial_id"] = getSerialIdFromFolder(os.path.basename(verification_folder))
+        # the pdf is left for the end of the batch, see renderBatchReports
+        barscan = processBarscan(verification_folder, camera_calibration_folder, fixture_id=fixture_id, defer_report=True,
+                                 filter_preset=filter_preset)
+        summary["output_folder"] = barscan.output_folder
+        summary["report_data_file"] = barscan.report_data_file
+        summary["passed"] = bool(barscan.has_passed)
+        summary["rms_error_percentage"] = barscan.rms_error_percentage
+    except Exception as e:
+        # one broken unit should not take the rest of the batch down with it
+        print("barscan failed for {}: {}".format(verification_folder, e))
+        summary["error"] = repr(e)
+
+    summary["duration_s"] = time.time() - start
+    return summary
+
+
+def renderBatchReports(results, n_jobs=None):
+    # runs whose scale bar stage was skipped on resume already have their pdf
+    from voyis.report import renderReportFiles
+
+    pending = [result for result in results if result["report_data_file"] is not None]
+    print("rendering {} reports".format(len(pending)))
+    for result, report_file in zip(pending, renderReportFiles([result["report_data_file"] for result in pending], n_jobs)):
+        if isinstance(report_file, Exception):
+            print("report failed for {}: {}".format(result["verification_folder"], report_file))
+            result["error"] = result["error"] or repr(report_file)
+        else:
+            result["report_file"] = report_file
+
+
+def writeBatchSummary(root_folder, results):
+    os.makedirs(root_folder, exist_ok=True)
+    filename = os.path.join(root_folder, "Barscan_Batch_Summary_{}.json".format(time.strftime("%Y-%m-%d_%H-%M-%S")))
+
+    summary = {
+        "units": len(results),
+        "passed": sum(1 for r in results if r["passed"]),
+        "failed": sum(1 for r in results if not r["passed"] and r["error"] is None),
+        "errors": sum(1 for r in results if r["error"] is not None),
+        "results": results,
+    }
+
+    with open(filename, "w") as filepointer:
+        json.dump(summary, filepointer, indent=4)
+
+    return filename
+
+
+def processBarscanBatch(root_folder, camera_calibration_folder, n_jobs=None, fixture_id=DEFAULT_FIXTURE, filter_preset=DEFAULT_FILTER_PRESET):
+    if not os.path.exists(root_folder):
+        raise Exception("Batch root folder {} does not exist".format(root_folder))
+
+    if not os.path.exists(camera_calibration_folder):
+        raise Exception("Camera calibration folder {} does not exist".format(camera_calibration_folder))
+
+    folders = findVerificationFolders(root_folder)
+    if len(folders) == 0:
+        raise Exception("No {}<serial> folders found in {}".format(STILLS_FOLDER_PREFIX, root_folder))
+
+    if n_jobs is None:
+        n_jobs = defaultWorkerCount()
+    n_jobs = max(1, min(n_jobs, len(folders)))
+
+    print("processing {} verification folders with {} workers".format(len(folders), n_jobs))
+
+    args = [
+        {"verification_folder": folder, "camera_calibration_folder": camera_calibration_folder, "fixture_id": fixture_id,
+         "filter_preset": filter_preset}
+        for folder in folders
+    ]
+    results = pqdm(args, runBarscanWorker, n_jobs=n_jobs, argument_type="kwargs")
+
+    # pqdm hands back the exception instead of a summary if a worker process itself died
+    for i, (folder, result) in enumerate(zip(folders, results)):
+        if isinstance(result, Exception):
+            results[i] = newBatchResult(folder)
+            results[i]["error"] = repr(result)
+
+    renderBatchReports(results)
+
+    filename = writeBatchSummary(root_folder, results)
+    print("batch summary written to {}".format(filename))
+
+    return results
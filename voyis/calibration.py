@@ -0,0 +1,288 @@
+import Metashape
+import os
+import glob
+import json
+import hashlib
+
+
+# where parsed calibration bundles are kept between runs. Local disk, the calibration folders are often on a slow share
+DEFAULT_CACHE_FOLDER = os.environ.get(
+    "VOYIS_CALIBRATION_CACHE", os.path.join(os.path.expanduser("~"), ".voyis", "calibration_cache"))
+DEFAULT_CACHE_ENTRIES = 256
+
+# the parts of a Metashape.Calibration we carry around
+CALIBRATION_FIELDS = ["width", "height", "f", "cx", "cy", "b1", "b2", "k1", "k2", "k3", "k4", "p1", "p2", "p3", "p4"]
+SENSOR_TYPES = {
+    "Frame": Metashape.Sensor.Type.Frame,
+    "Fisheye": Metashape.Sensor.Type.Fisheye,
+    "Spherical": Metashape.Sensor.Type.Spherical,
+    "Cylindrical": Metashape.Sensor.Type.Cylindrical,
+}
+EXTRINSIC_FIELDS = ["x", "y", "z", "Omega", "Kappa", "Phi"]
+
+OFFSETS_FILE = "AgisoftSlaveOffsets.json"
+
+
+def calibrationFiles(calibration_folder, serial_id=None):
+    '''the cam0 / cam1 / stereo offsets files of a unit. Without a serial id the folder has to hold exactly one unit'''
+    if serial_id is None:
+        left_files = glob.glob(os.path.join(glob.escape(calibration_folder), "*_cam0.xml"))
+        if len(left_files) != 1:
+            raise Exception("Expected one *_cam0.xml in {}, found {}".format(calibration_folder, len(left_files)))
+        serial_id = os.path.basename(left_files[0])[:-len("_cam0.xml")]
+
+    return serial_id, {
+        "left": os.path.join(calibration_folder, "{}_cam0.xml".format(serial_id)),
+        "right": os.path.join(calibration_folder, "{}_cam1.xml".format(serial_id)),
+        "offsets": os.path.join(calibration_folder, OFFSETS_FILE),
+    }
+
+
+def fileStats(files):
+    stats = dict()
+    for key, path in files.items():
+        stat = os.stat(path)
+        stats[key] = [os.path.normpath(path), stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def hashFiles(files):
+    digest = hashlib.sha256()
+    for key in sorted(files):
+        with open(files[key], "rb") as filepointer:
+            digest.update(key.encode("utf-8"))
+            digest.update(filepointer.read())
+    return digest.hexdigest()
+
+
+def calibrationToDict(calib):
+    values = {field: getattr(calib, field) for field in CALIBRATION_FIELDS}
+    values["type"] = next(name for name, sensor_type in SENSOR_TYPES.items() if sensor_type == calib.type)
+    return values
+
+
+def parseBundle(files):
+    # the one place the calibration files are actually parsed and checked
+    calibrations = dict()
+    for role in ["left", "right"]:
+        calib = Metashape.Calibration()
+        calib.load(files[role])
+        values = calibrationToDict(calib)
+        if values["width"] <= 0 or values["height"] <= 0 or values["f"] <= 0:
+            raise Exception("Calibration {} has no valid image size or focal length".format(files[role]))
+        calibrations[role] = values
+
+    with open(files["offsets"]) as f:
+        extrinsics = json.load(f)
+    missing = [field for field in EXTRINSIC_FIELDS if field not in extrinsics]
+    if len(missing) > 0:
+        raise Exception("Stereo offsets {} are missing {}".format(files["offsets"], ", ".join(missing)))
+
+    return calibrations, {field: float(extrinsics[field]) for field in EXTRINSIC_FIELDS}
+
+
+class CalibrationBundle:
+    '''the parsed intrinsics of both cameras and the stereo offsets of one unit'''
+
+    def __init__(self, serial_id, content_hash, calibrations, extrinsics, files):
+        self.serial_id = serial_id
+        self.content_hash = content_hash
+        self.calibrations = calibrations
+        self.extrinsics = extrinsics
+        self.files = files
+
+    def metashapeCalibration(self, role):
+        values = self.calibrations[role]
+        calib = Metashape.Calibration()
+        calib.type = SENSOR_TYPES[values["type"]]
+        for field in CALIBRATION_FIELDS:
+            setattr(calib, field, values[field])
+        return calib
+
+    def toDict(self):
+        return {
+            "serial_id": self.serial_id,
+            "content_hash": self.content_hash,
+            "calibrations": self.calibrations,
+            "extrinsics": self.extrinsics,
+            "files": self.files,
+        }
+
+    @staticmethod
+    def fromDict(values):
+        return CalibrationBundle(values["serial_id"], values["content_hash"], values["calibrations"], values["extrinsics"], values["files"])
+
+
+class CalibrationCache:
+    '''parsed calibration bundles on local disk, one small json per serial and content hash.
+    The least recently used entries are dropped once there are more than max_entries'''
+
+    def __init__(self, folder=DEFAULT_CACHE_FOLDER, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.folder = folder
+        self.max_entries = max_entries
+
+    def entryFile(self, serial_id, content_hash):
+        return os.path.join(self.folder, "{}_{}.json".format(serial_id, content_hash[:16]))
+
+    def read(self, filename):
+        try:
+            with open(filename) as filepointer:
+                bundle = CalibrationBundle.fromDict(json.load(filepointer))
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # mark as recently used
+        os.utime(filename)
+        return bundle
+
+    def findByStats(self, serial_id, stats):
+        # unchanged files (same size and mtime) are found without reading them from the share at all
+        for filename in glob.glob(os.path.join(glob.escape(self.folder), "{}_*.json".format(serial_id))):
+            bundle = self.read(filename)
+            if bundle is not None and bundle.files == stats:
+                return bundle
+        return None
+
+    def findByHash(self, serial_id, content_hash):
+        filename = self.entryFile(serial_id, content_hash)
+        if not os.path.exists(filename):
+            return None
+        return self.read(filename)
+
+    def store(self, bundle):
+        os.makedirs(self.folder, exist_ok=True)
+        filename = self.entryFile(bundle.serial_id, bundle.content_hash)
+
+        # batch workers share the cache, so write to a temp file and swap it in
+        temp_filename = "{}.{}.tmp".format(filename, os.getpid())
+        with open(temp_filename, "w") as filepointer:
+            json.dump(bundle.toDict(), filepointer, indent=4)
+        os.replace(temp_filename, filename)
+
+        self.evict()
+
+    def evict(self):
+        entries = glob.glob(os.path.join(glob.escape(self.folder), "*.json"))
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort(key=lambda filename: os.stat(filename).st_mtime)
+        for filename in entries[:len(entries) - self.max_entries]:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                # another worker got to it first
+                pass
+
+
+def loadCalibrationBundle(calibration_folder, serial_id=None, cache=None):
+    '''returns the CalibrationBundle of a unit, from the cache when the files did not change'''
+    if not os.path.exists(calibration_folder):
+        raise Exception("Calibration folder does not exist {}".format(calibration_folder))
+
+    cache = cache if cache is not None else CalibrationCache()
+    serial_id, files = calibrationFiles(calibration_folder, serial_id)
+    for path in files.values():
+        if not os.path.exists(path):
+            raise Exception("Calibration file does not exist {}".format(path))
+
+    stats = fileStats(files)
+    bundle = cache.findByStats(serial_id, stats)
+    if bundle is not None:
+        return bundle
+
+    content_hash = hashFiles(files)
+    bundle = cache.findByHash(serial_id, content_hash)
+    if bundle is None:
+        print("parsing calibration for {} from {}".format(serial_id, calibration_folder))
+        calibrations, extrinsics = parseBundle(files)
+        bundle = CalibrationBundle(serial_id, content_hash, calibrations, extrinsics, stats)
+    else:
+        # same content, copied or touched since. Remember the new stats so the next run skips the read
+        bundle.files = stats
+
+    cache.store(bundle)
+    return bundle
+
+
+def slaveRotationAngles(extrinsics):
+    '''the stereo rotation of the offsets file in the order the right sensor reference takes it. Anything comparing
+    against the calibrated rotation has to use this order too'''
+    return [extrinsics["Omega"], extrinsics["Kappa"], extrinsics["Phi"]]
+
+
+def setupStereoSensors(chunk, bundle, offset_accuracy):
+    '''adds the left and right sensors to the chunk, with the unit's calibration and the right sensor
+    solidly attached to the left one by the stereo offsets'''
+    sensors = dict()
+    sensors["left"] = chunk.addSensor()
+    sensors["right"] = chunk.addSensor()
+    sensors["left"].label = "left"
+    sensors["right"].label = "right"
+    sensors["right"].master = sensors["left"]
+
+    for sensor in sensors.keys():
+        calib = bundle.metashapeCalibration(sensor)
+        sensors[sensor].width = calib.width
+        sensors[sensor].height = calib.height
+        sensors[sensor].type = calib.type
+        sensors[sensor].user_calib = calib
+        sensors[sensor].fixed = True
+
+    # the stereo calibration offsets
+    extrinsics = bundle.extrinsics
+
+    sensors["right"].reference.enabled = True
+
+    # you MUST set this.. and its does not match gui and it is not documented at all. Like at all
+    # this is the same as checking "adjust location" in the gui / camera calibration tab under slave offsets
+    # I would like the last 4 hours of my life back please
+    sensors["right"].fixed_location = False
+    sensors["right"].fixed_rotation = False
+
+    # yes.. you have to set this for the left sensor too. In soviet Russia left sensor moves you. Dont know why. Dont ask why. Just do it.
+    sensors["left"].fixed_location = False
+
+    # set the rotation and translation for the right sensor and set accuracy to a high value to be "constant"
+    # In soviet Russia, nothing is fixed! Just solidly attached to the left sensor
+    sensors["right"].reference.location = Metashape.Vector(
+        [extrinsics["x"], extrinsics["y"], extrinsics["z"]]
+    )
+    sensors["right"].reference.location_accuracy = Metashape.Vector(
+        [offset_accuracy, offset_accuracy, offset_accuracy]
+    )
+    sensors["right"].reference.location_enabled = True
+
+    # at least this part makes some sense. Had to find it by looking at the python console output. Like a real programmer.
+    sensors["right"].reference.rotation = Metashape.Vector(slaveRotationAngles(extrinsics))
+    sensors["right"].reference.rotation_accuracy = Metashape.Vector(
+        [offset_accuracy, offset_accuracy, offset_accuracy]
+    )
+    sensors["right"].reference.rotation_enabled = True
+
+    sensors["right"].location = Metashape.Vector(
+        [extrinsics["x"], extrinsics["y"], extrinsics["z"]]
+    )
+    sensors["right"].rotation = Metashape.Matrix(
+        [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0, 0, 1.0]]
+    )
+
+    return sensors
+
+
+def loadStereoCalibration(calibration_folder, chunk, sensor_index=None, offset_accuracy=1e-6):
+    '''sets the stereo calibration of a unit on every camera already in the chunk. Returns the cameras whose
+    sensor could not be told from their file name, those are left unchanged'''
+    from voyis.pairing import sensorIndex, assignSensors
+
+    # check to see if the calibration file exists, parse it or take it from the local cache
+    bundle = loadCalibrationBundle(calibration_folder)
+
+    # create the sensors and set the calibration and the stereo calibration offsets
+    sensors = setupStereoSensors(chunk, bundle, offset_accuracy=offset_accuracy)
+
+    # the role of each image is parsed once from its file name, unless the caller already has the index from pairing the images
+    if sensor_index is None:
+        sensor_index = sensorIndex(cam.photo.path for cam in chunk.cameras)
+
+    return assignSensors(chunk.cameras, sensors, sensor_index)
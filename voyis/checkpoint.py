@@ -0,0 +1,59 @@
+import os
+import time
+import json
+import hashlib
+
+
+def hashInputs(*inputs):
+    # anything json can dump can be part of a stage hash. Keys are sorted so dict order does not matter
+    text = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class PipelineCheckpoint:
+    '''keeps track of which pipeline stages finished in an output folder and what their inputs were'''
+
+    def __init__(self, output_folder, serial_id):
+        self.filename = os.path.join(output_folder, "{}_checkpoint.json".format(serial_id))
+        self.stages = dict()
+
+        if os.path.exists(self.filename):
+            with open(self.filename) as filepointer:
+                self.stages = json.load(filepointer)["stages"]
+
+    def isDone(self, stage, input_hash):
+        entry = self.stages.get(stage)
+        if entry is None or entry["input_hash"] != input_hash:
+            return False
+
+        # the saved project is what later stages restart from, so it has to still be there
+        return entry["project_file"] is None or os.path.exists(entry["project_file"])
+
+    def projectFile(self, stage):
+        return self.stages[stage]["project_file"]
+
+    def result(self, stage):
+        return self.stages[stage]["result"]
+
+    def markDone(self, stage, input_hash, project_file=None, result=None):
+        self.stages[stage] = {
+            "input_hash": input_hash,
+            "project_file": project_file,
+            "result": result,
+            "completed": time.strftime("%Y-%m-%d_%H-%M-%S"),
+        }
+        self.save()
+
+    def invalidate(self, stages):
+        for stage in stages:
+            self.stages.pop(stage, None)
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+
+        # write to a temp file first so a crash mid write does not leave a broken checkpoint behind
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w") as filepointer:
+            json.dump({"stages": self.stages}, filepointer, indent=4)
+        os.replace(temp_filename, self.filename)
@@ -0,0 +1,179 @@
+# Headless entry point for the barscan and the tie point filter, for render nodes and scheduled jobs where
+# there is nobody to click through the menu dialogs. Runs with Metashape's own python:
+#
+#   metashape.sh -platform offscreen -r /path/to/voyis/cli.py barscan /data/Stills_230900123 --calibration /data/AgisoftParams
+#
+# or with the standalone Metashape module installed:
+#
+#   python -m voyis.cli batch /data/verification --calibration /data/AgisoftParams --workers 4
+#
+# exit codes: 0 passed (or stopped before the verdict as asked), 1 verification failed, 2 bad arguments,
+# 3 something went wrong before there was a verdict
+
+import os
+import sys
+import argparse
+import traceback
+
+# run as a file (metashape.sh -r) the folder holding the voyis package is not on the path yet
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Metashape
+
+from voyis.barscan import DEFAULT_FILTER_PRESET, PIPELINE_STAGES
+from voyis.fixtures import DEFAULT_FIXTURE, registry
+from voyis.matching import DEFAULT_MATCH_MODE, MATCH_MODES
+from voyis.results import DEFAULT_DATABASE
+from voyis.tiepoints import SCHEDULE_PRESETS
+
+
+EXIT_PASSED = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_ERROR = 3
+
+
+def openProject(project_file, chunk_index=None):
+    if not os.path.exists(project_file):
+        raise Exception("Project {} does not exist".format(project_file))
+
+    doc = Metashape.Document()
+    doc.open(project_file)
+    if len(doc.chunks) == 0:
+        raise Exception("Empty project!")
+    chunk = doc.chunks[chunk_index] if chunk_index is not None else (doc.chunk or doc.chunks[0])
+    return doc, chunk
+
+
+def saveProject(doc, output_file):
+    if output_file is None:
+        doc.save()
+    else:
+        doc.save(output_file)
+    print("saved {}".format(output_file or "the project"))
+
+
+def runBarscan(args):
+    from voyis.barscan import processBarscan
+
+    barscan = processBarscan(
+        args.stills_folder,
+        args.calibration,
+        resume=not args.no_resume,
+        ground_truth_file=args.ground_truth,
+        fixture_id=args.fixture,
+        defer_report=args.defer_report,
+        results_database=None if args.no_results_db else args.results_db,
+        filter_preset=args.filter_preset,
+        last_stage=args.until,
+        rerun_from=args.rerun_from,
+        prescreen=not args.no_prescreen,
+        tiepoint_budget=args.tiepoint_budget,
+        baseline_check=not args.no_baseline_check,
+        match_mode=args.match_mode,
+    )
+    print("output folder: {}".format(barscan.output_folder))
+    return EXIT_FAILED if barscan.has_passed is False else EXIT_PASSED
+
+
+def runBatch(args):
+    from voyis.batch import processBarscanBatch
+
+    results = processBarscanBatch(args.root, args.calibration, n_jobs=args.workers, fixture_id=args.fixture, filter_preset=args.filter_preset)
+    if any(result["error"] is not None for result in results):
+        return EXIT_ERROR
+    return EXIT_PASSED if all(result["passed"] for result in results) else EXIT_FAILED
+
+
+def runFilter(args):
+    from voyis.profiling import StageProfiler
+    from voyis.tiepoints import TiePointFilter
+
+    doc, chunk = openProject(args.project, args.chunk)
+    profiler = StageProfiler()
+    if args.tiepoint_budget is not None:
+        from voyis.thinning import TiePointThinner
+
+        thinner = TiePointThinner(chunk, args.tiepoint_budget, profiler=profiler)
+        with profiler.measure("thin", chunk, thinner.validCount):
+            thinner.run()
+    TiePointFilter(chunk, SCHEDULE_PRESETS[args.preset](), profiler).run()
+    profiler.printSummary()
+    saveProject(doc, args.output)
+    return EXIT_PASSED
+
+
+def runCalibration(args):
+    from voyis.calibration import loadStereoCalibration
+
+    doc, chunk = openProject(args.project, args.chunk)
+    unassigned = loadStereoCalibration(args.calibration, chunk)
+    for cam in unassigned:
+        print("could not tell the sensor of {}, left unchanged".format(cam.photo.path))
+    saveProject(doc, args.output)
+    return EXIT_PASSED
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(prog="voyis.cli", description="Voyis barscan verification and tie point filtering without the GUI")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def addBarscanOptions(command):
+        command.add_argument("--calibration", required=True, help="calibration folder (AgisoftParams)")
+        command.add_argument("--fixture", default=DEFAULT_FIXTURE, choices=registry.fixtureIds())
+        command.add_argument("--filter-preset", default=DEFAULT_FILTER_PRESET, choices=sorted(SCHEDULE_PRESETS))
+
+    barscan = commands.add_parser("barscan", help="verify one unit from its Stills_<serial> folder")
+    barscan.add_argument("stills_folder")
+    addBarscanOptions(barscan)
+    barscan.add_argument("--ground-truth", default=None, help="fixture ground truth file for the all pairs report, the fixture's own distances by default")
+    barscan.add_argument("--until", default=None, choices=PIPELINE_STAGES, help="stop after this stage")
+    barscan.add_argument("--rerun-from", default=None, choices=PIPELINE_STAGES, help="redo this stage and every one after it")
+    barscan.add_argument("--match-mode", default=DEFAULT_MATCH_MODE, choices=MATCH_MODES,
+                         help="sequential matches each frame with its neighbours and a few look alikes, for long captures")
+    barscan.add_argument("--no-prescreen", action="store_true", help="keep blurry and black frames")
+    barscan.add_argument("--no-baseline-check", action="store_true", help="keep stereo pairs that do not fit the calibrated offsets")
+    barscan.add_argument("--tiepoint-budget", type=int, default=None, help="thin the tie points to about this many before filtering")
+    barscan.add_argument("--no-resume", action="store_true", help="start a new output folder instead of resuming the last one")
+    barscan.add_argument("--defer-report", action="store_true", help="only write the report data, not the pdf")
+    barscan.add_argument("--results-db", default=DEFAULT_DATABASE)
+    barscan.add_argument("--no-results-db", action="store_true", help="leave this run out of the results database")
+    barscan.set_defaults(run=runBarscan)
+
+    batch = commands.add_parser("batch", help="verify every Stills_<serial> folder under a root")
+    batch.add_argument("root")
+    addBarscanOptions(batch)
+    batch.add_argument("--workers", type=int, default=None)
+    batch.set_defaults(run=runBatch)
+
+    filter = commands.add_parser("filter", help="filter the tie points of a saved project")
+    filter.add_argument("project")
+    filter.add_argument("--preset", default="cleaner", choices=sorted(SCHEDULE_PRESETS))
+    filter.add_argument("--tiepoint-budget", type=int, default=None, help="thin the tie points to about this many before filtering")
+    filter.add_argument("--chunk", type=int, default=None, help="chunk index, the active chunk if not given")
+    filter.add_argument("--output", default=None, help="save to this project instead of over the original")
+    filter.set_defaults(run=runFilter)
+
+    calibration = commands.add_parser("calibration", help="load a unit's stereo calibration into a saved project")
+    calibration.add_argument("project")
+    calibration.add_argument("--calibration", required=True, help="calibration folder (AgisoftParams)")
+    calibration.add_argument("--chunk", type=int, default=None)
+    calibration.add_argument("--output", default=None)
+    calibration.set_defaults(run=runCalibration)
+
+    return parser
+
+
+def main(argv=None):
+    args = buildParser().parse_args(argv)
+    try:
+        return args.run(args)
+    except Exception:
+        # the whole trace, a render node log is the only place anyone will see it
+        traceback.print_exc()
+        return EXIT_ERROR
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
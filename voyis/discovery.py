@@ -0,0 +1,150 @@
+import os
+import json
+
+
+# jpegs are what we normally get, tifs are only used when a folder has no jpegs at all
+JPEG_EXTENSIONS = {".jpg", ".jpeg"}
+TIF_EXTENSIONS = {".tif"}
+
+
+def isSkippedFolder(name):
+    # our own output folders and metashape's project data can hold thousands of files and never any input images
+    return "_Verification-" in name or name.endswith(".files")
+
+
+def imageExtension(name):
+    # the lower case extension if name is an image, otherwise None. Called for every file, so no os.path.splitext
+    extension = name[name.rfind("."):].lower() if "." in name else ""
+    return extension if extension in JPEG_EXTENSIONS or extension in TIF_EXTENSIONS else None
+
+
+def listFolder(path):
+    # the entries of one folder that matter for discovery: images (with their extension) and the sub folders we walk into
+    folders = []
+    images = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if not isSkippedFolder(entry.name):
+                    folders.append(entry)
+            else:
+                extension = imageExtension(entry.name)
+                if extension is not None:
+                    images.append((entry, extension))
+    return folders, images
+
+
+def walkImages(folder):
+    '''one recursive scandir pass over folder. Returns the images by extension as [relative path, size, mtime_ns]
+    and, for every folder that was walked, its mtime and relevant entries so a rerun can tell whether anything changed'''
+    images = dict()
+    directories = dict()
+
+    # relative paths are built up while walking, os.path.relpath on every file cost more than the walk itself
+    pending = [(folder, "")]
+    while pending:
+        current, relative = pending.pop()
+        folders, files = listFolder(current)
+
+        directories[relative or "."] = {
+            "mtime": os.stat(current).st_mtime_ns,
+            "entries": sorted([entry.name for entry in folders] + [entry.name for entry, _ in files]),
+        }
+        prefix = relative + os.sep if relative else ""
+        pending.extend((entry.path, prefix + entry.name) for entry in folders)
+
+        for entry, extension in files:
+            stat = entry.stat()
+            images.setdefault(extension, []).append([prefix + entry.name, stat.st_size, stat.st_mtime_ns])
+
+    return images, directories
+
+
+def selectImages(images):
+    selected = [image for extension in JPEG_EXTENSIONS for image in images.get(extension, [])]
+    if len(selected) == 0:
+        selected = [image for extension in TIF_EXTENSIONS for image in images.get(extension, [])]
+    return sorted(selected)
+
+
+def refreshImages(folder, images):
+    '''updates size and mtime of images replaced in place under the same name, which leaves the folder listing
+    alone. Returns False if an image is gone'''
+    changed = False
+    for image in images:
+        try:
+            stat = os.stat(os.path.join(folder, image[0]))
+        except FileNotFoundError:
+            return False, changed
+        if stat.st_size != image[1] or stat.st_mtime_ns != image[2]:
+            image[1] = stat.st_size
+            image[2] = stat.st_mtime_ns
+            changed = True
+    return True, changed
+
+
+def loadManifest(manifest_file, folder):
+    # a manifest is only reused if none of the walked folders changed since it was written
+    if manifest_file is None or not os.path.exists(manifest_file):
+        return None
+
+    with open(manifest_file) as filepointer:
+        manifest = json.load(filepointer)
+
+    if manifest["root"] != os.path.normpath(folder):
+        return None
+
+    for directory, recorded in manifest["directories"].items():
+        path = os.path.join(folder, directory)
+        try:
+            if os.stat(path).st_mtime_ns == recorded["mtime"]:
+                continue
+
+            # the folder changed, e.g. because an output folder was added. Only list this one folder to check
+            folders, files = listFolder(path)
+        except FileNotFoundError:
+            return None
+
+        if sorted([entry.name for entry in folders] + [entry.name for entry, _ in files]) != recorded["entries"]:
+            return None
+
+    found, changed = refreshImages(folder, manifest["images"])
+    if not found:
+        return None
+    if changed:
+        print("images changed in place since {}, updating it".format(manifest_file))
+        writeManifest(manifest_file, folder, manifest["images"], manifest["directories"])
+
+    return manifest
+
+
+def writeManifest(manifest_file, folder, images, directories):
+    manifest = {
+        "root": os.path.normpath(folder),
+        "directories": directories,
+        "images": images,
+    }
+
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+    # no indent, json only uses its fast encoder without one and this file has an entry for every image
+    with open(manifest_file, "w") as filepointer:
+        filepointer.write(json.dumps(manifest))
+
+    return manifest
+
+
+def discoverImages(folder, manifest_file=None):
+    '''returns the verification images under folder as [relative path, size, mtime_ns] entries,
+    from the manifest if it is still valid, otherwise from a fresh walk that is then written to the manifest'''
+    manifest = loadManifest(manifest_file, folder)
+    if manifest is not None:
+        print("reusing image manifest {}".format(manifest_file))
+        return manifest["images"]
+
+    images, directories = walkImages(folder)
+    images = selectImages(images)
+
+    if manifest_file is not None:
+        writeManifest(manifest_file, folder, images, directories)
+
+    return images
@@ -0,0 +1,118 @@
+import os
+import csv
+import json
+
+from voyis.scalebars import ScaleBar
+
+
+# the fixtures we ship live next to this file. Point VOYIS_FIXTURE_FOLDER at another folder to add or override some
+FIXTURE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixture_data")
+FIXTURE_FOLDERS = [folder for folder in [os.environ.get("VOYIS_FIXTURE_FOLDER"), FIXTURE_FOLDER] if folder]
+
+# the 9 bar fixture the 2.0 barscan measures
+DEFAULT_FIXTURE = "barscan_v2"
+
+FIXTURE_EXTENSIONS = [".json", ".csv"]
+CSV_COLUMNS = ["name", "marker_1", "marker_2", "ground_truth_m"]
+
+
+class Fixture:
+    '''the scale bars of one physical fixture. Never changed after loading, several runs can share one'''
+
+    def __init__(self, fixture_id, description, scale_bars, filename):
+        self.fixture_id = fixture_id
+        self.description = description
+        self.scale_bars = tuple(scale_bars)
+        self.filename = filename
+
+    def describe(self):
+        # what goes into the stage hash, any change to the bars redoes the scale bar stage
+        return {
+            "fixture_id": self.fixture_id,
+            "scale_bars": [list(bar) for bar in self.scale_bars],
+        }
+
+    def groundTruthFile(self):
+        # a json fixture can carry target positions / distances for the all pairs report too
+        if not self.filename.endswith(".json"):
+            return None
+        with open(self.filename) as filepointer:
+            fixture = json.load(filepointer)
+        return self.filename if "targets" in fixture or "distances" in fixture else None
+
+
+def scaleBarFromRow(row, filename):
+    missing = [column for column in CSV_COLUMNS if column not in row or row[column] in (None, "")]
+    if len(missing) > 0:
+        raise Exception("Scale bar {} in {} is missing {}".format(row, filename, ", ".join(missing)))
+    return ScaleBar(row["name"], row["marker_1"], row["marker_2"], float(row["ground_truth_m"]))
+
+
+def loadFixture(filename):
+    '''reads a fixture file. json:
+
+        {"fixture_id": "barscan_v2", "description": "...", "scale_bars": [{"name": .., "marker_1": .., "marker_2": .., "ground_truth_m": ..}]}
+
+    or a csv with the columns name, marker_1, marker_2, ground_truth_m where the file name is the fixture id'''
+    fixture_id, extension = os.path.splitext(os.path.basename(filename))
+    if extension == ".json":
+        with open(filename) as filepointer:
+            values = json.load(filepointer)
+        fixture_id = values.get("fixture_id", fixture_id)
+        description = values.get("description", "")
+        rows = values.get("scale_bars", [])
+    elif extension == ".csv":
+        with open(filename, newline="") as filepointer:
+            rows = list(csv.DictReader(filepointer))
+        description = ""
+    else:
+        raise Exception("Unknown fixture file type {}".format(filename))
+
+    scale_bars = [scaleBarFromRow(row, filename) for row in rows]
+    if len(scale_bars) == 0:
+        raise Exception("Fixture {} has no scale bars".format(filename))
+
+    names = [bar.name for bar in scale_bars]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if len(duplicates) > 0:
+        raise Exception("Fixture {} has duplicate scale bars: {}".format(filename, ", ".join(duplicates)))
+
+    return Fixture(fixture_id, description, scale_bars, filename)
+
+
+class FixtureRegistry:
+    '''finds fixtures by id in the fixture folders. The first folder wins, each fixture is loaded once'''
+
+    def __init__(self, folders=None):
+        self.folders = folders if folders is not None else FIXTURE_FOLDERS
+        self.fixtures = dict()
+
+    def fixtureFiles(self):
+        files = dict()
+        for folder in reversed(self.folders):
+            if not os.path.isdir(folder):
+                continue
+            for name in sorted(os.listdir(folder)):
+                fixture_id, extension = os.path.splitext(name)
+                if extension in FIXTURE_EXTENSIONS:
+                    files[fixture_id] = os.path.join(folder, name)
+        return files
+
+    def fixtureIds(self):
+        return sorted(self.fixtureFiles())
+
+    def get(self, fixture_id):
+        if fixture_id not in self.fixtures:
+            files = self.fixtureFiles()
+            if fixture_id not in files:
+                raise Exception("Unknown fixture {}, known fixtures: {}".format(fixture_id, ", ".join(sorted(files))))
+            self.fixtures[fixture_id] = loadFixture(files[fixture_id])
+        return self.fixtures[fixture_id]
+
+
+# fixture files do not change while metashape is open, so everything in one process shares this
+registry = FixtureRegistry()
+
+
+def getFixture(fixture_id=DEFAULT_FIXTURE):
+    return registry.get(fixture_id)
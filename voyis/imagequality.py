@@ -0,0 +1,199 @@
+import os
+import json
+import base64
+
+import numpy as np
+
+
+# jpegs are decoded straight from the dct at 1/2, 1/4 or 1/8 scale, whichever is the smallest that is still at least
+# this big. A 4096 x 3000 still comes out at 512 x 375 and the inverse dct only ever runs on the dc coefficient
+THUMBNAIL_SIZE = (256, 192)
+
+# a frame is blurry when its sharpness is under this share of the median sharpness of its camera. Relative, so
+# murky water and a clean tank both work without tuning
+DEFAULT_SHARPNESS_RATIO = 0.35
+
+# mean brightness (0..1) outside of these is a black (strobe did not fire) or blown out frame
+DEFAULT_DARK_LEVEL = 0.04
+DEFAULT_BRIGHT_LEVEL = 0.96
+
+# the global descriptor the sequential matching looks for loop closures with is the thumbnail averaged down to this
+# many blocks (x, y). Worked out while scoring, so matching does not have to decode every image again
+DESCRIPTOR_GRID = (16, 12)
+
+# images per worker below which starting another worker costs more than it saves
+MIN_IMAGES_PER_POOL = 16
+
+
+def loadThumbnail(path, size=THUMBNAIL_SIZE):
+    '''the image as a small grey scale float array (0..1), without decoding it at full resolution if it is a jpeg'''
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.draft("L", size)
+        image = image.convert("L")
+        # tifs have no draft mode, shrink those after the fact
+        if image.width > size[0] * 2:
+            image.thumbnail(size)
+        return np.asarray(image, dtype=np.float32) / 255.0
+
+
+def thumbnailDescriptor(pixels, grid=DESCRIPTOR_GRID):
+    '''a tiny, zero mean, unit length version of the image. Two frames of the same view have a dot product near 1'''
+    rows = pixels.shape[0] // grid[1] * grid[1]
+    columns = pixels.shape[1] // grid[0] * grid[0]
+    blocks = pixels[:rows, :columns].reshape(grid[1], rows // grid[1], grid[0], columns // grid[0]).mean(axis=(1, 3))
+
+    descriptor = blocks.ravel() - blocks.mean()
+    norm = np.linalg.norm(descriptor)
+    # a flat image looks like nothing, it gets no loop closures
+    return (descriptor / norm if norm > 1e-6 else np.zeros_like(descriptor)).astype(np.float32)
+
+
+def encodeDescriptor(descriptor):
+    # half floats in base64 keep the scores file small, the similarity does not need more than that
+    return base64.b64encode(np.asarray(descriptor, dtype=np.float16).tobytes()).decode("ascii")
+
+
+def decodeDescriptor(text):
+    return np.frombuffer(base64.b64decode(text), dtype=np.float16).astype(np.float32)
+
+
+def scoreImage(path):
+    pixels = loadThumbnail(path)
+
+    # variance of the laplacian, a blurred image has hardly any second derivative left
+    laplacian = pixels[1:-1, :-2] + pixels[1:-1, 2:] + pixels[:-2, 1:-1] + pixels[2:, 1:-1] - 4 * pixels[1:-1, 1:-1]
+    return {
+        "sharpness": float(laplacian.var()),
+        "brightness": float(pixels.mean()),
+        "width": pixels.shape[1],
+        "descriptor": encodeDescriptor(thumbnailDescriptor(pixels)),
+    }
+
+
+def scoreImages(paths):
+    # one worker's share. An image that can not be read is reported, Metashape gets the final say on it
+    scores = dict()
+    for path in paths:
+        try:
+            scores[path] = scoreImage(path)
+        except Exception as e:
+            scores[path] = {"error": repr(e)}
+    return scores
+
+
+class ImageQualityScreen:
+    '''scores every image of a capture from its thumbnail and rejects the frames with a blurry or black image
+    before anything goes into Metashape. Scores are kept in a json file next to the other outputs and only
+    images whose size or mtime changed are scored again'''
+
+    def __init__(self, sharpness_ratio=DEFAULT_SHARPNESS_RATIO, dark_level=DEFAULT_DARK_LEVEL, bright_level=DEFAULT_BRIGHT_LEVEL, n_jobs=None):
+        self.sharpness_ratio = sharpness_ratio
+        self.dark_level = dark_level
+        self.bright_level = bright_level
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        # normalized path -> descriptor of every image the last run scored, for the sequential matching
+        self.descriptors = dict()
+
+    def describe(self):
+        return {
+            "sharpness_ratio": self.sharpness_ratio,
+            "dark_level": self.dark_level,
+            "bright_level": self.bright_level,
+        }
+
+    def loadScores(self, quality_file):
+        if quality_file is None or not os.path.exists(quality_file):
+            return dict()
+        with open(quality_file) as filepointer:
+            return json.load(filepointer).get("images", dict())
+
+    def score(self, folder, entries, quality_file=None):
+        '''relative path -> scores for every [relative path, size, mtime_ns] entry'''
+        known = self.loadScores(quality_file)
+        scores = dict()
+        pending = []
+        for relative_path, size, mtime_ns in entries:
+            previous = known.get(relative_path)
+            # scores from before the descriptor was kept are worked out again, once
+            if (previous is not None and previous.get("size") == size and previous.get("mtime_ns") == mtime_ns
+                    and ("descriptor" in previous or "error" in previous)):
+                scores[relative_path] = previous
+            else:
+                pending.append((relative_path, size, mtime_ns))
+
+        if len(pending) > 0:
+            print("scoring {} images, {} unchanged".format(len(pending), len(scores)))
+            paths = [os.path.join(folder, entry[0]) for entry in pending]
+            n_jobs = max(1, min(self.n_jobs, len(paths) // MIN_IMAGES_PER_POOL))
+            if n_jobs == 1:
+                parsed = [scoreImages(paths)]
+            else:
+                from pqdm.processes import pqdm
+
+                # a few tasks per worker so one slow share of the disk does not hold up the rest
+                chunks = [paths[i::n_jobs * 4] for i in range(n_jobs * 4)]
+                parsed = pqdm(chunks, scoreImages, n_jobs=n_jobs)
+
+            found = dict()
+            for result in parsed:
+                if isinstance(result, Exception):
+                    print("could not score images: {}".format(result))
+                    continue
+                found.update(result)
+
+            for (relative_path, size, mtime_ns), path in zip(pending, paths):
+                if path in found:
+                    scores[relative_path] = dict(found[path], size=size, mtime_ns=mtime_ns)
+
+        return scores
+
+    def rejectFrames(self, folder, pairing, scores):
+        '''sequence -> reason for every frame with a bad image. The median sharpness is taken per camera,
+        left and right do not have to see the same amount of texture'''
+        rejected = dict()
+        for role_index, role in enumerate(pairing.roles):
+            sequences = np.array([sequence for sequence, _ in pairing.pairs], dtype=np.int64)
+            frame_scores = [scores.get(os.path.relpath(paths[role_index], folder), dict()) for _, paths in pairing.pairs]
+            scored = np.array(["error" not in values and "sharpness" in values for values in frame_scores], dtype=bool)
+            if not scored.any():
+                continue
+
+            sharpness = np.array([values.get("sharpness", np.nan) for values in frame_scores], dtype=float)
+            brightness = np.array([values.get("brightness", np.nan) for values in frame_scores], dtype=float)
+            median_sharpness = float(np.median(sharpness[scored]))
+
+            blurry = scored & (sharpness < median_sharpness * self.sharpness_ratio)
+            dark = scored & (brightness < self.dark_level)
+            bright = scored & (brightness > self.bright_level)
+
+            for reason, mask in [("blurry", blurry), ("dark", dark), ("bright", bright)]:
+                for sequence in sequences[mask]:
+                    rejected.setdefault(int(sequence), []).append("{} {}".format(role, reason))
+
+        return rejected
+
+    def run(self, folder, entries, pairing, quality_file=None):
+        '''scores the images, drops the rejected frames from the pairing and writes the scores. Returns the rejected frames'''
+        scores = self.score(folder, entries, quality_file)
+        self.descriptors = {os.path.normpath(os.path.join(folder, path)): decodeDescriptor(values["descriptor"])
+                            for path, values in scores.items() if "descriptor" in values}
+        rejected = self.rejectFrames(folder, pairing, scores)
+        pairing.dropFrames(rejected)
+
+        unreadable = sorted(path for path, values in scores.items() if "error" in values)
+        for path in unreadable:
+            print("could not score {}, left in".format(path))
+        print("image quality: {} of {} frames rejected".format(len(rejected), len(rejected) + len(pairing.pairs)))
+
+        if quality_file is not None:
+            os.makedirs(os.path.dirname(quality_file), exist_ok=True)
+            with open(quality_file, "w") as filepointer:
+                json.dump({
+                    "thresholds": self.describe(),
+                    "rejected": {str(sequence): reasons for sequence, reasons in sorted(rejected.items())},
+                    "images": scores,
+                }, filepointer, indent=4)
+
+        return rejected
@@ -0,0 +1,155 @@
+import os
+
+import numpy as np
+
+from voyis.imagequality import DESCRIPTOR_GRID, MIN_IMAGES_PER_POOL, loadThumbnail, thumbnailDescriptor
+
+
+# how matchPhotos picks the image pairs it matches
+MATCH_MODES = ["preselection", "sequential"]
+DEFAULT_MATCH_MODE = "preselection"
+
+# every frame is matched with this many frames before and after it
+DEFAULT_MATCH_WINDOW = 3
+
+# and with up to this many frames from elsewhere in the capture that look alike, for when the rig passes the fixture twice
+DEFAULT_LOOP_CANDIDATES = 2
+DEFAULT_MIN_SIMILARITY = 0.85
+
+# rows of the similarity matrix worked out at a time, keeps a 10000 frame capture under 100 MB
+SIMILARITY_BLOCK = 1024
+
+
+def imageDescriptor(path, grid=DESCRIPTOR_GRID):
+    # for images the quality screen did not already describe
+    return thumbnailDescriptor(loadThumbnail(path), grid)
+
+
+def imageDescriptors(paths):
+    # one worker's share, an image that can not be read just does not close any loops
+    descriptors = []
+    for path in paths:
+        try:
+            descriptors.append(imageDescriptor(path))
+        except Exception as e:
+            print("no descriptor for {}: {}".format(path, e))
+            descriptors.append(np.zeros(DESCRIPTOR_GRID[0] * DESCRIPTOR_GRID[1], dtype=np.float32))
+    return descriptors
+
+
+def windowPairs(count, window):
+    '''(i, j) frame indices of every frame with the window frames after it'''
+    if count < 2 or window < 1:
+        return np.zeros((0, 2), dtype=np.int64)
+    first = np.repeat(np.arange(count), window)
+    second = first + np.tile(np.arange(1, window + 1), count)
+    keep = second < count
+    return np.stack([first[keep], second[keep]], axis=1)
+
+
+def loopClosurePairs(descriptors, window, candidates=DEFAULT_LOOP_CANDIDATES, min_similarity=DEFAULT_MIN_SIMILARITY):
+    '''(i, j) frame indices of the most similar frames outside of twice the window, at most candidates per frame'''
+    count = len(descriptors)
+    if count < 2 or candidates < 1:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    descriptors = np.asarray(descriptors, dtype=np.float32)
+    candidates = min(candidates, count - 1)
+    pairs = []
+    for start in range(0, count, SIMILARITY_BLOCK):
+        rows = np.arange(start, min(start + SIMILARITY_BLOCK, count))
+        similarity = descriptors[rows] @ descriptors.T
+
+        # the neighbours are matched anyway and always look alike
+        near = np.abs(rows[:, None] - np.arange(count)[None, :]) <= 2 * window
+        similarity[near] = -np.inf
+
+        best = np.argpartition(-similarity, candidates - 1, axis=1)[:, :candidates]
+        best_similarity = np.take_along_axis(similarity, best, axis=1)
+        first = np.repeat(rows, candidates).reshape(len(rows), candidates)
+        keep = best_similarity >= min_similarity
+        pairs.append(np.stack([first[keep], best[keep]], axis=1))
+
+    pairs = np.concatenate(pairs)
+    # a pair found from both ends is matched once
+    return np.unique(np.sort(pairs, axis=1), axis=0)
+
+
+class SequentialMatchPairs:
+    '''the image pairs to match for a capture taken in sequence: every frame with its neighbours in the window,
+    plus a few loop closures between frames far apart that look alike. Replaces the global preselection, which
+    compares every image with every other one'''
+
+    def __init__(self, window=DEFAULT_MATCH_WINDOW, loop_candidates=DEFAULT_LOOP_CANDIDATES, min_similarity=DEFAULT_MIN_SIMILARITY, n_jobs=None):
+        self.window = window
+        self.loop_candidates = loop_candidates
+        self.min_similarity = min_similarity
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+
+    def describe(self):
+        return {
+            "window": self.window,
+            "loop_candidates": self.loop_candidates,
+            "min_similarity": self.min_similarity,
+        }
+
+    def descriptors(self, paths):
+        n_jobs = max(1, min(self.n_jobs, len(paths) // MIN_IMAGES_PER_POOL))
+        if n_jobs == 1:
+            return imageDescriptors(paths)
+
+        from pqdm.processes import pqdm
+
+        # contiguous shares so the descriptors come back in frame order
+        share = -(-len(paths) // (n_jobs * 4))
+        chunks = [paths[i:i + share] for i in range(0, len(paths), share)]
+        descriptors = []
+        for chunk, result in zip(chunks, pqdm(chunks, imageDescriptors, n_jobs=n_jobs)):
+            if isinstance(result, Exception):
+                print("could not describe images: {}".format(result))
+                result = [np.zeros(DESCRIPTOR_GRID[0] * DESCRIPTOR_GRID[1], dtype=np.float32)] * len(chunk)
+            descriptors.extend(result)
+        return descriptors
+
+    def frameDescriptors(self, pairing, known=None):
+        # the first camera is enough to tell where the rig was. Only images nobody described yet are decoded
+        known = known or dict()
+        paths = [os.path.normpath(paths[0]) for _, paths in pairing.pairs]
+        missing = [path for path in paths if path not in known]
+        if len(missing) > 0:
+            known = dict(known, **dict(zip(missing, self.descriptors(missing))))
+        return [known[path] for path in paths]
+
+    def framePairs(self, pairing, known_descriptors=None):
+        '''(i, j) indices into pairing.pairs of the frames to match with each other. known_descriptors maps the
+        normalized path of an image to its descriptor, e.g. from the image quality screen'''
+        neighbours = windowPairs(len(pairing.pairs), self.window)
+        if self.loop_candidates < 1:
+            return neighbours, np.zeros((0, 2), dtype=np.int64)
+
+        descriptors = self.frameDescriptors(pairing, known_descriptors)
+        return neighbours, loopClosurePairs(descriptors, self.window, self.loop_candidates, self.min_similarity)
+
+    def cameraPairs(self, cameras, pairing, known_descriptors=None):
+        '''(key, key) of every camera pair to match, as matchPhotos(pairs=...) wants them'''
+        keys = {os.path.normpath(camera.photo.path): camera.key for camera in cameras}
+        frames = [[keys[os.path.normpath(path)] for path in paths if os.path.normpath(path) in keys] for _, paths in pairing.pairs]
+        # nothing to match would leave matchPhotos with an empty list, which is not the same as no preselection
+        if not any(len(frame) > 0 for frame in frames):
+            raise Exception("None of the {} cameras in the chunk are in the pairing of {} frames".format(len(cameras), len(pairing.pairs)))
+
+        neighbours, loop_closures = self.framePairs(pairing, known_descriptors)
+        pairs = set()
+        # the cameras of one frame see the same thing
+        for frame in frames:
+            for index, first in enumerate(frame):
+                for second in frame[index + 1:]:
+                    pairs.add((first, second))
+        # and every camera of one frame is matched with every camera of the other
+        for i, j in np.concatenate([neighbours, loop_closures]):
+            for first in frames[i]:
+                for second in frames[j]:
+                    pairs.add((first, second))
+
+        print("{} image pairs to match, {} frame neighbours and {} loop closures".format(len(pairs), len(neighbours), len(loop_closures)))
+        return sorted(pairs)
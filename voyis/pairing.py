@@ -0,0 +1,127 @@
+import os
+import re
+import json
+
+
+# example: image_left_processed_SYSTEM_2023-11-08T153950.040882_CAL_11820.jpg. The value after CAL_ is the sequence number
+SEQUENCE_PATTERN = re.compile(r"CAL_(\d+)\.[^.]+$")
+
+# a sensor role is left / right on the stereo units. cam0..camN names are parsed too, but only the stereo roles are
+# paired and given sensors: AgisoftSlaveOffsets.json describes one stereo pair, there are no offsets for a rig
+ROLE_PATTERN = re.compile(r"^(left|right|cam\d+)$")
+
+# the order the images of one stereo pair are handed to metashape in
+STEREO_ROLES = ["left", "right"]
+
+
+def parseImageName(path):
+    '''returns (role, sequence number) for an image path, None for either part that can not be found.
+    Only the file name is looked at, and the role has to be a whole "_" separated token'''
+    name = os.path.basename(path)
+
+    match = SEQUENCE_PATTERN.search(name)
+    sequence = int(match.group(1)) if match is not None else None
+
+    roles = [token for token in os.path.splitext(name)[0].lower().split("_") if ROLE_PATTERN.match(token)]
+    role = roles[0] if len(roles) == 1 else None
+
+    return role, sequence
+
+
+def sensorIndex(paths):
+    # path -> sensor role, parsed once. For chunks whose images did not come through pairImages
+    return {os.path.normpath(path): parseImageName(path)[0] for path in paths}
+
+
+def assignSensors(cameras, sensors, sensor_index):
+    '''sets the sensor of every camera from the path -> role index. Returns the cameras that could not be assigned'''
+    unassigned = []
+    for cam in cameras:
+        role = sensor_index.get(os.path.normpath(cam.photo.path))
+        sensor = sensors.get(role)
+        if sensor is None:
+            unassigned.append(cam)
+            continue
+        cam.sensor = sensor
+    return unassigned
+
+
+class StereoPairing:
+    '''the images of a capture joined into frames by sequence number, plus everything that could not be paired.
+    A frame holds one image per role, left and right for the stereo units'''
+
+    def __init__(self, roles, pairs, orphans, unparsed, duplicates):
+        # pairs is a list of (sequence, [path per role]) sorted by sequence
+        self.roles = roles
+        self.pairs = pairs
+        self.orphans = orphans
+        self.unparsed = unparsed
+        self.duplicates = duplicates
+        # sequence -> reasons for the frames that were paired but taken out again, e.g. by the image quality screen
+        self.rejected = dict()
+
+    def images(self):
+        # flat left, right, left, right list in capture order, as addPhotos wants it
+        return [path for _, paths in self.pairs for path in paths]
+
+    def filegroups(self):
+        return [len(self.roles)] * len(self.pairs)
+
+    def sensorIndex(self):
+        # path -> sensor role for every paired image, straight from the parse done while pairing
+        return {os.path.normpath(path): role for _, paths in self.pairs for role, path in zip(self.roles, paths)}
+
+    def dropFrames(self, rejected):
+        # the whole frame goes, a stereo pair with one bad image is no use as a pair
+        self.rejected.update(rejected)
+        self.pairs = [(sequence, paths) for sequence, paths in self.pairs if sequence not in rejected]
+
+    def summary(self):
+        return {
+            "pairs": len(self.pairs),
+            "orphans": self.orphans,
+            "unparsed": self.unparsed,
+            "duplicates": self.duplicates,
+            "rejected": {str(sequence): reasons for sequence, reasons in sorted(self.rejected.items())},
+        }
+
+    def printSummary(self):
+        print("{} frames of {}, {} orphans, {} unparsed, {} duplicates, {} rejected".format(
+            len(self.pairs), "/".join(self.roles), len(self.orphans), len(self.unparsed), len(self.duplicates), len(self.rejected)))
+        for path in self.orphans:
+            print("incomplete frame, no partner for {}".format(path))
+
+    def write(self, filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as filepointer:
+            json.dump(self.summary(), filepointer, indent=4)
+
+
+def pairImages(paths, roles=STEREO_ROLES):
+    # one pass to bucket every image by sequence number, one pass over the buckets to keep the complete ones
+    frames = dict()
+    unparsed = []
+    duplicates = []
+
+    for path in paths:
+        role, sequence = parseImageName(path)
+        if role not in roles or sequence is None:
+            unparsed.append(path)
+            continue
+
+        frame = frames.setdefault(sequence, dict())
+        if role in frame:
+            duplicates.append(path)
+            continue
+        frame[role] = path
+
+    pairs = []
+    orphans = []
+    for sequence in sorted(frames):
+        frame = frames[sequence]
+        if len(frame) == len(roles):
+            pairs.append((sequence, [frame[role] for role in roles]))
+        else:
+            orphans.extend(frame.values())
+
+    return StereoPairing(list(roles), pairs, orphans, unparsed, duplicates)
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import json
+import platform
+import contextlib
+
+try:
+    import resource
+except ImportError:
+    # not available on windows
+    resource = None
+
+
+def peakRssMb():
+    # peak resident memory of this process so far, not of the single stage
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # linux reports kilobytes, mac reports bytes
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, "peak_wset", memory.rss) / (1024 * 1024)
+
+
+def validPointCount(tie_points):
+    # points removed by marking them invalid are still in the list, only the valid ones count
+    if tie_points is None:
+        return 0
+    return sum(1 for point in tie_points.points if point.valid)
+
+
+def chunkCounts(chunk, valid_points=None, count_points=False):
+    '''tie point and camera counts of the chunk. valid_points is an optional callable that knows the number of
+    valid tie points without walking the cloud, e.g. from the valid mask the filter keeps anyway. Without it the
+    cloud is only walked when count_points is set, a walk through a few million points is not free'''
+    if chunk is None:
+        return None
+
+    tie_points = valid_points() if valid_points is not None else None
+    if tie_points is None and count_points:
+        tie_points = validPointCount(chunk.tie_points)
+    return {
+        "tie_points": tie_points,
+        "cameras": len(chunk.cameras),
+        "aligned_cameras": sum(1 for camera in chunk.cameras if camera.transform is not None),
+    }
+
+
+class StageProfiler:
+    '''records wall time, cpu time, peak memory and chunk sizes around the steps of a pipeline'''
+
+    def __init__(self):
+        self.records = []
+        self.stack = []
+
+    def name(self, step):
+        # nested steps are named after their parents, e.g. filter/reprojection_error 0.8
+        return "/".join(self.stack + [step])
+
+    @contextlib.contextmanager
+    def measure(self, step, chunk=None, valid_points=None, count_points=False):
+        name = self.name(step)
+        before = chunkCounts(chunk, valid_points, count_points)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        self.stack.append(step)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            self.records.append({
+                "name": name,
+                "wall_s": time.perf_counter() - wall_start,
+                "cpu_s": time.process_time() - cpu_start,
+                "peak_rss_mb": peakRssMb(),
+                "before": before,
+                "after": chunkCounts(chunk, valid_points, count_points),
+                "skipped": False,
+            })
+
+    def skipped(self, step):
+        self.records.append({"name": self.name(step), "skipped": True})
+
+    def environment(self):
+        environment = {
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+        }
+        try:
+            import Metashape
+            environment["metashape"] = Metashape.app.version
+        except ImportError:
+            environment["metashape"] = None
+        return environment
+
+    def write(self, filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as filepointer:
+            json.dump({"environment": self.environment(), "records": self.records}, filepointer, indent=4)
+
+    def printSummary(self):
+        for record in self.records:
+            if record["skipped"]:
+                print("{:<50} skipped".format(record["name"]))
+            else:
+                print("{:<50} {:>9.2f} s wall {:>9.2f} s cpu".format(record["name"], record["wall_s"], record["cpu_s"]))
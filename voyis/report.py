@@ -0,0 +1,219 @@
+import os
+import json
+import functools
+import itertools
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import BaseDocTemplate, Frame, Image, PageTemplate, Paragraph, Spacer, Table
+
+
+# every table is cut into blocks of this many rows, each of which fits on a page. Reportlab never has to split
+# a table then, which is what gets slow (and memory hungry) on long tables
+ROWS_PER_TABLE = 36
+
+SCALE_BAR_HEADER = ["Measurment", "GT [m]", "Measured [m]", "Error [mm]", "Error %", "Pass/Fail"]
+PAIR_HEADER = ["Target", "Target", "GT [m]", "Measured [m]", "Error [mm]", "Error %"]
+TARGET_HEADER = ["Target", "Bias [mm]", "RMS [mm]", "Pairs"]
+TIMING_HEADER = ["Step", "Wall [s]", "CPU [s]", "Peak RSS [MB]"]
+
+
+class ReportTemplate:
+    '''page layout, paragraph and table styles of the verification report. Made once per process'''
+
+    def __init__(self, pagesize=letter, margin=0.75 * inch):
+        self.pagesize = pagesize
+        self.margin = margin
+        self.width = pagesize[0] - 2 * margin
+        self.height = pagesize[1] - 2 * margin
+
+        self.title = ParagraphStyle("title", fontName="Helvetica-Bold", fontSize=18, leading=22, spaceAfter=6)
+        self.heading = ParagraphStyle("heading", fontName="Helvetica-Bold", fontSize=13, leading=16, spaceBefore=12, spaceAfter=6)
+        self.body = ParagraphStyle("body", fontName="Helvetica", fontSize=10, leading=13)
+        self.verdict = ParagraphStyle("verdict", fontName="Helvetica-Bold", fontSize=12, leading=15)
+
+        self.table_style = [
+            ("GRID", (0, 0), (-1, -1), 0.5, colors.black),
+            ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+            ("FONTSIZE", (0, 0), (-1, -1), 8),
+            ("BACKGROUND", (0, 0), (-1, 0), colors.lightgrey),
+        ]
+
+    def pageTemplates(self, footer):
+        # frames keep state while a document is built, so every document gets its own. They are cheap
+        def drawFooter(canvas, doc):
+            canvas.saveState()
+            canvas.setFont("Helvetica", 8)
+            canvas.drawString(self.margin, self.margin / 2, footer)
+            canvas.drawRightString(self.pagesize[0] - self.margin, self.margin / 2, "Page {}".format(doc.page))
+            canvas.restoreState()
+
+        frame = Frame(self.margin, self.margin, self.width, self.height, id="content")
+        return [PageTemplate(id="report", frames=[frame], onPage=drawFooter)]
+
+
+@functools.lru_cache(maxsize=None)
+def reportTemplate():
+    return ReportTemplate()
+
+
+class FlowableStream(list):
+    '''hands reportlab the flowables of a generator a few at a time. build only ever looks at the front of the list,
+    so only the tables of about one page exist at once however long the report gets'''
+
+    def __init__(self, flowables, lookahead=4):
+        super().__init__()
+        self.pending = iter(flowables)
+        self.lookahead = lookahead
+
+    def fill(self):
+        while list.__len__(self) < self.lookahead:
+            flowable = next(self.pending, None)
+            if flowable is None:
+                break
+            self.append(flowable)
+
+    def __len__(self):
+        self.fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self.fill()
+        return list.__getitem__(self, index)
+
+
+def tables(template, header, rows, widths, status_column=None):
+    '''the rows (any iterable) as tables of at most ROWS_PER_TABLE rows, each with the header repeated.
+    widths are fractions of the page'''
+    column_widths = [template.width * width for width in widths]
+    rows = iter(rows)
+    block = list(itertools.islice(rows, ROWS_PER_TABLE))
+    # an empty table still gets its header
+    while True:
+        style = list(template.table_style)
+        if status_column is not None:
+            for row, values in enumerate(block, start=1):
+                cell_color = colors.red if values[status_column] == "Fail" else colors.green
+                style.append(("BACKGROUND", (status_column, row), (status_column, row), cell_color))
+        yield Table([header] + block, colWidths=column_widths, style=style)
+
+        block = list(itertools.islice(rows, ROWS_PER_TABLE))
+        if len(block) == 0:
+            break
+
+
+def scaleBarFlowables(template, data):
+    yield Paragraph("Scale Bars ({})".format(data["fixture_id"]), template.heading)
+    yield from tables(template, SCALE_BAR_HEADER, data["scale_bars"], [0.3, 0.12, 0.15, 0.13, 0.12, 0.18], status_column=5)
+    yield Spacer(1, 8)
+    yield Paragraph("Root Mean Square Error [%]: {:.4f}".format(data["rms_error_percentage"]), template.verdict)
+    yield Paragraph("Passing Error [%]: {} %".format(data["passing_error_in_percentage"]), template.verdict)
+    verdict_color = "green" if data["passed"] else "red"
+    yield Paragraph('<font color="{}">{}</font>'.format(verdict_color, "PASS" if data["passed"] else "FAIL"), template.verdict)
+
+
+def pairwiseFlowables(template, pairwise):
+    summary = pairwise["summary"]
+    yield Paragraph("All Target Pairs", template.heading)
+    lines = [
+        "{} targets, {} pairs with ground truth".format(summary["targets"], summary["pairs"]),
+        "RMS error: {:.3f} mm ({:.4f} %)".format(summary["rms_error_mm"], summary["rms_error_percent"]),
+        "Mean error: {:.3f} mm, std {:.3f} mm, max {:.3f} mm".format(
+            summary["mean_error_mm"], summary["std_error_mm"], summary["max_abs_error_mm"]),
+        "Error vs length: {:.4f} mm/m + {:.3f} mm".format(
+            summary["error_vs_length_slope_mm_per_m"], summary["error_vs_length_offset_mm"]),
+    ]
+    if len(summary["missing_targets"]) > 0:
+        lines.append("Not detected: {}".format(", ".join(summary["missing_targets"])))
+    for line in lines:
+        yield Paragraph(line, template.body)
+
+    yield Paragraph("Worst Pairs", template.heading)
+    worst = [
+        [pair["pair"][0], pair["pair"][1], "{:.4f}".format(pair["ground_truth_m"]), "{:.4f}".format(pair["measured_m"]), "{:.2f}".format(pair["error_mm"]), "{:.3f}".format(pair["error_percent"])]
+        for pair in pairwise["worst_pairs"]
+    ]
+    yield from tables(template, PAIR_HEADER, worst, [0.2, 0.2, 0.15, 0.15, 0.15, 0.15])
+
+    yield Paragraph("Per Target Bias", template.heading)
+    targets = [
+        [label, "{:.3f}".format(values["bias_mm"]), "{:.3f}".format(values["rms_mm"]), str(values["pairs"])]
+        for label, values in pairwise["targets"].items()
+    ]
+    yield from tables(template, TARGET_HEADER, targets, [0.4, 0.2, 0.2, 0.2])
+
+    yield Paragraph("Every Pair", template.heading)
+    pairs = (
+        [first, second, "{:.4f}".format(ground_truth), "{:.4f}".format(measured), "{:.2f}".format(error_mm), "{:.3f}".format(error_percent)]
+        for first, second, ground_truth, measured, error_mm, error_percent in pairwise["pairs"]
+    )
+    yield from tables(template, PAIR_HEADER, pairs, [0.2, 0.2, 0.15, 0.15, 0.15, 0.15])
+
+
+def imageFlowables(template, filename):
+    yield Paragraph("Top Down View", template.heading)
+    width, height = ImageReader(filename).getSize()
+    scale = min(template.width / width, template.height * 0.6 / height)
+    yield Image(filename, width=width * scale, height=height * scale)
+
+
+def timingFlowables(template, timings):
+    yield Paragraph("Timings", template.heading)
+    rows = [[name, "{:.2f}".format(wall_s), "{:.2f}".format(cpu_s), "{:.0f}".format(peak_rss_mb)] for name, wall_s, cpu_s, peak_rss_mb in timings]
+    yield from tables(template, TIMING_HEADER, rows, [0.55, 0.15, 0.15, 0.15])
+
+
+def reportFlowables(template, data):
+    yield Paragraph("{} Verification Report".format(data["serial_id"]), template.title)
+    yield Paragraph("Run {} on {}".format(data["uuid"], data["created"]), template.body)
+    yield from scaleBarFlowables(template, data)
+
+    if data.get("pairwise") is not None:
+        yield from pairwiseFlowables(template, data["pairwise"])
+
+    image = data.get("top_down_image")
+    if image is not None and os.path.exists(image):
+        yield from imageFlowables(template, image)
+
+    if len(data.get("timings", [])) > 0:
+        yield from timingFlowables(template, data["timings"])
+
+
+def renderReport(data, filename=None):
+    '''renders the verification report pdf from the report data of one run and returns its file name'''
+    filename = filename or data["report_file"]
+    template = reportTemplate()
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    doc = BaseDocTemplate(filename, pagesize=template.pagesize, pageCompression=1,
+                          title="{} Verification Report".format(data["serial_id"]))
+    doc.addPageTemplates(template.pageTemplates("{} - {}".format(data["serial_id"], data["created"])))
+    doc.build(FlowableStream(reportFlowables(template, data)))
+    return filename
+
+
+def writeReportData(data, filename):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as filepointer:
+        json.dump(data, filepointer, indent=4)
+
+
+def renderReportFile(data_file):
+    with open(data_file) as filepointer:
+        return renderReport(json.load(filepointer))
+
+
+def renderReportFiles(data_files, n_jobs=None):
+    '''renders the reports of many runs in a worker pool, e.g. at the end of a batch. Returns the pdf (or the
+    exception) per data file'''
+    from pqdm.processes import pqdm
+
+    if len(data_files) == 0:
+        return []
+
+    # rendering is single threaded python, so every core can take one
+    n_jobs = max(1, min(n_jobs or os.cpu_count() or 1, len(data_files)))
+    return pqdm(data_files, renderReportFile, n_jobs=n_jobs)
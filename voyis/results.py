@@ -0,0 +1,286 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import argparse
+
+
+# one database for every barscan run on this machine. Point VOYIS_RESULTS_DB somewhere shared to pool machines
+DEFAULT_DATABASE = os.environ.get(
+    "VOYIS_RESULTS_DB", os.path.join(os.path.expanduser("~"), ".voyis", "barscan_results.sqlite"))
+
+RESULTS_FILE_SUFFIX = "_results.json"
+
+# the folder name of a run has its start time, e.g. 123456789_Verification-2023-11-08_15-39-50
+OUTPUT_FOLDER_PATTERN = re.compile(r"(\d{9})_Verification-(\d{4}-\d{2}-\d{2})_(\d{2})-(\d{2})-(\d{2})")
+
+# what the barscan passed at before results files had the run in them
+LEGACY_PASSING_ERROR_IN_PERCENTAGE = 0.03
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_uuid TEXT PRIMARY KEY,
+    serial_id TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    fixture_id TEXT,
+    passed INTEGER,
+    rms_error_percentage REAL,
+    output_folder TEXT,
+    results_file TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_serial ON runs (serial_id, timestamp);
+CREATE INDEX IF NOT EXISTS runs_by_time ON runs (timestamp, passed);
+CREATE INDEX IF NOT EXISTS runs_by_fixture ON runs (fixture_id, timestamp);
+CREATE INDEX IF NOT EXISTS runs_by_file ON runs (results_file);
+
+CREATE TABLE IF NOT EXISTS bar_results (
+    run_uuid TEXT NOT NULL REFERENCES runs (run_uuid) ON DELETE CASCADE,
+    bar_name TEXT NOT NULL,
+    ground_truth_m REAL,
+    measured_m REAL,
+    error_percent REAL,
+    passed INTEGER,
+    PRIMARY KEY (run_uuid, bar_name)
+);
+CREATE INDEX IF NOT EXISTS bar_results_by_bar ON bar_results (bar_name);
+
+CREATE TABLE IF NOT EXISTS ingested_files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    run_uuid TEXT NOT NULL
+);
+"""
+
+
+def runTimestamp(path, fallback_mtime):
+    match = OUTPUT_FOLDER_PATTERN.search(path)
+    if match is None:
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(fallback_mtime))
+    return "{}T{}:{}:{}".format(*match.groups()[1:])
+
+
+def legacyFixture(bar_names):
+    # old results files do not say which fixture they measured, the bar names give it away
+    from voyis.fixtures import registry
+
+    for fixture_id in registry.fixtureIds():
+        fixture = registry.get(fixture_id)
+        if {bar.name for bar in fixture.scale_bars} == set(bar_names):
+            return fixture
+    return None
+
+
+def parseLegacyResults(filename, values, stat):
+    # {"<serial>": "<serial>", "<bar name>": error percent, ...}
+    serial_id = os.path.basename(filename)[:-len(RESULTS_FILE_SUFFIX)]
+    errors = {name: float(value) for name, value in values.items() if name != serial_id and name != "run"}
+
+    fixture = legacyFixture(errors)
+    ground_truth = {bar.name: bar.ground_truth_distance for bar in fixture.scale_bars} if fixture is not None else dict()
+
+    rms = (sum(error ** 2 for error in errors.values()) / len(errors)) ** 0.5 if len(errors) > 0 else None
+    bars = []
+    for name, error_percent in errors.items():
+        length = ground_truth.get(name)
+        bars.append({
+            "name": name,
+            "ground_truth_m": length,
+            "measured_m": length * (1 + error_percent / 100) if length is not None else None,
+            "error_percent": error_percent,
+            "passed": None,
+        })
+
+    return {
+        # the same file always gets the same id, so backfilling twice does not duplicate it
+        "run_uuid": str(uuid.uuid5(uuid.NAMESPACE_URL, os.path.abspath(filename))),
+        "serial_id": serial_id,
+        "timestamp": runTimestamp(filename, stat.st_mtime),
+        "fixture_id": fixture.fixture_id if fixture is not None else None,
+        "passed": rms < LEGACY_PASSING_ERROR_IN_PERCENTAGE if rms is not None else None,
+        "rms_error_percentage": rms,
+        "bars": bars,
+    }
+
+
+def parseResultsFile(filename):
+    '''one <serial>_results.json as a run record for the database, old files without a "run" block included'''
+    stat = os.stat(filename)
+    with open(filename) as filepointer:
+        values = json.load(filepointer)
+
+    run = values.get("run")
+    record = dict(run) if run is not None else parseLegacyResults(filename, values, stat)
+    record["output_folder"] = os.path.dirname(os.path.abspath(filename))
+    record["results_file"] = os.path.abspath(filename)
+    record["mtime_ns"] = stat.st_mtime_ns
+    return record
+
+
+def parseResultsFiles(filenames):
+    # one worker's share of a backfill. A broken file is reported, not fatal
+    records = []
+    for filename in filenames:
+        try:
+            records.append(parseResultsFile(filename))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print("skipping {}: {}".format(filename, e))
+    return records
+
+
+def findResultsFiles(root_folder):
+    # results files only live in the output folders, so only those are listed
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root_folder):
+        if "_Verification-" in os.path.basename(dirpath):
+            found.extend(os.path.join(dirpath, name) for name in filenames if name.endswith(RESULTS_FILE_SUFFIX))
+            # nothing of ours further down
+            dirnames[:] = []
+            continue
+        # metashape project data never holds results
+        dirnames[:] = [name for name in dirnames if not name.endswith(".files")]
+    return sorted(found)
+
+
+class ResultsDatabase:
+    '''every barscan run and its scale bars in one sqlite file, indexed by serial, time and fixture'''
+
+    def __init__(self, filename=DEFAULT_DATABASE):
+        self.filename = filename
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+
+        # batch workers write at the same time, wal lets readers carry on and the timeout makes writers queue
+        self.connection = sqlite3.connect(filename, timeout=60)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def ingest(self, records):
+        # all records in one transaction, the run and its bars are replaced as a whole
+        with self.connection:
+            # a resumed or rerun barscan rewrites the same results file under a new run uuid. The run recorded for
+            # that file before goes, its bars with it, or the unit would count twice in the failures and the trends
+            self.connection.executemany(
+                "DELETE FROM runs WHERE results_file = :results_file AND run_uuid != :run_uuid", records)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO runs VALUES (:run_uuid, :serial_id, :timestamp, :fixture_id, :passed, "
+                ":rms_error_percentage, :output_folder, :results_file)",
+                records)
+            self.connection.executemany(
+                "DELETE FROM bar_results WHERE run_uuid = ?", [(record["run_uuid"],) for record in records])
+            self.connection.executemany(
+                "INSERT INTO bar_results VALUES (:run_uuid, :name, :ground_truth_m, :measured_m, :error_percent, :passed)",
+                [dict(bar, run_uuid=record["run_uuid"]) for record in records for bar in record["bars"]])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO ingested_files VALUES (:results_file, :mtime_ns, :run_uuid)",
+                records)
+        return len(records)
+
+    def ingestFile(self, filename):
+        return self.ingest([parseResultsFile(filename)])
+
+    def ingestedFiles(self):
+        return {row["path"]: row["mtime_ns"] for row in self.connection.execute("SELECT path, mtime_ns FROM ingested_files")}
+
+    def backfill(self, root_folder, n_jobs=None):
+        '''ingests every results file under root_folder that is new or changed since it was last ingested.
+        The files are parsed in a process pool, the database is written from this process only'''
+        filenames = findResultsFiles(root_folder)
+        known = self.ingestedFiles()
+        pending = [name for name in filenames if known.get(os.path.abspath(name)) != os.stat(name).st_mtime_ns]
+        print("{} results files, {} new or changed".format(len(filenames), len(pending)))
+        if len(pending) == 0:
+            return 0
+
+        n_jobs = max(1, min(n_jobs or os.cpu_count() or 1, len(pending)))
+        # a few files per task, starting a task costs more than parsing one small json
+        chunks = [pending[i::n_jobs * 4] for i in range(min(len(pending), n_jobs * 4))]
+        if n_jobs == 1:
+            parsed = [parseResultsFiles(chunk) for chunk in chunks]
+        else:
+            from pqdm.processes import pqdm
+            parsed = pqdm(chunks, parseResultsFiles, n_jobs=n_jobs)
+
+        records = []
+        for chunk, result in zip(chunks, parsed):
+            if isinstance(result, Exception):
+                print("could not parse {} files: {}".format(len(chunk), result))
+                continue
+            records.extend(result)
+        return self.ingest(records)
+
+    def failingRuns(self, since=None, until=None, fixture_id=None):
+        query = "SELECT * FROM runs WHERE passed = 0"
+        arguments = []
+        if since is not None:
+            query += " AND timestamp >= ?"
+            arguments.append(since)
+        if until is not None:
+            query += " AND timestamp < ?"
+            arguments.append(until)
+        if fixture_id is not None:
+            query += " AND fixture_id = ?"
+            arguments.append(fixture_id)
+        return [dict(row) for row in self.connection.execute(query + " ORDER BY timestamp", arguments)]
+
+    def serialTrend(self, serial_id, bar_name=None):
+        # every bar of every run of one unit, oldest first
+        query = ("SELECT runs.timestamp, runs.run_uuid, runs.fixture_id, runs.rms_error_percentage, runs.passed, "
+                 "bar_results.bar_name, bar_results.error_percent FROM runs JOIN bar_results USING (run_uuid) "
+                 "WHERE runs.serial_id = ?")
+        arguments = [serial_id]
+        if bar_name is not None:
+            query += " AND bar_results.bar_name = ?"
+            arguments.append(bar_name)
+        return [dict(row) for row in self.connection.execute(query + " ORDER BY runs.timestamp, bar_results.bar_name", arguments)]
+
+
+def printRows(rows, columns):
+    print("  ".join("{:<20}".format(column) for column in columns))
+    for row in rows:
+        print("  ".join("{:<20}".format("-" if row[column] is None else str(row[column])) for column in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="The barscan results database")
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser("backfill", help="ingest every results file in the output folders under a root")
+    backfill.add_argument("root")
+    backfill.add_argument("--workers", type=int, default=None)
+
+    failing = commands.add_parser("failing", help="failing runs, e.g. failing --since 2026-10-01")
+    failing.add_argument("--since", default=None)
+    failing.add_argument("--until", default=None)
+    failing.add_argument("--fixture", default=None)
+
+    trend = commands.add_parser("trend", help="error per bar of every run of one unit")
+    trend.add_argument("serial_id")
+    trend.add_argument("--bar", default=None)
+
+    args = parser.parse_args(argv)
+    database = ResultsDatabase(args.database)
+
+    if args.command == "backfill":
+        start = time.perf_counter()
+        count = database.backfill(args.root, args.workers)
+        print("ingested {} runs in {:.1f} s".format(count, time.perf_counter() - start))
+    elif args.command == "failing":
+        printRows(database.failingRuns(args.since, args.until, args.fixture),
+                  ["timestamp", "serial_id", "fixture_id", "rms_error_percentage", "output_folder"])
+    elif args.command == "trend":
+        printRows(database.serialTrend(args.serial_id, args.bar),
+                  ["timestamp", "bar_name", "error_percent", "rms_error_percentage", "passed"])
+
+    database.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
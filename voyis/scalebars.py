@@ -0,0 +1,124 @@
+import Metashape
+import collections
+import numpy as np
+
+from voyis.profiling import StageProfiler
+
+
+# one bar of a fixture. A tuple so nobody can write a measurement onto a definition several runs share
+ScaleBar = collections.namedtuple("ScaleBar", ["name", "marker_1_name", "marker_2_name", "ground_truth_distance"])
+
+
+def detectTargets(chunk, profiler=None):
+    profiler = profiler if profiler is not None else StageProfiler()
+
+    # detect markers
+    with profiler.measure("detectMarkers", chunk):
+        chunk.detectMarkers(
+            target_type=Metashape.CircularTarget12bit,
+            tolerance=15,
+            filter_mask=False,
+            inverted=False,
+        )
+
+    with profiler.measure("refineMarkers", chunk):
+        chunk.refineMarkers()
+
+
+def markerPositions(chunk):
+    '''the labels and an N x 3 array of positions (chunk coordinates) of every marker that got a position'''
+    labels = []
+    positions = []
+    for marker in chunk.markers:
+        if marker.position is None:
+            continue
+        labels.append(marker.label)
+        positions.append([marker.position.x, marker.position.y, marker.position.z])
+    return labels, np.array(positions, dtype=float).reshape(-1, 3)
+
+
+def barIndices(labels, scale_bars):
+    # row of both markers of every bar in the position array
+    index = {label: i for i, label in enumerate(labels)}
+    missing = sorted({name for bar in scale_bars for name in [bar.marker_1_name, bar.marker_2_name] if name not in index})
+    if len(missing) > 0:
+        raise Exception("Targets not detected: {}".format(", ".join(missing)))
+
+    first = np.array([index[bar.marker_1_name] for bar in scale_bars], dtype=int)
+    second = np.array([index[bar.marker_2_name] for bar in scale_bars], dtype=int)
+    return first, second
+
+
+def measureScaleBars(chunk, scale_bars, profiler=None):
+    '''detects the targets in the chunk and returns the measured length of every scale bar as an array, in the same order'''
+    detectTargets(chunk, profiler)
+
+    labels, positions = markerPositions(chunk)
+    first, second = barIndices(labels, scale_bars)
+
+    # the bars go into the project too, so they show up in the agisoft report
+    markers = {marker.label: marker for marker in chunk.markers}
+    for scale_bar in scale_bars:
+        chunk.addScalebar(markers[scale_bar.marker_1_name], markers[scale_bar.marker_2_name])
+
+    # YOU NEED TO SCALE YOUR MEASUREMENTS BY THE CHUNK SCALE TO GET THE REAL WORLD MEASUREMENTS
+    # In soviet Russia, the chunk scale scales you
+    # This is where 3.5 hours of Stan's time went to die
+    return np.linalg.norm(positions[first] - positions[second], axis=1) * chunk.transform.scale
+
+
+class ScaleBarResult:
+    '''the measured scale bars of one barscan. Errors, rms and pass / fail are worked out once when it is made
+    and the arrays are read only after that, every run owns its own result'''
+
+    def __init__(self, scale_bars, measured_distances, passing_error_in_percentage, passing_single_measurment_error_percentage):
+        self.names = tuple(bar.name for bar in scale_bars)
+        self.ground_truth = np.array([bar.ground_truth_distance for bar in scale_bars], dtype=float)
+        self.measured = np.array(measured_distances, dtype=float)
+        self.passing_error_in_percentage = passing_error_in_percentage
+        self.passing_single_measurment_error_percentage = passing_single_measurment_error_percentage
+
+        self.error = self.measured - self.ground_truth
+        self.abs_error = np.abs(self.error)
+        self.error_percent = self.error / self.ground_truth * 100
+
+        # fail a bar if it is over passing_single_measurment_error_percentage of the ground truth distance
+        self.bar_passed = np.abs(self.error_percent) < passing_single_measurment_error_percentage
+
+        # summarize the results as Root Mean square error
+        self.rms_error_percentage = float(np.sqrt(np.mean((self.error_percent / 100) ** 2)) * 100) if len(self.measured) > 0 else 0.0
+        self.has_passed = bool(self.rms_error_percentage < passing_error_in_percentage)
+
+        for array in [self.ground_truth, self.measured, self.error, self.abs_error, self.error_percent, self.bar_passed]:
+            array.setflags(write=False)
+
+    def rows(self):
+        # one row per bar for the report table
+        return [
+            [
+                name,
+                "{:.4f}".format(ground_truth),
+                "{:.4f}".format(measured),
+                "{:.2f}".format(error * 1000),
+                "{:.3f}".format(error_percent),
+                "Pass" if passed else "Fail",
+            ]
+            for name, ground_truth, measured, error, error_percent, passed in zip(
+                self.names, self.ground_truth, self.measured, self.error, self.error_percent, self.bar_passed)
+        ]
+
+    def bars(self):
+        return [
+            {
+                "name": name,
+                "ground_truth_m": float(ground_truth),
+                "measured_m": float(measured),
+                "error_percent": float(error_percent),
+                "passed": bool(passed),
+            }
+            for name, ground_truth, measured, error_percent, passed in zip(
+                self.names, self.ground_truth, self.measured, self.error_percent, self.bar_passed)
+        ]
+
+    def errorPercentByName(self):
+        return {name: float(error_percent) for name, error_percent in zip(self.names, self.error_percent)}
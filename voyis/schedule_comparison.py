@@ -0,0 +1,107 @@
+import Metashape
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+
+from voyis.fixtures import DEFAULT_FIXTURE, getFixture
+from voyis.scalebars import measureScaleBars
+from voyis.tiepoints import TiePointFilter, barscanSchedule, deferredSchedule, OPTIMIZE_PER_CRITERION
+
+
+def defaultCandidates():
+    # the current per step behaviour first, everything else is compared against it
+    return [
+        barscanSchedule(),
+        deferredSchedule(barscanSchedule(), 2),
+        deferredSchedule(barscanSchedule(), 3),
+        deferredSchedule(barscanSchedule(), OPTIMIZE_PER_CRITERION),
+    ]
+
+
+def runCandidate(project_file, schedule, scale_bars):
+    # every candidate starts from the same aligned project. It is opened read only so nothing is written back
+    doc = Metashape.Document()
+    doc.open(project_file, read_only=True)
+    chunk = doc.chunks[0]
+
+    start = time.perf_counter()
+    engine = TiePointFilter(chunk, schedule)
+    engine.run()
+    filter_s = time.perf_counter() - start
+
+    distances = measureScaleBars(chunk, scale_bars)
+    ground_truth = np.asarray([bar.ground_truth_distance for bar in scale_bars], dtype=float)
+    error_percent = (distances - ground_truth) / ground_truth * 100
+
+    return {
+        "schedule": schedule.name,
+        "optimize_every": schedule.optimize_every,
+        "optimizations": engine.optimizations,
+        "filter_s": filter_s,
+        "tie_points": sum(1 for point in chunk.tie_points.points if point.valid),
+        "rms_error_percentage": float(np.sqrt(np.mean(error_percent ** 2))),
+        "max_abs_error_percentage": float(np.max(np.abs(error_percent))),
+        "measured_distances": distances.tolist(),
+        "error_percentages": error_percent.tolist(),
+    }
+
+
+def compareFilterSchedules(project_file, candidates=None, scale_bars=None, tolerance_mm=0.1):
+    '''runs every candidate schedule on the same aligned project and reports how far each one's scale bar
+    measurements move from the first (reference) candidate'''
+    candidates = candidates if candidates is not None else defaultCandidates()
+    scale_bars = scale_bars if scale_bars is not None else getFixture().scale_bars
+
+    results = [runCandidate(project_file, schedule, scale_bars) for schedule in candidates]
+
+    reference = np.asarray(results[0]["measured_distances"])
+    for result in results:
+        max_difference_mm = float(np.max(np.abs(np.asarray(result["measured_distances"]) - reference)) * 1000)
+        result["max_difference_to_reference_mm"] = max_difference_mm
+        result["within_tolerance"] = max_difference_mm <= tolerance_mm
+
+    return results
+
+
+def printComparison(results):
+    print("{:<32} {:>6} {:>10} {:>10} {:>10} {:>10} {:>6}".format(
+        "schedule", "optim", "filter [s]", "rms [%]", "max [%]", "diff [mm]", "ok"))
+    for result in results:
+        print("{:<32} {:>6} {:>10.1f} {:>10.4f} {:>10.4f} {:>10.3f} {:>6}".format(
+            result["schedule"],
+            result["optimizations"],
+            result["filter_s"],
+            result["rms_error_percentage"],
+            result["max_abs_error_percentage"],
+            result["max_difference_to_reference_mm"],
+            "yes" if result["within_tolerance"] else "no",
+        ))
+
+    # the cheapest schedule that still agrees with the reference
+    passing = [result for result in results if result["within_tolerance"]]
+    cheapest = min(passing, key=lambda result: result["optimizations"])
+    print("cheapest schedule within tolerance: {}".format(cheapest["schedule"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare tie point filter schedules on an aligned barscan project")
+    parser.add_argument("project", help="aligned project, e.g. <serial>_align.psx from a barscan output folder")
+    parser.add_argument("--tolerance-mm", type=float, default=0.1, help="allowed scale bar difference to the per step schedule")
+    parser.add_argument("--output", default=None, help="json file for the results, defaults to next to the project")
+    parser.add_argument("--fixture", default=DEFAULT_FIXTURE, help="fixture id of the scale bars to measure")
+    args = parser.parse_args(argv)
+
+    results = compareFilterSchedules(args.project, scale_bars=getFixture(args.fixture).scale_bars, tolerance_mm=args.tolerance_mm)
+    printComparison(results)
+
+    output = args.output or os.path.splitext(args.project)[0] + "_schedule_comparison.json"
+    with open(output, "w") as filepointer:
+        json.dump(results, filepointer, indent=4)
+    print("comparison written to {}".format(output))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,226 @@
+import Metashape
+import numpy as np
+
+from voyis.profiling import StageProfiler
+
+
+# every image is cut into this many cells (x, y) and keeps its best points in each one
+DEFAULT_GRID = (16, 12)
+DEFAULT_POINTS_PER_CELL = 2
+
+# a camera with fewer kept points than this gets its best removed ones back, so thinning never cuts a camera loose
+DEFAULT_MIN_POINTS_PER_CAMERA = 150
+
+# what makes a point good, each as a rank so the units do not matter. Lower is better for the first two
+QUALITY_CRITERIA = {
+    "reprojection_error": Metashape.TiePoints.Filter.ReprojectionError,
+    "reconstruction_uncertainty": Metashape.TiePoints.Filter.ReconstructionUncertainty,
+    "image_count": Metashape.TiePoints.Filter.ImageCount,
+}
+
+
+def ranks(values):
+    # 0 for the smallest value, 1 for the largest
+    order = np.argsort(values, kind="stable")
+    result = np.empty(len(values), dtype=float)
+    result[order] = np.linspace(0.0, 1.0, len(values)) if len(values) > 1 else 0.0
+    return result
+
+
+def bestPerGroup(groups, score, per_group=1):
+    '''a mask of the per_group lowest scores in every group. One lexsort, no loop over the groups'''
+    if len(groups) == 0:
+        return np.zeros(0, dtype=bool)
+    order = np.lexsort((score, groups))
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    # position of every entry inside its group
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    mask = np.zeros(len(groups), dtype=bool)
+    mask[order[rank < per_group]] = True
+    return mask
+
+
+class TiePointThinner:
+    '''caps the sparse cloud at budget points before the filter sweep, so every optimizeCameras after it is cheaper.
+    Points are kept in this order: the best few in every cell of every image (coverage), the best in every 3D voxel
+    (spread), then the best of the rest until the budget is used up. Cameras left with too few points get their
+    best ones back afterwards'''
+
+    def __init__(self, chunk, budget, grid=DEFAULT_GRID, points_per_cell=DEFAULT_POINTS_PER_CELL, voxel_size=None,
+                 min_points_per_camera=DEFAULT_MIN_POINTS_PER_CAMERA, profiler=None):
+        if budget is None or budget < 1:
+            raise Exception("Tie point thinning needs a budget of at least one point")
+
+        self.chunk = chunk
+        self.budget = int(budget)
+        self.grid = tuple(grid)
+        self.points_per_cell = points_per_cell
+        self.voxel_size = voxel_size
+        self.min_points_per_camera = min_points_per_camera
+        self.profiler = profiler if profiler is not None else StageProfiler()
+        # valid points in the cloud as far as the thinner knows, None until it read them
+        self.valid_count = None
+
+    def describe(self):
+        return {
+            "budget": self.budget,
+            "grid": list(self.grid),
+            "points_per_cell": self.points_per_cell,
+            "voxel_size": self.voxel_size,
+            "min_points_per_camera": self.min_points_per_camera,
+        }
+
+    def validCount(self):
+        # for the profiler, so it does not have to walk the cloud again
+        return self.valid_count
+
+    def readPoints(self):
+        # position, track and validity of every point, read into one flat array and split up by numpy
+        points = self.chunk.tie_points.points
+        rows = np.fromiter(self.pointValues(points), dtype=float, count=5 * len(points)).reshape(-1, 5)
+        return rows[:, :3], rows[:, 3].astype(np.int64), rows[:, 4] > 0.5
+
+    @staticmethod
+    def pointValues(points):
+        for point in points:
+            coord = point.coord
+            yield coord.x
+            yield coord.y
+            yield coord.z
+            yield point.track_id
+            yield point.valid
+
+    def readCriteria(self):
+        values = dict()
+        for name, criterion in QUALITY_CRITERIA.items():
+            f = Metashape.TiePoints.Filter()
+            f.init(self.chunk, criterion=criterion)
+            values[name] = np.asarray(f.values, dtype=float)
+        return values
+
+    def removePoints(self, remove):
+        '''removes every point of the mask in one removePoints call. The filter is handed the mask as its values, so
+        everything above the threshold goes'''
+        f = Metashape.TiePoints.Filter()
+        f.init(self.chunk, criterion=Metashape.TiePoints.Filter.ReprojectionError)
+        f.values = remove.astype(float).tolist()
+        f.removePoints(0.5)
+
+    def score(self, criteria, valid):
+        # lower is better: small errors and uncertainty, seen by many images
+        score = np.full(len(valid), np.inf)
+        score[valid] = (ranks(criteria["reprojection_error"][valid])
+                        + ranks(criteria["reconstruction_uncertainty"][valid])
+                        + (1.0 - ranks(criteria["image_count"][valid])))
+        return score
+
+    def readProjections(self, track_ids, valid):
+        '''point index, camera index and image cell of every projection of a valid point'''
+        track_order = np.argsort(track_ids)
+        sorted_tracks = track_ids[track_order]
+
+        point_index = []
+        camera_index = []
+        cells = []
+        cameras = [camera for camera in self.chunk.cameras if camera.transform is not None]
+        for index, camera in enumerate(cameras):
+            projections = self.chunk.tie_points.projections[camera]
+            if len(projections) == 0:
+                continue
+            tracks = np.fromiter((projection.track_id for projection in projections), dtype=np.int64, count=len(projections))
+            pixels = np.array([(projection.coord.x, projection.coord.y) for projection in projections], dtype=float)
+
+            # projections are by track, points are looked up through their track id
+            found = np.searchsorted(sorted_tracks, tracks)
+            found = np.minimum(found, len(sorted_tracks) - 1)
+            known = sorted_tracks[found] == tracks
+            points = track_order[found[known]]
+            pixels = pixels[known]
+            keep = valid[points]
+
+            width = camera.sensor.width or pixels[:, 0].max() + 1
+            height = camera.sensor.height or pixels[:, 1].max() + 1
+            cell_x = np.clip((pixels[keep, 0] / width * self.grid[0]).astype(np.int64), 0, self.grid[0] - 1)
+            cell_y = np.clip((pixels[keep, 1] / height * self.grid[1]).astype(np.int64), 0, self.grid[1] - 1)
+
+            point_index.append(points[keep])
+            camera_index.append(np.full(int(keep.sum()), index, dtype=np.int64))
+            cells.append((index * self.grid[1] + cell_y) * self.grid[0] + cell_x)
+
+        if len(point_index) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, len(cameras)
+        return np.concatenate(point_index), np.concatenate(camera_index), np.concatenate(cells), len(cameras)
+
+    def voxelKeys(self, coords, valid):
+        # voxels sized so that about budget of them cover the middle 90 % of the cloud
+        voxel_size = self.voxel_size
+        if voxel_size is None:
+            low, high = np.percentile(coords[valid], [5, 95], axis=0)
+            volume = float(np.prod(np.maximum(high - low, 1e-6)))
+            voxel_size = (volume / self.budget) ** (1.0 / 3.0)
+
+        cells = np.floor((coords - coords[valid].min(axis=0)) / voxel_size).astype(np.int64)
+        cells = np.clip(cells, 0, 2 ** 20 - 1)
+        return (cells[:, 0] << 40) | (cells[:, 1] << 20) | cells[:, 2], voxel_size
+
+    def select(self, coords, track_ids, valid, score):
+        valid_count = int(valid.sum())
+        point_index, camera_index, cells, camera_count = self.readProjections(track_ids, valid)
+
+        # 0 = best in an image cell, 1 = best in a voxel, 2 = everything else
+        tier = np.full(len(valid), 2, dtype=np.int64)
+        voxels, voxel_size = self.voxelKeys(coords, valid)
+        valid_points = np.flatnonzero(valid)
+        tier[valid_points[bestPerGroup(voxels[valid_points], score[valid_points])]] = 1
+        tier[point_index[bestPerGroup(cells, score[point_index], self.points_per_cell)]] = 0
+
+        order = np.lexsort((score, tier))
+        order = order[valid[order]]
+        keep = np.zeros(len(valid), dtype=bool)
+        keep[order[:self.budget]] = True
+
+        # connectivity: a camera with too few points left gets its best removed ones back
+        restored = 0
+        kept_per_camera = np.bincount(camera_index[keep[point_index]], minlength=camera_count)
+        for camera in np.flatnonzero(kept_per_camera < self.min_points_per_camera):
+            candidates = point_index[(camera_index == camera) & ~keep[point_index]]
+            missing = self.min_points_per_camera - int(kept_per_camera[camera])
+            best = candidates[np.argsort(score[candidates], kind="stable")[:missing]]
+            keep[best] = True
+            restored += len(best)
+
+        return keep, {
+            "valid_points": valid_count,
+            "kept_points": int(keep.sum()),
+            "image_cell_points": int(((tier == 0) & keep).sum()),
+            "voxel_points": int(((tier == 1) & keep).sum()),
+            "restored_for_connectivity": restored,
+            "voxel_size": voxel_size,
+            "cameras": camera_count,
+            "min_points_per_camera": int(np.bincount(camera_index[keep[point_index]], minlength=camera_count).min()) if camera_count > 0 else 0,
+        }
+
+    def run(self):
+        '''thins the cloud of the chunk down to about budget points and returns a summary of what was kept'''
+        with self.profiler.measure("thin read", self.chunk, self.validCount):
+            coords, track_ids, valid = self.readPoints()
+            criteria = self.readCriteria()
+            self.valid_count = int(valid.sum())
+
+        valid_count = self.valid_count
+        if valid_count <= self.budget:
+            print("{} tie points, within the budget of {}, nothing to thin".format(valid_count, self.budget))
+            return {"valid_points": valid_count, "kept_points": valid_count}
+
+        with self.profiler.measure("thin select", self.chunk, self.validCount):
+            keep, summary = self.select(coords, track_ids, valid, self.score(criteria, valid))
+
+        with self.profiler.measure("thin remove", self.chunk, self.validCount):
+            self.removePoints(valid & ~keep)
+            self.valid_count = summary["kept_points"]
+
+        print("thinned {valid_points} tie points to {kept_points} ({image_cell_points} for image coverage, {voxel_points} for "
+              "spread, {restored_for_connectivity} restored so no camera has fewer than {min_points_per_camera})".format(**summary))
+        return summary
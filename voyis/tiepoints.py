@@ -0,0 +1,337 @@
+import Metashape
+import math
+import numpy as np
+
+from voyis.profiling import StageProfiler
+
+
+# camera parameters each kind of optimization is allowed to adjust
+# barscans only move the poses, the calibration is what is being verified
+FIT_POSES_ONLY = {
+    "fit_f": False,
+    "fit_cx": False,
+    "fit_cy": False,
+    "fit_b1": False,
+    "fit_b2": False,
+    "fit_k1": False,
+    "fit_k2": False,
+    "fit_k3": False,
+    "fit_k4": False,
+    "fit_p1": False,
+    "fit_p2": False,
+    "fit_corrections": False,
+    "adaptive_fitting": False,
+}
+
+# the tie point cleaner also refines focal length, principal point and tangential distortion
+FIT_INTRINSICS = dict(FIT_POSES_ONLY, fit_f=True, fit_cx=True, fit_cy=True, fit_p1=True, fit_p2=True)
+
+FIT_PROFILES = {
+    "poses_only": FIT_POSES_ONLY,
+    "intrinsics": FIT_INTRINSICS,
+}
+
+# schedule criterion names to the metashape filter criteria. Higher values are worse for all of them
+CRITERIA = {
+    "image_count": Metashape.TiePoints.Filter.ImageCount,
+    "reconstruction_uncertainty": Metashape.TiePoints.Filter.ReconstructionUncertainty,
+    "projection_accuracy": Metashape.TiePoints.Filter.ProjectionAccuracy,
+    "reprojection_error": Metashape.TiePoints.Filter.ReprojectionError,
+}
+
+
+def thresholdSweep(start, stop, step):
+    # like range() but for floats, without np.arange piling up rounding errors on every step
+    count = max(0, math.ceil(round((stop - start) / step, 9)))
+    return [round(start + i * step, 6) for i in range(count)]
+
+
+class FilterStep:
+    '''one criterion of a filter schedule. Fixed steps remove every threshold in turn, adaptive steps
+    pick each threshold from the current values until end_threshold is reached'''
+
+    def __init__(self, criterion, thresholds=None, fit="poses_only", select_points=False,
+                 adaptive=False, end_threshold=None, max_removal_percent=10, min_removed_points=10,
+                 rms_tolerance=0.001, max_passes=10):
+        if criterion not in CRITERIA:
+            raise Exception("Unknown tie point filter criterion {}".format(criterion))
+        if fit not in FIT_PROFILES:
+            raise Exception("Unknown optimization profile {}".format(fit))
+        if adaptive and end_threshold is None:
+            raise Exception("Adaptive filter steps need an end threshold")
+
+        self.criterion = criterion
+        self.thresholds = list(thresholds) if thresholds is not None else []
+        self.fit = fit
+        self.select_points = select_points
+        self.adaptive = adaptive
+        self.end_threshold = end_threshold
+        self.max_removal_percent = max_removal_percent
+        self.min_removed_points = min_removed_points
+        self.rms_tolerance = rms_tolerance
+        self.max_passes = max_passes
+
+    def describe(self):
+        return dict(vars(self))
+
+
+# optimize_every value that runs one optimization at the end of each criterion instead of after every K removals
+OPTIMIZE_PER_CRITERION = "criterion"
+
+
+class FilterSchedule:
+    '''an ordered list of filter steps followed by one optimization with tie point covariance.
+    optimize_every=1 optimizes after every removal, K after every K removals of a criterion and
+    OPTIMIZE_PER_CRITERION once per criterion. Pending removals are always optimized before the next criterion.'''
+
+    def __init__(self, name, steps, final_fit="poses_only", optimize_every=1):
+        if optimize_every != OPTIMIZE_PER_CRITERION and (not isinstance(optimize_every, int) or optimize_every < 1):
+            raise Exception("optimize_every has to be a positive integer or {}".format(OPTIMIZE_PER_CRITERION))
+
+        self.name = name
+        self.steps = steps
+        self.final_fit = final_fit
+        self.optimize_every = optimize_every
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "final_fit": self.final_fit,
+            "optimize_every": self.optimize_every,
+            "steps": [step.describe() for step in self.steps],
+        }
+
+
+def deferredSchedule(schedule, optimize_every=OPTIMIZE_PER_CRITERION):
+    # same steps, fewer bundle adjustments
+    name = "{}_every_{}".format(schedule.name, optimize_every)
+    return FilterSchedule(name, schedule.steps, schedule.final_fit, optimize_every)
+
+
+def barscanSchedule():
+    # what both barscan report scripts have always run
+    return FilterSchedule("barscan", [
+        FilterStep("image_count", [2], select_points=True),
+        FilterStep("reconstruction_uncertainty", range(100, 20, -20)),
+        FilterStep("projection_accuracy", range(90, 20, -20)),
+        FilterStep("reprojection_error", thresholdSweep(1.2, 0.5, -0.2)),
+    ])
+
+
+def cleanerSchedule(img_count=2, max_reconstruction_uncertainty=35, min_projection_accuracy=15, min_reprojection_error=0.4):
+    # what the Filter Tie Points menu entry has always run
+    return FilterSchedule("cleaner", [
+        FilterStep("image_count", [img_count], fit="intrinsics", select_points=True),
+        FilterStep("reconstruction_uncertainty", range(100, max_reconstruction_uncertainty, -10), fit="intrinsics"),
+        FilterStep("projection_accuracy", range(90, min_projection_accuracy, -10), fit="intrinsics"),
+        FilterStep("reprojection_error", thresholdSweep(1.2, min_reprojection_error, -0.1), fit="intrinsics"),
+    ], final_fit="intrinsics")
+
+
+def adaptiveCleanerSchedule(img_count=2, max_reconstruction_uncertainty=35, min_projection_accuracy=15, min_reprojection_error=0.4,
+                            max_removal_percent=10, min_removed_points=10, rms_tolerance=0.001, max_passes=10):
+    # the sweeps of the cleaner stop short of their limits (range is exclusive), so the end thresholds are the last
+    # values the cleaner actually applies. Otherwise adaptive would cut deeper than the schedule it replaces
+    cleaner = cleanerSchedule(img_count, max_reconstruction_uncertainty, min_projection_accuracy, min_reprojection_error)
+    end_thresholds = {step.criterion: step.thresholds[-1] for step in cleaner.steps if len(step.thresholds) > 0}
+
+    adaptive = {
+        "fit": "intrinsics",
+        "adaptive": True,
+        "max_removal_percent": max_removal_percent,
+        "min_removed_points": min_removed_points,
+        "rms_tolerance": rms_tolerance,
+        "max_passes": max_passes,
+    }
+    return FilterSchedule("cleaner_adaptive", [
+        FilterStep("image_count", [img_count], fit="intrinsics", select_points=True),
+        FilterStep("reconstruction_uncertainty", end_threshold=end_thresholds["reconstruction_uncertainty"], **adaptive),
+        FilterStep("projection_accuracy", end_threshold=end_thresholds["projection_accuracy"], **adaptive),
+        FilterStep("reprojection_error", end_threshold=end_thresholds["reprojection_error"], **adaptive),
+    ], final_fit="intrinsics")
+
+
+SCHEDULE_PRESETS = {
+    "barscan": barscanSchedule,
+    "barscan_deferred": lambda: deferredSchedule(barscanSchedule()),
+    "cleaner": cleanerSchedule,
+    "cleaner_adaptive": adaptiveCleanerSchedule,
+}
+
+
+# criteria that remove the points at or below the threshold instead of above it
+REMOVES_AT_OR_BELOW = {"image_count"}
+
+
+def removalMask(criterion, values, threshold):
+    if criterion in REMOVES_AT_OR_BELOW:
+        return values <= threshold
+    return values > threshold
+
+
+def loosestThreshold(criterion, thresholds):
+    # the one threshold that removes everything the others would have removed one after another
+    return max(thresholds) if criterion in REMOVES_AT_OR_BELOW else min(thresholds)
+
+
+def removalCounts(criterion, values, thresholds):
+    '''how many of the values each threshold removes, from one sort and a searchsorted instead of a pass per threshold'''
+    sorted_values = np.sort(values)
+    at_or_below = np.searchsorted(sorted_values, np.asarray(thresholds, dtype=float), side="right")
+    if criterion in REMOVES_AT_OR_BELOW:
+        return at_or_below
+    return len(sorted_values) - at_or_below
+
+
+class TiePointFilter:
+    '''runs a filter schedule on a chunk. The one place every tie point filter in these scripts goes through.
+
+    The values of a criterion only change when the cameras are optimized, so each criterion is read into numpy
+    once per optimization and every threshold until the next optimization works on that copy. Thresholds with no
+    optimization between them are removed in one go, at the loosest of them'''
+
+    def __init__(self, chunk, schedule, profiler=None):
+        self.chunk = chunk
+        self.schedule = schedule
+        self.profiler = profiler if profiler is not None else StageProfiler()
+
+        # removals since the last optimization and how many optimizations ran, for comparing schedules
+        self.pending_removals = 0
+        self.optimizations = 0
+
+        # criterion -> (initialized metashape filter, value of every tie point). Thrown away by the next optimization
+        self.filters = dict()
+        # which points are still valid. Read off the cloud once, after that every removal goes through here anyway
+        self.valid = None
+        self.filter_inits = 0
+
+        # criterion, threshold, points removed by it and points left after it, for the log and for comparing schedules
+        self.removal_log = []
+
+    def validCount(self):
+        # for the profiler, None until the mask was read and the profiler has to count itself
+        return int(np.count_nonzero(self.valid)) if self.valid is not None else None
+
+    def optimize(self, fit, calcVariance=False):
+        self.chunk.optimizeCameras(tiepoint_covariance=calcVariance, **FIT_PROFILES[fit])
+        self.pending_removals = 0
+        self.optimizations += 1
+        self.filters.clear()
+
+    def afterRemoval(self, step, removals=1):
+        self.pending_removals += removals
+        if self.schedule.optimize_every != OPTIMIZE_PER_CRITERION and self.pending_removals >= self.schedule.optimize_every:
+            self.optimize(step.fit)
+
+    def flushRemovals(self, step):
+        # the next criterion has to see the poses after this one's removals
+        if self.pending_removals > 0:
+            with self.profiler.measure("{} optimize".format(step.criterion), self.chunk, self.validCount):
+                self.optimize(step.fit)
+
+    def criterionFilter(self, criterion):
+        if criterion not in self.filters:
+            f = Metashape.TiePoints.Filter()
+            f.init(self.chunk, criterion=CRITERIA[criterion])
+            self.filters[criterion] = (f, np.asarray(f.values, dtype=float))
+            self.filter_inits += 1
+
+        f, values = self.filters[criterion]
+        if self.valid is None:
+            self.valid = np.fromiter((point.valid for point in self.chunk.tie_points.points), dtype=bool, count=len(values))
+        return f, values
+
+    def criterionValues(self, criterion):
+        # per point values of the criterion, only for the points that are still valid
+        f, values = self.criterionFilter(criterion)
+        return f, values[self.valid]
+
+    def rmsReprojectionError(self):
+        _, values = self.criterionValues("reprojection_error")
+        if len(values) == 0:
+            return 0.0
+        return float(np.sqrt(np.mean(values ** 2)))
+
+    def removePoints(self, step, thresholds):
+        '''removes every point any of the thresholds would remove in one removePoints call and logs how many
+        each threshold accounts for. Returns the number of points removed'''
+        f, values = self.criterionFilter(step.criterion)
+        valid_values = values[self.valid]
+
+        # cumulative counts in the order the thresholds were given, tightest last
+        removed = removalCounts(step.criterion, valid_values, thresholds)
+        increments = np.diff(removed, prepend=0)
+        for threshold, count, total in zip(thresholds, increments, removed):
+            self.removal_log.append({
+                "criterion": step.criterion,
+                "threshold": threshold,
+                "removed": int(count),
+                "remaining": int(len(valid_values) - total),
+            })
+        print("{} removed per threshold: {}, {} of {} points left".format(
+            step.criterion, ", ".join("{} -> {}".format(t, int(c)) for t, c in zip(thresholds, increments)),
+            len(valid_values) - int(removed[-1]), len(valid_values)))
+
+        threshold = loosestThreshold(step.criterion, thresholds)
+        if step.select_points:
+            f.selectPoints(threshold)
+        f.removePoints(threshold)
+        self.valid &= ~removalMask(step.criterion, values, threshold)
+        return int(removed[-1])
+
+    def thresholdBatches(self, step):
+        # the thresholds that run without an optimization between them
+        if self.schedule.optimize_every == OPTIMIZE_PER_CRITERION:
+            return [step.thresholds] if len(step.thresholds) > 0 else []
+        every = self.schedule.optimize_every
+        return [step.thresholds[i:i + every] for i in range(0, len(step.thresholds), every)]
+
+    def run(self):
+        for step in self.schedule.steps:
+            if step.adaptive:
+                self.runAdaptiveStep(step)
+            else:
+                self.runFixedStep(step)
+            self.flushRemovals(step)
+
+        # one last calc with the variance for saving
+        with self.profiler.measure("covariance", self.chunk, self.validCount):
+            self.optimize(self.schedule.final_fit, calcVariance=True)
+
+    def runFixedStep(self, step):
+        print("filtering points by {} at {}".format(step.criterion, step.thresholds))
+
+        for thresholds in self.thresholdBatches(step):
+            label = " ".join(str(threshold) for threshold in thresholds)
+            with self.profiler.measure("{} {}".format(step.criterion, label), self.chunk, self.validCount):
+                self.removePoints(step, thresholds)
+                self.afterRemoval(step, len(thresholds))
+
+    def runAdaptiveStep(self, step):
+        print("adaptive filtering of {} down to {}".format(step.criterion, step.end_threshold))
+        rms = self.rmsReprojectionError()
+
+        for adaptive_pass in range(step.max_passes):
+            _, values = self.criterionValues(step.criterion)
+            if len(values) == 0:
+                break
+
+            # never go past the end threshold, and never take more than the allowed share in one pass
+            threshold = max(step.end_threshold, float(np.percentile(values, 100 - step.max_removal_percent)))
+            removed = int(np.count_nonzero(values > threshold))
+            if removed < step.min_removed_points:
+                print("{} converged, only {} points above {:.3f}".format(step.criterion, removed, threshold))
+                break
+
+            with self.profiler.measure("{} pass {} {:.3f}".format(step.criterion, adaptive_pass, threshold), self.chunk, self.validCount):
+                self.removePoints(step, [threshold])
+                self.afterRemoval(step)
+
+            new_rms = self.rmsReprojectionError()
+            print("{} pass {}: removed {} points above {:.3f}, rms reprojection error {:.4f}".format(
+                step.criterion, adaptive_pass, removed, threshold, new_rms))
+
+            rms_change = abs(rms - new_rms)
+            rms = new_rms
+            if threshold <= step.end_threshold or rms_change < step.rms_tolerance:
+                break
@@ -0,0 +1,276 @@
+import os
+import sys
+import html
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from voyis.results import DEFAULT_DATABASE, ResultsDatabase
+
+
+# how many runs of a bar the rolling statistics look back over, and what the first runs (the baseline) are
+DEFAULT_WINDOW = 5
+
+# a bar whose recent mean error moved this far (in %) from its baseline is drifting. A third of the passing rms,
+# so a unit gets flagged well before it starts failing
+DEFAULT_DRIFT_THRESHOLD = 0.01
+
+# fewer runs than this and there is no telling drift from noise
+DEFAULT_MIN_RUNS = 4
+
+BAR_KEYS = ["serial_id", "bar_name"]
+
+BAR_QUERY = """
+SELECT runs.serial_id, runs.timestamp, runs.run_uuid, runs.fixture_id, runs.passed, runs.rms_error_percentage,
+       bar_results.bar_name, bar_results.error_percent
+FROM runs JOIN bar_results USING (run_uuid)
+WHERE bar_results.error_percent IS NOT NULL
+"""
+
+
+def loadBarFrame(database):
+    '''one row per bar of every run in the results database, sorted by serial, bar and time'''
+    frame = pd.read_sql_query(BAR_QUERY, database.connection)
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], format="ISO8601")
+    frame["error_percent"] = frame["error_percent"].astype(float)
+    return frame.sort_values(BAR_KEYS + ["timestamp"], kind="stable").reset_index(drop=True)
+
+
+def addRollingStatistics(frame, window=DEFAULT_WINDOW):
+    '''adds the rolling mean / std of the error of each bar of each unit over its last window runs'''
+    grouped = frame.groupby(BAR_KEYS, sort=False)["error_percent"]
+    # rolling on a groupby comes back with the group keys in front, the rows are already in group order
+    frame["rolling_mean_percent"] = grouped.rolling(window, min_periods=1).mean().to_numpy()
+    frame["rolling_std_percent"] = grouped.rolling(window, min_periods=2).std().to_numpy()
+    frame["run_number"] = frame.groupby(BAR_KEYS, sort=False).cumcount()
+    return frame
+
+
+def barDrift(frame, window=DEFAULT_WINDOW, drift_threshold=DEFAULT_DRIFT_THRESHOLD, min_runs=DEFAULT_MIN_RUNS):
+    '''drift of every bar of every unit: the mean error of its last window runs against its first window runs, and
+    the least squares slope of the error over time. A bar with fewer than 2 x window runs is split into halves
+    instead, so the baseline and the recent runs never share a run. All group-bys, no loop over units'''
+    grouped = frame.groupby(BAR_KEYS, sort=False)
+    runs = grouped["error_percent"].transform("size")
+    span = np.minimum(window, runs // 2)
+
+    baseline = frame[frame["run_number"] < span].groupby(BAR_KEYS, sort=False)["error_percent"].mean()
+    recent = frame[frame["run_number"] >= runs - span].groupby(BAR_KEYS, sort=False)["error_percent"].mean()
+
+    # slope from the sums, days since the first run of the bar so the numbers stay small
+    days = (frame["timestamp"] - grouped["timestamp"].transform("min")).dt.total_seconds() / 86400.0
+    sums = pd.DataFrame({
+        "n": 1.0,
+        "x": days,
+        "y": frame["error_percent"],
+        "xx": days * days,
+        "xy": days * frame["error_percent"],
+    }).groupby([frame["serial_id"], frame["bar_name"]], sort=False).sum()
+    denominator = sums["n"] * sums["xx"] - sums["x"] ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where(denominator > 0, (sums["n"] * sums["xy"] - sums["x"] * sums["y"]) / denominator, np.nan)
+
+    drift = pd.DataFrame({
+        "runs": sums["n"].astype(int),
+        "first_run": grouped["timestamp"].min(),
+        "last_run": grouped["timestamp"].max(),
+        "baseline_percent": baseline,
+        "recent_percent": recent,
+        "drift_percent": recent - baseline,
+        "slope_percent_per_30_days": slope * 30,
+        "last_rolling_std_percent": grouped["rolling_std_percent"].last(),
+    })
+    drift["drifting"] = (drift["runs"] >= min_runs) & (drift["drift_percent"].abs() > drift_threshold)
+    return drift.reset_index()
+
+
+def unitSummary(frame, drift):
+    '''one row per serial: its runs, the latest verdict and its worst drifting bar'''
+    # the frame is sorted by bar first, the runs have to be in time order for last() to be the latest run
+    runs = frame.drop_duplicates("run_uuid").sort_values(["serial_id", "timestamp"], kind="stable")
+    grouped = runs.groupby("serial_id", sort=True)
+    summary = pd.DataFrame({
+        "runs": grouped.size(),
+        "first_run": grouped["timestamp"].min(),
+        "last_run": grouped["timestamp"].max(),
+        "pass_rate": grouped["passed"].mean(),
+        "last_rms_error_percentage": grouped["rms_error_percentage"].last(),
+        "last_passed": grouped["passed"].last(),
+    })
+
+    # the bar that moved the most decides how badly a unit drifts
+    worst = drift.loc[drift["drift_percent"].abs().fillna(-1).groupby(drift["serial_id"]).idxmax()].set_index("serial_id")
+    summary["worst_bar"] = worst["bar_name"]
+    summary["worst_drift_percent"] = worst["drift_percent"]
+    summary["drifting_bars"] = drift.groupby("serial_id")["drifting"].sum().astype(int)
+    summary["drifting"] = summary["drifting_bars"] > 0
+    summary = summary.reset_index()
+
+    # drifting units first, the worst of them on top
+    order = np.lexsort((-summary["worst_drift_percent"].abs().fillna(0).to_numpy(), ~summary["drifting"].to_numpy()))
+    return summary.iloc[order].reset_index(drop=True)
+
+
+class FleetTrends:
+    '''the drift of every unit in the results database. Built once, rendered as html and / or pdf'''
+
+    def __init__(self, frame, window=DEFAULT_WINDOW, drift_threshold=DEFAULT_DRIFT_THRESHOLD, min_runs=DEFAULT_MIN_RUNS):
+        self.window = window
+        self.drift_threshold = drift_threshold
+        self.min_runs = min_runs
+
+        self.frame = addRollingStatistics(frame, window)
+        self.drift = barDrift(self.frame, window, drift_threshold, min_runs)
+        self.units = unitSummary(self.frame, self.drift)
+
+    @classmethod
+    def fromDatabase(cls, database, **kwargs):
+        return cls(loadBarFrame(database), **kwargs)
+
+    def drifting(self):
+        return self.units[self.units["drifting"]]
+
+    def driftingBars(self):
+        return self.drift[self.drift["drifting"]].sort_values("drift_percent", key=np.abs, ascending=False)
+
+    def headline(self):
+        return [
+            "{} units, {} runs, {} bar measurements".format(len(self.units), int(self.units["runs"].sum()), len(self.frame)),
+            "{} units drifting: recent mean of the last {} runs more than {} % from the first {} (halves of shorter histories), with at least {} runs".format(
+                len(self.drifting()), self.window, self.drift_threshold, self.window, self.min_runs),
+            "{} units failed their last run".format(int((self.units["last_passed"] == 0).sum())),
+        ]
+
+    def unitRows(self, units):
+        for row in units.itertuples(index=False):
+            yield [
+                row.serial_id,
+                str(row.runs),
+                row.last_run.strftime("%Y-%m-%d"),
+                "{:.0%}".format(row.pass_rate) if pd.notna(row.pass_rate) else "-",
+                "{:.4f}".format(row.last_rms_error_percentage) if pd.notna(row.last_rms_error_percentage) else "-",
+                row.worst_bar,
+                "{:+.4f}".format(row.worst_drift_percent) if pd.notna(row.worst_drift_percent) else "-",
+                "Fail" if row.drifting else "Pass",
+            ]
+
+    def barRows(self, bars):
+        for row in bars.itertuples(index=False):
+            yield [
+                row.serial_id,
+                row.bar_name,
+                str(row.runs),
+                "{:+.4f}".format(row.baseline_percent),
+                "{:+.4f}".format(row.recent_percent),
+                "{:+.4f}".format(row.drift_percent),
+                "{:+.4f}".format(row.slope_percent_per_30_days) if pd.notna(row.slope_percent_per_30_days) else "-",
+            ]
+
+    def writeHtml(self, filename):
+        # one self contained page, no javascript, opens from a shared drive
+        def table(header, rows, status_column=None):
+            lines = ["<table><tr>{}</tr>".format("".join("<th>{}</th>".format(html.escape(name)) for name in header))]
+            for row in rows:
+                cells = []
+                for column, value in enumerate(row):
+                    css = ' class="{}"'.format(value.lower()) if column == status_column else ""
+                    cells.append("<td{}>{}</td>".format(css, html.escape(value)))
+                lines.append("<tr>{}</tr>".format("".join(cells)))
+            lines.append("</table>")
+            return "\n".join(lines)
+
+        body = [
+            "<h1>Barscan Fleet Summary</h1>",
+            "<p>Generated {}</p>".format(time.strftime("%Y-%m-%d %H:%M")),
+            "".join("<p>{}</p>".format(html.escape(line)) for line in self.headline()),
+            "<h2>Drifting Bars</h2>",
+            table(BAR_HEADER, self.barRows(self.driftingBars())),
+            "<h2>Units</h2>",
+            table(UNIT_HEADER, self.unitRows(self.units), status_column=len(UNIT_HEADER) - 1),
+        ]
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        with open(filename, "w") as filepointer:
+            filepointer.write(HTML_PAGE.format(body="\n".join(body)))
+        return filename
+
+    def writePdf(self, filename):
+        from reportlab.platypus import BaseDocTemplate, Paragraph
+
+        from voyis.report import FlowableStream, reportTemplate, tables
+
+        template = reportTemplate()
+        created = time.strftime("%Y-%m-%d %H:%M")
+
+        def flowables():
+            yield Paragraph("Barscan Fleet Summary", template.title)
+            for line in ["Generated {}".format(created)] + self.headline():
+                yield Paragraph(line, template.body)
+            yield Paragraph("Drifting Bars", template.heading)
+            yield from tables(template, BAR_HEADER, self.barRows(self.driftingBars()), [0.14, 0.26, 0.08, 0.13, 0.13, 0.13, 0.13])
+            yield Paragraph("Units", template.heading)
+            yield from tables(template, UNIT_HEADER, self.unitRows(self.units), [0.12, 0.06, 0.12, 0.08, 0.1, 0.26, 0.12, 0.14], status_column=7)
+
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        doc = BaseDocTemplate(filename, pagesize=template.pagesize, pageCompression=1, title="Barscan Fleet Summary")
+        doc.addPageTemplates(template.pageTemplates("Fleet summary - {}".format(created)))
+        doc.build(FlowableStream(flowables()))
+        return filename
+
+
+UNIT_HEADER = ["Serial", "Runs", "Last run", "Passed", "Last RMS %", "Worst bar", "Drift %", "Drifting"]
+BAR_HEADER = ["Serial", "Bar", "Runs", "Baseline %", "Recent %", "Drift %", "Slope %/30d"]
+
+HTML_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Barscan Fleet Summary</title>
+<style>
+body {{ font-family: Helvetica, Arial, sans-serif; font-size: 13px; margin: 24px; }}
+table {{ border-collapse: collapse; margin-bottom: 16px; }}
+th, td {{ border: 1px solid #999; padding: 2px 8px; text-align: left; }}
+th {{ background: #ddd; }}
+td.fail {{ background: #f88; }}
+td.pass {{ background: #8d8; }}
+</style></head>
+<body>
+{body}
+</body></html>
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drift of every unit across its repeated barscans")
+    parser.add_argument("--database", default=DEFAULT_DATABASE)
+    parser.add_argument("--backfill", default=None, help="ingest the results files under this folder first")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_DRIFT_THRESHOLD, help="drift in %% that flags a bar")
+    parser.add_argument("--min-runs", type=int, default=DEFAULT_MIN_RUNS)
+    parser.add_argument("--html", default=None)
+    parser.add_argument("--pdf", default=None)
+    args = parser.parse_args(argv)
+
+    database = ResultsDatabase(args.database)
+    if args.backfill is not None:
+        database.backfill(args.backfill)
+
+    start = time.perf_counter()
+    trends = FleetTrends.fromDatabase(database, window=args.window, drift_threshold=args.threshold, min_runs=args.min_runs)
+    database.close()
+    print("aggregated {} bar measurements in {:.2f} s".format(len(trends.frame), time.perf_counter() - start))
+
+    for line in trends.headline():
+        print(line)
+    for row in trends.unitRows(trends.drifting()):
+        print("  ".join("{:<14}".format(value) for value in row))
+
+    if args.html is not None:
+        print("wrote {}".format(trends.writeHtml(args.html)))
+    if args.pdf is not None:
+        print("wrote {}".format(trends.writePdf(args.pdf)))
+
+    # a drifting unit is something to act on, scripts can check the exit code
+    return 1 if len(trends.drifting()) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,379 @@
+# Watches the ingest folder the technicians copy Stills_<serial> folders into and runs a barscan for every one of
+# them once the copy is done. The queue is a sqlite file next to nothing else, so a restart (or a crash) picks up
+# where it left off. No services needed, e.g. as a systemd unit:
+#
+#   ExecStart=/opt/metashape/python/bin/python3 -m voyis.watcher watch /data/ingest --calibration /data/AgisoftParams --workers 2
+#
+# and to look at or poke the queue:
+#
+#   python -m voyis.watcher status
+#   python -m voyis.watcher enqueue /data/ingest/Stills_230900123 --priority 10
+#   python -m voyis.watcher retry 42
+
+import os
+import sys
+import time
+import signal
+import sqlite3
+import argparse
+import concurrent.futures
+
+from voyis.barscan import DEFAULT_FILTER_PRESET, getSerialIdFromFolder
+from voyis.batch import STILLS_FOLDER_PREFIX, findVerificationFolders, runBarscanWorker
+from voyis.fixtures import DEFAULT_FIXTURE
+
+
+DEFAULT_QUEUE = os.environ.get(
+    "VOYIS_QUEUE_DB", os.path.join(os.path.expanduser("~"), ".voyis", "barscan_queue.sqlite"))
+
+# a folder counts as copied once nothing in it changed for this long. Copies off the units stall now and then
+DEFAULT_STABLE_SECONDS = 120
+DEFAULT_POLL_SECONDS = 10
+
+DEFAULT_MAX_ATTEMPTS = 3
+# a failed attempt waits this long, doubled for every attempt before it
+DEFAULT_RETRY_SECONDS = 300
+
+# our own output goes into the stills folder, it must not make the folder look like it is still being copied
+IGNORED_FOLDER_MARKERS = ["_Verification-", ".files"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    folder TEXT NOT NULL,
+    serial_id TEXT,
+    signature TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    not_before REAL NOT NULL DEFAULT 0,
+    enqueued REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    passed INTEGER,
+    output_folder TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, priority, enqueued);
+CREATE INDEX IF NOT EXISTS jobs_by_folder ON jobs (folder, id);
+"""
+
+JOB_STATES = ["pending", "running", "done", "failed"]
+
+
+def folderSignature(folder):
+    '''file count, total size and newest mtime of everything under folder but our own output. Any change to
+    it means the copy is still going'''
+    count = 0
+    size = 0
+    newest = 0
+    pending = [folder]
+    while len(pending) > 0:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not any(marker in entry.name for marker in IGNORED_FOLDER_MARKERS):
+                        pending.append(entry.path)
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                count += 1
+                size += stat.st_size
+                newest = max(newest, stat.st_mtime_ns)
+    return "{}:{}:{}".format(count, size, newest)
+
+
+class StabilityTracker:
+    '''remembers when the signature of every folder last changed. A folder is stable once it did not change
+    for stable_seconds, and an empty folder never is'''
+
+    def __init__(self, stable_seconds=DEFAULT_STABLE_SECONDS, clock=time.monotonic):
+        self.stable_seconds = stable_seconds
+        self.clock = clock
+        self.seen = dict()
+
+    def update(self, folder):
+        # returns the signature once the folder is stable, None while it is not
+        try:
+            signature = folderSignature(folder)
+        except OSError:
+            # moved or deleted under us, start over if it comes back
+            self.seen.pop(folder, None)
+            return None
+
+        now = self.clock()
+        previous = self.seen.get(folder)
+        if previous is None or previous[0] != signature:
+            self.seen[folder] = (signature, now)
+            return None
+        if signature.startswith("0:") or now - previous[1] < self.stable_seconds:
+            return None
+        return signature
+
+    def forget(self, folders):
+        for folder in set(self.seen) - set(folders):
+            del self.seen[folder]
+
+
+class JobQueue:
+    '''barscan jobs in a sqlite file. Claiming a job is one write transaction, so several watchers on the
+    same box (there should only be one, but still) never run a folder twice'''
+
+    def __init__(self, filename=DEFAULT_QUEUE):
+        self.filename = filename
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self.connection = sqlite3.connect(filename, timeout=60, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def latest(self, folder):
+        return self.connection.execute("SELECT * FROM jobs WHERE folder = ? ORDER BY id DESC LIMIT 1", [folder]).fetchone()
+
+    def enqueue(self, folder, signature=None, priority=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        folder = os.path.abspath(folder)
+        # queued by hand the content is taken as it is now, so the watcher does not queue it a second time
+        signature = signature if signature is not None else folderSignature(folder)
+        try:
+            serial_id = getSerialIdFromFolder(os.path.basename(folder))
+        except AttributeError:
+            serial_id = None
+
+        cursor = self.connection.execute(
+            "INSERT INTO jobs (folder, serial_id, signature, priority, max_attempts, enqueued) VALUES (?, ?, ?, ?, ?, ?)",
+            [folder, serial_id, signature, priority, max_attempts, time.time()])
+        print("queued {} (job {}, priority {})".format(folder, cursor.lastrowid, priority))
+        return cursor.lastrowid
+
+    def offer(self, folder, signature, priority=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        '''enqueues a stable folder unless it is already queued or was already run with this content.
+        A folder that changed after its run (more images copied in) is run again'''
+        job = self.latest(os.path.abspath(folder))
+        if job is not None and (job["state"] in ("pending", "running") or job["signature"] == signature):
+            return None
+        return self.enqueue(folder, signature, priority, max_attempts)
+
+    def claim(self):
+        # the most important, then oldest, pending job that is not waiting for a retry
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            job = self.connection.execute(
+                "SELECT * FROM jobs WHERE state = 'pending' AND not_before <= ? ORDER BY priority DESC, enqueued, id LIMIT 1",
+                [time.time()]).fetchone()
+            if job is not None:
+                self.connection.execute(
+                    "UPDATE jobs SET state = 'running', attempts = attempts + 1, started = ? WHERE id = ?", [time.time(), job["id"]])
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return job
+
+    def finish(self, job_id, result, retry_seconds=DEFAULT_RETRY_SECONDS):
+        job = self.connection.execute("SELECT * FROM jobs WHERE id = ?", [job_id]).fetchone()
+
+        if result["error"] is None:
+            # a failed verification is a result, not something to retry
+            self.connection.execute(
+                "UPDATE jobs SET state = 'done', finished = ?, passed = ?, output_folder = ?, error = NULL WHERE id = ?",
+                [time.time(), result["passed"], result["output_folder"], job_id])
+            return "done"
+
+        if job["attempts"] < job["max_attempts"]:
+            delay = retry_seconds * 2 ** (job["attempts"] - 1)
+            self.connection.execute(
+                "UPDATE jobs SET state = 'pending', not_before = ?, error = ? WHERE id = ?", [time.time() + delay, result["error"], job_id])
+            print("job {} failed (attempt {} of {}), retrying in {:.0f} s".format(job_id, job["attempts"], job["max_attempts"], delay))
+            return "pending"
+
+        self.connection.execute(
+            "UPDATE jobs SET state = 'failed', finished = ?, output_folder = ?, error = ? WHERE id = ?",
+            [time.time(), result["output_folder"], result["error"], job_id])
+        return "failed"
+
+    def retry(self, job_id, priority=None):
+        # back to the queue with a fresh set of attempts, e.g. after fixing the calibration folder
+        self.connection.execute(
+            "UPDATE jobs SET state = 'pending', attempts = 0, not_before = 0, priority = COALESCE(?, priority) WHERE id = ?",
+            [priority, job_id])
+
+    def requeueInterrupted(self):
+        # a job still running when the watcher starts was cut off. The barscan resumes from its checkpoints
+        count = self.connection.execute("UPDATE jobs SET state = 'pending' WHERE state = 'running'").rowcount
+        if count > 0:
+            print("requeued {} interrupted jobs".format(count))
+        return count
+
+    def counts(self):
+        counts = {state: 0 for state in JOB_STATES}
+        counts.update({row["state"]: row["count"] for row in self.connection.execute("SELECT state, COUNT(*) AS count FROM jobs GROUP BY state")})
+        return counts
+
+    def jobs(self, states=None, limit=50):
+        states = states or JOB_STATES
+        query = "SELECT * FROM jobs WHERE state IN ({}) ORDER BY id DESC LIMIT ?".format(", ".join("?" * len(states)))
+        return [dict(row) for row in self.connection.execute(query, list(states) + [limit])]
+
+
+def runQueuedBarscan(verification_folder, camera_calibration_folder, fixture_id=DEFAULT_FIXTURE, filter_preset=DEFAULT_FILTER_PRESET):
+    # one job in a worker process. The pdf is rendered right away, there is no end of the batch to wait for
+    from voyis.report import renderReportFile
+
+    result = runBarscanWorker(verification_folder, camera_calibration_folder, fixture_id, filter_preset)
+    if result["error"] is None and result["report_data_file"] is not None:
+        try:
+            result["report_file"] = renderReportFile(result["report_data_file"])
+        except Exception as e:
+            result["error"] = repr(e)
+    return result
+
+
+class BarscanWatcher:
+    '''scans the ingest folder, queues every stable Stills_<serial> folder and keeps n_jobs barscans running'''
+
+    def __init__(self, ingest_folder, camera_calibration_folder, queue, n_jobs=1, fixture_id=DEFAULT_FIXTURE,
+                 filter_preset=DEFAULT_FILTER_PRESET, stable_seconds=DEFAULT_STABLE_SECONDS, poll_seconds=DEFAULT_POLL_SECONDS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, retry_seconds=DEFAULT_RETRY_SECONDS):
+        if not os.path.exists(ingest_folder):
+            raise Exception("Ingest folder {} does not exist".format(ingest_folder))
+        if not os.path.exists(camera_calibration_folder):
+            raise Exception("Camera calibration folder {} does not exist".format(camera_calibration_folder))
+
+        self.ingest_folder = ingest_folder
+        self.camera_calibration_folder = camera_calibration_folder
+        self.queue = queue
+        self.n_jobs = max(1, n_jobs)
+        self.fixture_id = fixture_id
+        self.filter_preset = filter_preset
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+
+        self.tracker = StabilityTracker(stable_seconds)
+        # future -> (job id, the executor running it)
+        self.running = dict()
+        self.stopping = False
+
+    def stop(self, *args):
+        if not self.stopping:
+            print("stopping, waiting for {} running barscans".format(len(self.running)))
+        self.stopping = True
+
+    def scan(self):
+        folders = findVerificationFolders(self.ingest_folder)
+        self.tracker.forget(folders)
+        for folder in folders:
+            signature = self.tracker.update(folder)
+            if signature is not None:
+                self.queue.offer(folder, signature, max_attempts=self.max_attempts)
+
+    def newExecutor(self):
+        # a fresh process per barscan, metashape does not give all of its memory back after a project. One single
+        # worker pool per job instead of max_tasks_per_child, that needs python 3.11 and metashape ships an older one
+        return concurrent.futures.ProcessPoolExecutor(max_workers=1)
+
+    def dispatch(self):
+        while len(self.running) < self.n_jobs and not self.stopping:
+            job = self.queue.claim()
+            if job is None:
+                return
+            print("starting job {} for {} (attempt {})".format(job["id"], job["folder"], job["attempts"] + 1))
+            executor = self.newExecutor()
+            future = executor.submit(runQueuedBarscan, job["folder"], self.camera_calibration_folder, self.fixture_id, self.filter_preset)
+            self.running[future] = (job["id"], executor)
+
+    def collect(self, timeout):
+        if len(self.running) == 0:
+            time.sleep(timeout)
+            return
+
+        finished, _ = concurrent.futures.wait(self.running, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in finished:
+            job_id, executor = self.running.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                # the worker process itself died, e.g. metashape crashed or ran out of memory. Only this job's pool goes with it
+                result = {"error": repr(e), "passed": False, "output_folder": None}
+            executor.shutdown(wait=False)
+            state = self.queue.finish(job_id, result, self.retry_seconds)
+            print("job {} {}{}".format(job_id, state, ", passed" if result["passed"] else ""))
+
+    def run(self):
+        self.queue.requeueInterrupted()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        print("watching {} for {}<serial> folders with {} workers".format(self.ingest_folder, STILLS_FOLDER_PREFIX, self.n_jobs))
+        try:
+            while not self.stopping or len(self.running) > 0:
+                if not self.stopping:
+                    self.scan()
+                    self.dispatch()
+                self.collect(self.poll_seconds)
+        finally:
+            for _, executor in self.running.values():
+                executor.shutdown()
+
+
+def printJobs(jobs):
+    columns = ["id", "state", "priority", "attempts", "serial_id", "passed", "folder", "error"]
+    print("  ".join("{:<10}".format(column) for column in columns))
+    for job in jobs:
+        print("  ".join("{:<10}".format("-" if job[column] is None else str(job[column])) for column in columns))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs a barscan for every verification folder copied into an ingest folder")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    watch = commands.add_parser("watch", help="watch the ingest folder and run the queue")
+    watch.add_argument("ingest_folder")
+    watch.add_argument("--calibration", required=True, help="calibration folder (AgisoftParams)")
+    watch.add_argument("--workers", type=int, default=1)
+    watch.add_argument("--fixture", default=DEFAULT_FIXTURE)
+    watch.add_argument("--filter-preset", default=DEFAULT_FILTER_PRESET)
+    watch.add_argument("--stable-seconds", type=float, default=DEFAULT_STABLE_SECONDS)
+    watch.add_argument("--poll-seconds", type=float, default=DEFAULT_POLL_SECONDS)
+    watch.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+    watch.add_argument("--retry-seconds", type=float, default=DEFAULT_RETRY_SECONDS)
+
+    enqueue = commands.add_parser("enqueue", help="queue a folder now, without waiting for it to be stable")
+    enqueue.add_argument("folder")
+    enqueue.add_argument("--priority", type=int, default=10)
+    enqueue.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    retry = commands.add_parser("retry", help="put a job back in the queue")
+    retry.add_argument("job_id", type=int)
+    retry.add_argument("--priority", type=int, default=None)
+
+    status = commands.add_parser("status", help="the queue and the latest jobs")
+    status.add_argument("--state", choices=JOB_STATES, nargs="+", default=None)
+    status.add_argument("--limit", type=int, default=50)
+
+    args = parser.parse_args(argv)
+    queue = JobQueue(args.queue)
+
+    if args.command == "watch":
+        BarscanWatcher(args.ingest_folder, args.calibration, queue, n_jobs=args.workers, fixture_id=args.fixture,
+                       filter_preset=args.filter_preset, stable_seconds=args.stable_seconds, poll_seconds=args.poll_seconds,
+                       max_attempts=args.max_attempts, retry_seconds=args.retry_seconds).run()
+    elif args.command == "enqueue":
+        if not os.path.isdir(args.folder):
+            raise Exception("Verification folder {} does not exist".format(args.folder))
+        queue.enqueue(args.folder, priority=args.priority, max_attempts=args.max_attempts)
+    elif args.command == "retry":
+        queue.retry(args.job_id, args.priority)
+    elif args.command == "status":
+        print(", ".join("{} {}".format(count, state) for state, count in queue.counts().items()))
+        printJobs(queue.jobs(args.state, args.limit))
+
+    queue.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])